@@ -1,38 +1,192 @@
 # 2_train_model.py
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
 import pandas as pd
 import xgboost as xgb
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
-import joblib
-import os
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+
+import grid_store
+import model_registry
+import static_features
+import variables
+from inference import FEATURES
+
+TARGET = 'thon_present'
+DATASET_STEM = 'data/dataset'            # Historique initial (.parquet, ou l'ancien .csv)
+OBSERVATIONS_DIR = 'data/observations'   # Nouvelles observations ajoutées au fil des jours, un fichier par lot
+BATCH_ROWS = 65536          # Lignes lues par lot : l'historique n'est jamais chargé en entier
+HOLDOUT_FRACTION = 0.2
+HOLDOUT_MAX_ROWS = 200000   # Borne la mémoire du jeu d'évaluation
+FULL_ROUNDS = 100           # Arbres d'un entraînement complet (n_estimators par défaut de XGBClassifier)
+INCREMENTAL_ROUNDS = 20     # Arbres ajoutés à chaque mise à jour
+PROMOTION_TOLERANCE = 0.02  # Une mise à jour n'est servie que si sa logloss ne dépasse pas celle du parent de plus de 2 %
+PARAMS = {'objective': 'binary:logistic', 'eval_metric': 'logloss', 'tree_method': 'hist', 'seed': 42}
+
+
+def training_sources() -> list[str]:
+    """Fichiers d'entraînement : l'historique initial puis les observations, dans l'ordre d'arrivée."""
+    sources = []
+    try:
+        sources.append(grid_store.resolve_path(DATASET_STEM, (grid_store.PARQUET_EXTENSION, grid_store.CSV_EXTENSION)))
+    except FileNotFoundError:
+        pass
+    for ext in (grid_store.PARQUET_EXTENSION, grid_store.ARROW_EXTENSION, grid_store.CSV_EXTENSION):
+        sources.extend(glob.glob(os.path.join(OBSERVATIONS_DIR, f"*{ext}")))
+    return sources[:1] + sorted(sources[1:])
+
+
+class TrainingBatches(xgb.DataIter):
+    """
+    Itérateur de lots pour XGBoost : chaque fichier est relu par lots à chaque passe, sans être chargé en entier
+    (QuantileDMatrix ne garde que les valeurs quantifiées). Une part fixe de chaque lot est réservée à
+    l'évaluation, de façon déterministe pour que toutes les passes voient le même découpage.
+    """
+
+    def __init__(self, sources: list[str], batch_size: int = BATCH_ROWS, seed: int = 42):
+        self.sources = sources
+        self.batch_size = batch_size
+        self.seed = seed
+        self.holdout_X, self.holdout_y = [], []
+        self.rows_train = self.rows_holdout = self.rows_skipped = 0
+        self._batches = None
+        self._first_pass = True
+        super().__init__()
+
+    def _split_batches(self):
+        index = 0
+        for path in self.sources:
+            # Observations écrites sur la grille du pipeline : variables statiques rejointes par cell_id
+            static_df = static_features.read_static_store(grid_store.read_metadata(path))
+            for batch in grid_store.iter_table(path, batch_size=self.batch_size):
+                if static_df is not None:
+                    batch = static_features.attach_static_features(batch, static_df)
+                valid = variables.valid_rows(batch, FEATURES) & batch[TARGET].notna().to_numpy()
+                rng = np.random.default_rng([self.seed, index])
+                holdout = rng.random(len(batch)) < HOLDOUT_FRACTION
+                index += 1
+                if self._first_pass:
+                    self.rows_skipped += int((~valid).sum())
+                    kept = valid & holdout
+                    if self.rows_holdout < HOLDOUT_MAX_ROWS and kept.any():
+                        self.holdout_X.append(batch.loc[kept, FEATURES].astype(np.float32))
+                        self.holdout_y.append(batch.loc[kept, TARGET].to_numpy(dtype=np.int8))
+                        self.rows_holdout += int(kept.sum())
+                    self.rows_train += int((valid & ~holdout).sum())
+                train = valid & ~holdout
+                if train.any():
+                    yield batch.loc[train, FEATURES].astype(np.float32), batch.loc[train, TARGET].to_numpy(dtype=np.float32)
+
+    def reset(self):
+        if self._batches is not None:
+            self._first_pass = False
+        self._batches = None
+
+    def next(self, input_data) -> bool:
+        if self._batches is None:
+            self._batches = self._split_batches()
+        batch = next(self._batches, None)
+        if batch is None:
+            return False
+        input_data(data=batch[0], label=batch[1])
+        return True
+
+    def holdout(self):
+        if not self.holdout_X:
+            return None
+        return pd.concat(self.holdout_X, ignore_index=True), np.concatenate(self.holdout_y)
+
+
+def evaluate(booster: xgb.Booster, X, y) -> dict:
+    scores = booster.inplace_predict(X.to_numpy())
+    metrics = {"accuracy": float(accuracy_score(y, scores >= 0.5)), "logloss": float(log_loss(y, scores, labels=[0, 1]))}
+    if len(np.unique(y)) == 2:
+        metrics["auc"] = float(roc_auc_score(y, scores))
+    return metrics
+
 
-print("\nÉtape 2: Entraînement du modèle IA en cours...")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Entraînement du modèle Thonia (incrémental par défaut).")
+    parser.add_argument('--full', action='store_true', help="Réentraîner depuis zéro sur tout l'historique.")
+    parser.add_argument('--rounds', type=int, help="Nombre d'arbres à entraîner (défaut : 100 en complet, 20 en incrémental).")
+    parser.add_argument('--batch-size', type=int, default=BATCH_ROWS, help="Lignes lues par lot.")
+    parser.add_argument('--promote', action='store_true', help="Servir la nouvelle version même si elle est moins bonne que la précédente.")
+    args = parser.parse_args()
 
-try:
-    df = pd.read_csv('data/dataset.csv')
-except FileNotFoundError:
-    print("❌ Erreur: Le fichier 'data/dataset.csv' n'a pas été trouvé. Lancez '1_simulate_data.py' d'abord.")
-    exit()
+    print("\nÉtape 2: Entraînement du modèle IA en cours...")
 
-features = ['latitude', 'longitude', 'temp_surface_c', 'chlorophylle_mg_m3', 'vent_noeuds']
-target = 'thon_present'
+    sources = training_sources()
+    if not sources:
+        print("❌ Erreur: Le fichier 'data/dataset.parquet' (ou 'data/dataset.csv') n'a pas été trouvé. Lancez '1_simulate_data.py' d'abord.")
+        exit()
 
-X = df[features]
-y = df[target]
+    parent_version = None if args.full else model_registry.current_version()
+    seen_sources = {}
+    if parent_version is not None:
+        # Mise à jour : seuls les fichiers nouveaux ou modifiés depuis la version courante sont lus.
+        seen_sources = model_registry.load_metadata(parent_version).get("sources", {})
+        signatures = {path: model_registry.source_signature(path) for path in sources}
+        new_sources = [path for path in sources if seen_sources.get(path) != signatures[path]]
+        changed = [path for path in new_sources if path in seen_sources]
+        if changed:
+            print(f"⚠️ Fichier(s) modifié(s) depuis {parent_version}, relus en entier : {', '.join(changed)} (utilisez --full pour repartir de zéro).")
+        if not new_sources:
+            print(f"✅ Aucune nouvelle donnée depuis {parent_version} : modèle inchangé.")
+            exit()
+        parent_booster = model_registry.load_booster(parent_version)
+        print(f"-> Mise à jour de {parent_version} avec {len(new_sources)} nouveau(x) fichier(s).")
+    else:
+        new_sources = sources
+        parent_booster = None
+        print(f"-> Entraînement complet sur {len(new_sources)} fichier(s).")
+    rounds = args.rounds or (INCREMENTAL_ROUNDS if parent_booster is not None else FULL_ROUNDS)
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    started = time.perf_counter()
+    batches = TrainingBatches(new_sources, batch_size=args.batch_size)
+    try:
+        dtrain = xgb.QuantileDMatrix(batches)
+    except xgb.core.XGBoostError as e:
+        print(f"❌ Erreur: aucune ligne exploitable dans les nouvelles données ({e}).")
+        exit()
+    if batches.rows_skipped:
+        print(f"⚠️ {batches.rows_skipped} ligne(s) ignorée(s) : valeurs manquantes ou hors plage.")
+    holdout = batches.holdout()
+    # Évaluation du parent sur les mêmes lignes, avant qu'il ne serve de point de départ
+    parent_metrics = evaluate(parent_booster, *holdout) if holdout and parent_booster is not None else None
 
-model = xgb.XGBClassifier(objective='binary:logistic', use_label_encoder=False, eval_metric='logloss')
-model.fit(X_train, y_train)
+    # Entraînement continu : les nouveaux arbres s'ajoutent à ceux du parent (coût proportionnel aux nouvelles lignes)
+    booster = xgb.train(PARAMS, dtrain, num_boost_round=rounds, xgb_model=parent_booster)
+    train_seconds = time.perf_counter() - started
 
-y_pred = model.predict(X_test)
-accuracy = accuracy_score(y_test, y_pred)
-print(f"Performance du modèle (Accuracy) : {accuracy:.2f}")
+    metrics = evaluate(booster, *holdout) if holdout else None
+    if metrics:
+        comparison = f" (parent: {parent_metrics['logloss']:.4f})" if parent_metrics else ""
+        print(f"Performance du modèle (Accuracy) : {metrics['accuracy']:.2f}, logloss {metrics['logloss']:.4f}{comparison}")
 
-if not os.path.exists('models'):
-    os.makedirs('models')
-    
-model_path = 'models/thonia_model.joblib'
-joblib.dump(model, model_path)
+    promote = args.promote or parent_metrics is None or metrics is None or metrics['logloss'] <= parent_metrics['logloss'] * (1 + PROMOTION_TOLERANCE)
+    version = model_registry.publish(booster, {
+        "parent": parent_version,
+        "mode": "incremental" if parent_booster is not None else "full",
+        "rounds_added": rounds,
+        "total_rounds": booster.num_boosted_rounds(),
+        "features": FEATURES,
+        "params": PARAMS,
+        "new_sources": new_sources,
+        "sources": {**seen_sources, **{path: model_registry.source_signature(path) for path in new_sources}},
+        "rows_train": batches.rows_train,
+        "rows_holdout": batches.rows_holdout,
+        "rows_skipped": batches.rows_skipped,
+        "train_seconds": round(train_seconds, 3),
+        "metrics": metrics,
+        "parent_metrics": parent_metrics,
+    }, make_current=promote)
 
-print(f"✅ Modèle IA entraîné et sauvegardé dans '{model_path}'.")
\ No newline at end of file
+    print(f"-> {batches.rows_train} lignes d'entraînement, {booster.num_boosted_rounds()} arbres au total, {train_seconds:.1f}s.")
+    if promote:
+        print(f"✅ Modèle IA entraîné et publié : {model_registry.version_dir(version)} (version servie).")
+    else:
+        print(f"⚠️ {version} enregistrée mais non servie : moins bonne que {parent_version} sur les nouvelles données. "
+              f"Pour la servir quand même : relancer avec --promote ou appeler model_registry.set_current('{version}').")
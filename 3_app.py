@@ -1,85 +1,294 @@
 # 3_app.py
+import gzip
+import json
 import os
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-import pandas as pd
-import joblib
 import google.generativeai as genai
 from google.api_core import exceptions # Important: Assurez-vous que cet import est présent
+from chat_cache import ChatResponseCache
+from chat_service import ChatOverloaded, ChatService, ChatTimeout, FakeLLM, GeminiLLM
+from grid_raster import MAX_TILE_ZOOM, TILE_FORMATS
+from prediction_cache import PAYLOAD_FORMATS, LEGACY_FORMAT, PredictionCache
+from spatial_index import DEFAULT_NEAR_RADIUS_KM, LAT_RANGE, LON_RANGE, MAX_NEAR_RADIUS_KM, MAX_TOP_K
 
 # --- CONFIGURATION DE LA CLÉ API GEMINI ---
 VOTRE_CLE_GEMINI_API = "xxxx" # <-- METTEZ VOTRE CLÉ API ICI
+# THONIA_LLM_BACKEND=fake : LLM local factice (tests, mesures de charge), sans clé ni quota.
+LLM_BACKEND = os.getenv("THONIA_LLM_BACKEND", "gemini")
 
-if not VOTRE_CLE_GEMINI_API or "AIzaSy" not in VOTRE_CLE_GEMINI_API:
-    print("❌ ERREUR: Votre clé API Gemini semble incorrecte ou manquante.")
-    exit()
+if LLM_BACKEND == "fake":
+    print("⚠️ LLM factice activé (THONIA_LLM_BACKEND=fake) : les réponses du chat sont des réponses de test.")
+    llm = FakeLLM(latency_s=float(os.getenv("THONIA_FAKE_LLM_LATENCY", "0.2")))
+else:
+    if not VOTRE_CLE_GEMINI_API or "AIzaSy" not in VOTRE_CLE_GEMINI_API:
+        print("❌ ERREUR: Votre clé API Gemini semble incorrecte ou manquante.")
+        exit()
+
+    genai.configure(api_key=VOTRE_CLE_GEMINI_API)
+    # On utilise gemini-1.0-pro, qui a souvent un quota séparé et est très stable.
+    gemini_model = genai.GenerativeModel('gemini-1.0-pro')
+    llm = GeminiLLM(gemini_model)
 
-genai.configure(api_key=VOTRE_CLE_GEMINI_API)
-# On utilise gemini-1.0-pro, qui a souvent un quota séparé et est très stable.
-gemini_model = genai.GenerativeModel('gemini-1.0-pro')
+# Appels LLM sur un pool borné (délai par appel, file d'attente limitée) : un chat lent ou saturé
+# n'immobilise pas les threads qui servent la carte.
+chat_service = ChatService(llm)
+# Réponses déjà générées pour les données du jour (questions identiques ou très proches) : pas de nouvel appel LLM.
+chat_cache = ChatResponseCache()
 
 print("\nÉtape 3: Démarrage du serveur Flask (API)...")
 app = Flask(__name__)
 CORS(app) 
 
 # --- PARTIE 1 : CHARGEMENT DES DONNÉES ET MODÈLE ---
+MODEL_PATH = 'models/thonia_model.joblib'
+DAILY_DATA_STEM = 'data/daily_data' # Dernière grille publiée par data_pipeline.py (.arrow, ou l'ancien .csv à défaut)
+FORECAST_STEM = 'data/forecast' # Cube de prévision multi-jours (data_pipeline.py --forecast-days N), optionnel
+# Jeton requis par /api/admin/reload (l'endpoint est désactivé s'il n'est pas défini)
+ADMIN_TOKEN = os.getenv("THONIA_ADMIN_TOKEN")
+
 try:
-    model = joblib.load('models/thonia_model.joblib')
-    daily_df = pd.read_csv('data/daily_data.csv')
-    print("✅ Données du jour (daily_data.csv) chargées.")
+    # La grille est scorée une seule fois ici, puis à chaque nouveau fichier du pipeline
+    # ou nouveau modèle, en tâche de fond et sans redémarrer le serveur.
+    predictions_cache = PredictionCache(MODEL_PATH, DAILY_DATA_STEM, FORECAST_STEM)
+    print(f"✅ Données du jour ({os.path.basename(predictions_cache.snapshot.signature[1][0])}) chargées.")
 except FileNotFoundError:
     print("❌ ERREUR: Fichiers de données ou de modèle non trouvés. Lancez 'data_pipeline.py'.")
     exit()
 
+# État exposé à la sonde de disponibilité (passe à False pendant l'arrêt d'un worker)
+serving_state = {"ready": True}
+
+def start_background_tasks():
+    """
+    Lance la surveillance des fichiers. À appeler dans le processus qui sert les requêtes :
+    avec gunicorn, après le fork de chaque worker (voir gunicorn.conf.py), car un thread
+    démarré avant le fork n'existe pas dans les workers.
+    """
+    predictions_cache.start_watcher()
+
+def stop_background_tasks():
+    serving_state["ready"] = False
+    predictions_cache.stop_watcher()
+
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    return jsonify({"status": "ok"})
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    # Prêt = données et modèle chargés, et worker pas en cours d'arrêt.
+    snapshot = predictions_cache.snapshot
+    if not serving_state["ready"] or snapshot is None:
+        return jsonify({"status": "unavailable"}), 503
+    return jsonify({"status": "ready", "version": snapshot.version, "points": len(snapshot.daily_df), "model": snapshot.signature[0][0], "dates": snapshot.dates(), "pid": os.getpid()})
+
+@app.route('/api/admin/reload', methods=['POST'])
+def reload_data():
+    # Force la prise en compte d'une nouvelle grille ou d'un nouveau modèle (sinon, délai de surveillance).
+    if not ADMIN_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "Accès refusé"}), 403
+    reloaded = predictions_cache.reload(force=request.args.get('force') == '1')
+    snapshot = predictions_cache.snapshot
+    status = 500 if predictions_cache.last_error else 200
+    return jsonify({"reloaded": reloaded, "version": snapshot.version, "error": predictions_cache.last_error}), status
+
 # --- PARTIE 2 : PRÉDICTIONS POUR LA CARTE ---
+def _json_response(body, etag, gzip_body=None):
+    """Réponse JSON avec ETag/If-None-Match et compression gzip si le client l'accepte."""
+    # Qualité de gzip dans Accept-Encoding ('gzip;q=0' le refuse). Chaque représentation a son propre ETag
+    # fort (suffixe -gz pour la version gzip) : les caches et les requêtes Range ne les confondent pas.
+    use_gzip = request.accept_encodings['gzip'] > 0
+    if use_gzip:
+        etag = f"{etag}-gz"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    elif use_gzip:
+        response = Response(gzip_body or gzip.compress(body, compresslevel=6, mtime=0), mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _parse_floats(name, ranges):
+    """Valeurs séparées par des virgules, une par plage (min, max) de `ranges`."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    numbers = [float(v) for v in value.split(',')]
+    if len(numbers) != len(ranges):
+        raise ValueError(f"'{name}' attend {len(ranges)} valeurs séparées par des virgules")
+    # float() accepte 'nan', 'inf' et 1e308 : hors plage (nan compris), la valeur est refusée
+    for number, (low, high) in zip(numbers, ranges):
+        if not low <= number <= high:
+            raise ValueError(f"'{name}' : {number} hors de [{low:g}, {high:g}] (latitudes dans [-90, 90], longitudes dans [-180, 180])")
+    return numbers
+
+def _snapshot_for_request():
+    """Snapshot du jour demandé par ?date=AAAA-MM-JJ (grille du jour par défaut), ou réponse 404."""
+    snapshot = predictions_cache.snapshot
+    date = request.args.get('date')
+    if date is None:
+        return snapshot, None
+    day = snapshot.for_date(date)
+    if day is None:
+        return None, (jsonify({"error": f"Aucune prévision pour le {date}", "dates": snapshot.dates()}), 404)
+    return day, None
+
 @app.route('/api/predictions', methods=['GET'])
 def get_predictions():
-    # ... (cette partie est inchangée et correcte)
-    features_for_prediction = daily_df[['latitude', 'longitude', 'temp_surface_c', 'chlorophylle_mg_m3', 'vent_noeuds']]
-    predictions_proba = model.predict_proba(features_for_prediction)[:, 1]
-    results = []
-    for index, row in daily_df.iterrows():
-        results.append({
-            'lat': row['latitude'], 'lon': row['longitude'],
-            'prediction_score': round(float(predictions_proba[index]), 2),
-            'details': { 'Température': f"{row['temp_surface_c']:.1f}°C", 'Vent': f"{row['vent_noeuds']:.0f} noeuds" }
-        })
-    return jsonify(results)
+    # Réponse servie directement depuis la mémoire : pas d'inférence par requête.
+    # ?format=columnar renvoie des tableaux parallèles lat/lon/score, plus légers que la liste d'objets.
+    fmt = request.args.get('format', LEGACY_FORMAT)
+    if fmt not in PAYLOAD_FORMATS:
+        return jsonify({"error": f"Format inconnu: {fmt}"}), 400
+
+    # Filtres spatiaux servis par l'index de la grille :
+    # ?bbox=lon_min,lat_min,lon_max,lat_max  ?near=lat,lon&radius_km=55  ?top=20 (meilleurs scores d'abord)
+    try:
+        bbox = _parse_floats('bbox', (LON_RANGE, LAT_RANGE, LON_RANGE, LAT_RANGE))
+        near = _parse_floats('near', (LAT_RANGE, LON_RANGE))
+        radius_km = request.args.get('radius_km', DEFAULT_NEAR_RADIUS_KM, type=float)
+        top = request.args.get('top', type=int)
+    except ValueError as e:
+        return jsonify({"error": f"Paramètre invalide: {e}"}), 400
+    if top is not None and not 0 < top <= MAX_TOP_K:
+        return jsonify({"error": f"'top' doit être compris entre 1 et {MAX_TOP_K}"}), 400
+    if not 0 < radius_km <= MAX_NEAR_RADIUS_KM:
+        return jsonify({"error": f"'radius_km' doit être compris entre 0 (exclu) et {MAX_NEAR_RADIUS_KM:g}"}), 400
+
+    # Un seul snapshot par requête : un rechargement concurrent ne peut pas mélanger deux versions.
+    # ?date=AAAA-MM-JJ sert un jour de la prévision, préparé à l'avance comme la grille du jour.
+    snapshot, error = _snapshot_for_request()
+    if error is not None:
+        return error
+    if bbox is None and near is None and top is None:
+        payload = snapshot.get(fmt)
+        return _json_response(payload.body, payload.etag, payload.gzip_body)
+    body, etag = snapshot.query(fmt, bbox=bbox, near=near, radius_km=radius_km, top=top)
+    return _json_response(body, etag)
+
+@app.route('/api/tiles/<int:z>/<int:x>/<int:y>.<fmt>', methods=['GET'])
+def get_prediction_tile(z, x, y, fmt):
+    # Tuiles z/x/y (Web Mercator, 256 px) pour les grilles haute résolution :
+    # .png = score quantifié sur 8 bits, .f16 = scores float16 bruts avec un petit en-tête.
+    if fmt not in TILE_FORMATS:
+        return jsonify({"error": f"Format de tuile inconnu: {fmt}"}), 400
+    if z > MAX_TILE_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return jsonify({"error": "Coordonnées de tuile invalides"}), 400
+    snapshot, error = _snapshot_for_request()
+    if error is not None:
+        return error
+    tile, etag = snapshot.get_tile(z, x, y, fmt)
+    mimetype = 'image/png' if fmt == 'png' else 'application/octet-stream'
+    response = Response(tile, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 # --- PARTIE 3 : CHATBOT PROPULSÉ PAR GEMINI ---
+BUSY_REPLY = "Désolé, ThonIA est très demandé en ce moment ! 😅 Veuillez réessayer dans une minute."
+TIMEOUT_REPLY = "Désolé, ThonIA met trop de temps à répondre... ⏳ Veuillez réessayer."
+ERROR_REPLY = "Désolé, une erreur est survenue avec l'assistant IA."
+
+def _chat_error(e):
+    """Réponse (message, statut HTTP) pour une erreur du chat."""
+    if isinstance(e, ChatOverloaded):
+        return BUSY_REPLY, 429
+    if isinstance(e, exceptions.ResourceExhausted):
+        print(f"Quota Gemini dépassé: {e}")
+        return BUSY_REPLY, 429
+    if isinstance(e, ChatTimeout):
+        print("Délai dépassé lors de l'appel au LLM.")
+        return TIMEOUT_REPLY, 504
+    print(f"Erreur lors de l'appel à l'API Gemini: {e}")
+    return ERROR_REPLY, 500
+
+def _chat_error_response(e):
+    reply, status = _chat_error(e)
+    response = jsonify({"reply": reply})
+    if status == 429:
+        response.headers['Retry-After'] = '30'
+    return response, status
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 def chat_with_ia():
     user_message = request.json.get('message')
     if not user_message: 
         return jsonify({"error": "Message manquant"}), 400
 
-    # Le prompt est créé AVANT le bloc try
-    avg_temp = daily_df['temp_surface_c'].mean()
-    avg_wind = daily_df['vent_noeuds'].mean()
+    # Le prompt est créé AVANT le bloc try.
+    # Le contexte du jour (conditions, marées, zones prometteuses) est préparé une fois par snapshot.
+    snapshot = predictions_cache.snapshot
     
     full_prompt = (
         "Contexte : Tu es ThonIA, un expert de la pêche au thon dans le Golfe de Gascogne. "
         "Tu es amical, concis et précis. Tes réponses doivent aider les pêcheurs. "
         "Utilise des emojis liés à la mer 🎣🐟🌊☀️. "
-        f"Les conditions réelles aujourd'hui sont : température moyenne de l'eau de {avg_temp:.1f}°C et vent moyen de {avg_wind:.0f} noeuds. "
+        f"Les conditions aujourd'hui : {snapshot.prompt_context} "
         "Les zones les plus prometteuses sont visibles en rouge/orange sur la carte de l'utilisateur. "
+        "Si certaines sources sont simulées, signale-le brièvement. "
         f"Question de l'utilisateur : \"{user_message}\"\n\n"
         "Ta réponse :"
     )
 
-    try:
-        response = gemini_model.generate_content(full_prompt)
-        bot_response = response.text
+    # Accept: text/event-stream (ou ?stream=1) : la réponse arrive au fil de l'eau en Server-Sent Events.
+    # Sans cela, on garde l'ancienne réponse JSON {"reply": ...}.
+    wants_stream = request.args.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+    cached_reply = chat_cache.get(snapshot.version, user_message)
+    if cached_reply is not None:
+        if not wants_stream:
+            return jsonify({"reply": cached_reply})
+        response = Response([_sse({"delta": cached_reply}), _sse({}, event="done")], mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    if not wants_stream:
+        try:
+            bot_response = chat_service.ask(full_prompt)
+        except Exception as e:
+            return _chat_error_response(e)
+        chat_cache.put(snapshot.version, user_message, bot_response)
         return jsonify({"reply": bot_response})
-        
-    except exceptions.ResourceExhausted as e:
-        print(f"Quota Gemini dépassé: {e}")
-        return jsonify({"reply": "Désolé, ThonIA est très demandé en ce moment ! 😅 Veuillez réessayer dans une minute."}), 429
 
+    try:
+        # Les refus (file pleine, quota) et les erreurs avant le premier fragment gardent leur statut HTTP.
+        chunks = chat_service.stream(full_prompt)
     except Exception as e:
-        print(f"Erreur lors de l'appel à l'API Gemini: {e}")
-        return jsonify({"reply": "Désolé, une erreur est survenue avec l'assistant IA."}), 500
+        return _chat_error_response(e)
+
+    def generate():
+        try:
+            parts = []
+            for chunk in chunks:
+                parts.append(chunk)
+                yield _sse({"delta": chunk})
+            # Seules les réponses complètes sont mises en cache.
+            chat_cache.put(snapshot.version, user_message, "".join(parts))
+            yield _sse({}, event="done")
+        except Exception as e:
+            reply, _ = _chat_error(e)
+            yield _sse({"reply": reply}, event="error")
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # pas de mise en tampon par un proxy nginx
+    return response
+
+@app.route('/api/chat/metrics', methods=['GET'])
+def chat_metrics():
+    # Compteurs du cache de réponses (par worker) : hits exacts, hits par similarité, misses, évictions.
+    return jsonify(chat_cache.metrics())
 
 if __name__ == '__main__':
-    print("✅ Serveur démarré avec le modèle Gemini.")
+    # Serveur de développement. En production : gunicorn -c gunicorn.conf.py (plusieurs workers).
+    print(f"✅ Serveur démarré avec le modèle {'factice' if LLM_BACKEND == 'fake' else 'Gemini'}.")
+    start_background_tasks()
     app.run(debug=True, port=5000)
@@ -0,0 +1,81 @@
+# bathymetry.py
+import hashlib
+import os
+
+import numpy as np
+
+try:
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_origin
+    from rasterio.vrt import WarpedVRT
+except ImportError: # rasterio absent : bathymétrie simulée (voir data_pipeline.add_bathymetry_to_grid)
+    rasterio = None
+
+BATHY_CACHE_DIR = "data/bathymetry/cache"
+BATHY_CRS = "EPSG:4326"   # Notre grille est en latitude/longitude WGS84
+
+
+def grid_axes(lats: np.ndarray, lons: np.ndarray, resolution: float):
+    """Axes réguliers (latitudes, longitudes croissantes) de la grille et indices ligne/colonne de chaque point."""
+    lat_axis = np.unique(np.asarray(lats, dtype=np.float64))
+    lon_axis = np.unique(np.asarray(lons, dtype=np.float64))
+    n_lat = int(round((lat_axis[-1] - lat_axis[0]) / resolution)) + 1
+    n_lon = int(round((lon_axis[-1] - lon_axis[0]) / resolution)) + 1
+    row = np.rint((np.asarray(lats, dtype=np.float64) - lat_axis[0]) / resolution).astype(np.int64)
+    col = np.rint((np.asarray(lons, dtype=np.float64) - lon_axis[0]) / resolution).astype(np.int64)
+    return (lat_axis[0], lon_axis[0], n_lat, n_lon), row, col
+
+
+def source_signature(tif_path: str) -> str:
+    """Version du GeoTIFF (chemin, taille, date) pour invalider les caches qui en dépendent ; 'absent' sinon."""
+    if not os.path.exists(tif_path):
+        return "absent"
+    stat = os.stat(tif_path)
+    return f"{os.path.abspath(tif_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def _cache_path(tif_path: str, grid_def: tuple, resolution: float, cache_dir: str) -> str:
+    # Clé : grille (origine, taille, résolution) + version du GeoTIFF (taille et date de modification)
+    key = f"{source_signature(tif_path)}|{grid_def[0]:.6f},{grid_def[1]:.6f},{grid_def[2]},{grid_def[3]}|{resolution:.6f}"
+    return os.path.join(cache_dir, f"bathy_{resolution:g}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.npy")
+
+
+def sample_cells(tif_path: str, grid_def: tuple, resolution: float) -> np.ndarray:
+    """
+    Profondeur moyenne de chaque cellule de la grille (n_lat × n_lon, latitudes croissantes).
+    Le GeoTIFF est lu à travers un VRT dont la grille de sortie est exactement la nôtre : GDAL ne lit
+    que la fenêtre couvrant l'emprise, reprojette si besoin et moyenne les pixels de chaque cellule
+    (en s'appuyant sur les overviews du fichier s'il en a). Hors couverture ou à terre (nodata) : NaN.
+    """
+    lat0, lon0, n_lat, n_lon = grid_def
+    west = lon0 - resolution / 2
+    north = lat0 + (n_lat - 0.5) * resolution
+    with rasterio.open(tif_path) as src:
+        with WarpedVRT(src, crs=BATHY_CRS, transform=from_origin(west, north, resolution, resolution),
+                       width=n_lon, height=n_lat, resampling=Resampling.average) as vrt:
+            values = vrt.read(1, masked=True, out_dtype="float32")
+    # Lignes du raster du nord au sud -> latitudes croissantes comme la grille
+    return np.ma.filled(values, np.nan)[::-1]
+
+
+def load_bathymetry(tif_path: str, lats: np.ndarray, lons: np.ndarray, resolution: float, cache_dir: str = BATHY_CACHE_DIR) -> np.ndarray:
+    """
+    Bathymétrie (m, négative sous le niveau de la mer) de chaque point de la grille.
+    Le tableau pré-échantillonné est sauvegardé une fois par (grille, résolution, version du GeoTIFF) ;
+    les runs suivants le relisent en mémoire mappée sans rouvrir le GeoTIFF.
+    """
+    grid_def, row, col = grid_axes(lats, lons, resolution)
+    path = _cache_path(tif_path, grid_def, resolution, cache_dir)
+    if not os.path.exists(path):
+        if rasterio is None:
+            raise ImportError("rasterio est nécessaire pour lire le GeoTIFF EMODnet (pip install rasterio)")
+        cells = sample_cells(tif_path, grid_def, resolution)
+        os.makedirs(cache_dir, exist_ok=True)
+        partial_path = f"{path}.{os.getpid()}.part.npy"
+        np.save(partial_path, cells)
+        os.replace(partial_path, path)
+        print(f"   Bathymétrie pré-échantillonnée ({int(np.isfinite(cells).sum())} cellules en mer) sauvegardée dans {path}")
+    cells = np.load(path, mmap_mode="r")
+    return np.asarray(cells[row, col], dtype=np.float32)
+
@@ -0,0 +1,428 @@
+# benchmark.py
+# Mesures de performance de bout en bout, à plusieurs résolutions de grille :
+#   - pipeline  : grille, bathymétrie + variables statiques, téléchargements (remplacés par des fichiers locaux
+#                 simulés, voir synthetic_data.py), regrillage (à froid puis tables en mémoire), écriture ;
+#   - training  : 2_train_model.py --full sur un jeu simulé (temps, CPU, mémoire maximale du processus) ;
+#   - serving   : /api/predictions et /api/chat sous charge concurrente, LLM factice (THONIA_LLM_BACKEND=fake).
+# Tout tourne dans un dossier temporaire : data/ et models/ du projet ne sont pas touchés.
+# Les résultats sont écrits en JSON et comparés à la référence benchmarks/baseline.json ; le code de sortie est 1
+# si une mesure régresse au-delà de la tolérance.
+# Aucune référence n'est livrée avec le dépôt : les temps n'ont de sens que sur la machine qui les a mesurés.
+# Pour en créer une, sur la machine de référence (celle de la CI de performance), à partir d'un commit sain :
+#   python benchmark.py --save-baseline                   # mêmes options que les runs qui seront comparés
+#   git add benchmarks/baseline.json                      # puis committer la référence
+# Sans référence, les mesures sont seulement enregistrées (code de sortie 0), sauf avec --require-baseline.
+#   python benchmark.py                                   # toutes les étapes, résolutions 0.1, 0.05 et 0.01
+#   python benchmark.py --stages pipeline --resolutions 0.1 0.05
+#   python benchmark.py --require-baseline                # en CI : échoue (code 2) si la référence manque
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+import context_digest
+import data_pipeline
+import grid_store
+import regridding
+import static_features
+from synthetic_data import SyntheticOcean
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(REPO_DIR, "benchmarks")
+RESULTS_PATH = os.path.join(BENCHMARK_DIR, "results.json")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+STAGES = ('pipeline', 'training', 'serving')
+RESOLUTIONS = (0.1, 0.05, 0.01)
+BENCHMARK_DATE = datetime(2024, 6, 1)
+SOURCE_BBOX = (43.0, 48.0, -6.0, 0.0)   # Emprise des fichiers simulés : la zone d'étude et sa marge
+# Produit simulé (synthetic_data.PRODUCTS) servi à la place du téléchargement de chaque source ; les autres échouent
+STUB_PRODUCTS = {'sst': 'sst', 'chl': 'chl', 'cur': 'cur', 'mf_wind': 'wind'}
+REPEAT = 3                   # Mesures en mémoire : meilleur temps sur REPEAT essais
+TRAINING_ROWS = 200000
+PREDICTION_REQUESTS = 200
+CHAT_REQUESTS = 40
+CONCURRENCY = 16
+SERVER_WORKERS = 2
+SERVER_START_TIMEOUT_S = 300  # Le serveur score toute la grille avant d'être prêt
+REGRESSION_TOLERANCE = 0.25   # Écart relatif admis par rapport à la référence
+# Sens de chaque mesure, d'après le suffixe de son nom : plus petit ou plus grand = mieux. Les autres sont informatives.
+LOWER_IS_BETTER = ('_s', '_ms', '_mb')
+HIGHER_IS_BETTER = ('_per_s',)
+
+
+@contextlib.contextmanager
+def working_directory(path: str):
+    """Exécute le bloc dans `path` : les chemins relatifs du projet (data/, models/) y sont créés."""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def stubbed_sources(files: dict):
+    """
+    Remplace le registre data_pipeline.SOURCES le temps du bloc : chaque téléchargement renvoie le fichier
+    local de `files` (NetCDF, d'où open_kwargs retiré) comme donnée réelle, ou échoue sans relance.
+    """
+    original = data_pipeline.SOURCES
+    stubs = {}
+    for name, source in original.items():
+        path = files.get(name)
+        stubs[name] = {**source, 'fetch': lambda *args, path=path, **kwargs: (path, path is not None),
+                       'open_kwargs': None, 'timeout': None, 'retries': 0}
+    data_pipeline.SOURCES = stubs
+    try:
+        yield stubs
+    finally:
+        data_pipeline.SOURCES = original
+
+
+def quietly(fn, *args, **kwargs):
+    """Appelle `fn` sans les messages de progression du pipeline."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def timed(fn, repeat: int = 1) -> tuple[dict, object]:
+    """Meilleur temps (mur et CPU) de `fn` sur `repeat` essais, et le résultat du dernier appel."""
+    best = None
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = quietly(fn)
+        timing = {"wall_s": time.perf_counter() - wall, "cpu_s": time.process_time() - cpu}
+        if best is None or timing["wall_s"] < best["wall_s"]:
+            best = timing
+    return {name: round(value, 4) for name, value in best.items()}, result
+
+
+# --- PIPELINE ---
+def bench_pipeline(resolution: float, repeat: int = REPEAT) -> dict:
+    """Étapes de data_pipeline.py à la résolution donnée (dans le dossier courant). Laisse data/daily_data.arrow pour le serveur."""
+    results = {}
+    results["grid"], grid_df = timed(lambda: data_pipeline.create_grid(resolution=resolution), repeat)
+    results["grid"]["points"] = len(grid_df)
+
+    # Sans GeoTIFF EMODnet : bathymétrie manquante, seules les variables statiques sont calculées
+    def static_grid():
+        bathy_df = data_pipeline.add_bathymetry_to_grid(grid_df.copy(), data_pipeline.EMODNET_BATHYMETRY_FILEPATH, resolution)
+        return static_features.compute_static_features(bathy_df, resolution)
+    results["bathymetry"], static_df = timed(static_grid, repeat)
+    daily_grid = static_df[[static_features.CELL_ID_COLUMN, 'latitude', 'longitude']]
+
+    # Fichiers sources simulés à une résolution au moins aussi fine que la grille (comme les produits CMEMS)
+    ocean = SyntheticOcean(BENCHMARK_DATE, bbox=SOURCE_BBOX, resolution=min(resolution, data_pipeline.FAKE_SOURCE_RESOLUTION))
+    files = {name: ocean.write_netcdf(product, os.path.join("data", "stubs", f"{product}.nc")) for name, product in STUB_PRODUCTS.items()}
+    # Les caches de téléchargement (un par dossier relatif, créés une fois par processus) doivent exister ici aussi
+    for cache_dir in data_pipeline.DOWNLOAD_CACHE_DIRS:
+        os.makedirs(cache_dir, exist_ok=True)
+    with stubbed_sources(files):
+        results["fetch"], fetch_results = timed(lambda: data_pipeline.run_fetch_stage(
+            BENCHMARK_DATE, data_pipeline.LAT_MIN, data_pipeline.LAT_MAX, data_pipeline.LON_MIN, data_pipeline.LON_MAX), repeat)
+        results["fetch"]["source_bytes"] = sum(os.path.getsize(path) for path in files.values())
+
+        # À froid : tables de regrillage calculées et sauvegardées ; à chaud : tables déjà en mémoire
+        def cold_regrid():
+            regridding._regridders.clear()
+            shutil.rmtree(regridding.REGRID_WEIGHTS_DIR, ignore_errors=True)
+            return data_pipeline.project_sources_on_grid(daily_grid, fetch_results, data_pipeline.simulation_rng(BENCHMARK_DATE))
+        results["regrid_cold"], _ = timed(cold_regrid, 1)
+        results["regrid_warm"], daily_df = timed(lambda: data_pipeline.project_sources_on_grid(daily_grid, fetch_results, data_pipeline.simulation_rng(BENCHMARK_DATE)), repeat)
+
+    provenance = data_pipeline.build_provenance(BENCHMARK_DATE, fetch_results)
+    provenance["resolution"] = resolution
+    output_path = data_pipeline.daily_output_path(BENCHMARK_DATE)
+    results["write"], output_path = timed(lambda: grid_store.write_table(daily_df, output_path, metadata=provenance), repeat)
+    results["write"]["bytes"] = os.path.getsize(output_path)
+    results["total_s"] = round(sum(stage["wall_s"] for stage in results.values()), 4)
+
+    # Grille du jour servie par 3_app.py, avec son résumé pour le chat
+    digest = context_digest.build_environment_digest(daily_df, provenance, fetch_results['tide'], data_pipeline.get_moon_phase(BENCHMARK_DATE))
+    context_digest.write_digest(context_digest.digest_path(output_path), digest)
+    quietly(data_pipeline.publish_daily_output, output_path)
+    return results
+
+
+# --- ENTRAÎNEMENT ---
+def bench_training(rows: int = TRAINING_ROWS) -> dict:
+    """2_train_model.py --full dans un sous-processus (dossier courant) : temps, CPU et mémoire maximale (ru_maxrss)."""
+    ocean = SyntheticOcean(BENCHMARK_DATE, days=30)
+    dataset_path = quietly(ocean.write_training_set, os.path.join("data", "dataset.parquet"), rows)
+    # Sortie dans un fichier : os.wait4 (pour ru_maxrss du seul sous-processus) ne lit pas de pipe pendant l'attente
+    with open("train.log", "w+", encoding="utf-8") as log:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "2_train_model.py"), "--full"], stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            log.seek(0)
+            raise RuntimeError(f"2_train_model.py a échoué (code {process.returncode}) :\n{log.read()[-2000:]}")
+    # ru_maxrss : kilo-octets sous Linux, octets sous macOS
+    max_rss_bytes = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "rows": rows,
+        "dataset_bytes": os.path.getsize(dataset_path),
+        "wall_s": round(wall, 4),
+        "cpu_s": round(usage.ru_utime + usage.ru_stime, 4),
+        "max_rss_mb": round(max_rss_bytes / 1e6, 1),
+        "rows_per_s": round(rows / wall),
+    }
+
+
+# --- SERVICE ---
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def running_server(workers: int = SERVER_WORKERS):
+    """
+    Lance 3_app.py sur le dossier courant (gunicorn -c gunicorn.conf.py, ou le serveur Flask multi-thread si
+    gunicorn n'est pas installé), avec le LLM factice, et attend qu'il soit prêt. Renvoie (URL, temps de démarrage).
+    """
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])),
+        "THONIA_LLM_BACKEND": "fake",
+        "THONIA_BIND": f"127.0.0.1:{port}",
+        "THONIA_WORKERS": str(workers),
+        # Questions toutes différentes et pas de recherche approchée : chaque requête chat appelle le LLM
+        "THONIA_CHAT_CACHE_SIMILARITY": "0",
+    }
+    if importlib.util.find_spec("gunicorn") is not None:
+        command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py")]
+    else:
+        command = [sys.executable, "-c", "import wsgi; wsgi.thonia_app.start_background_tasks(); "
+                                         f"wsgi.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Le serveur s'est arrêté au démarrage (code {process.returncode}).")
+            if time.perf_counter() - started > SERVER_START_TIMEOUT_S:
+                raise RuntimeError(f"Serveur non prêt après {SERVER_START_TIMEOUT_S}s.")
+            try:
+                if requests.get(f"{url}/api/health/ready", timeout=1).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+        yield url, time.perf_counter() - started
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def load_test(send, requests_count: int, concurrency: int) -> dict:
+    """
+    Envoie `requests_count` requêtes (`send(session, i)` -> réponse) avec `concurrency` clients en parallèle.
+    Latences en millisecondes (réponse complète), débit en requêtes/s, et nombre de réponses par statut HTTP.
+    """
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = send(session, i).status_code
+        except requests.RequestException:
+            status = "error"
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(requests_count)))
+    wall = time.perf_counter() - started
+    latencies = np.array([latency for latency, status in outcomes if status == 200]) * 1000
+    statuses = {}
+    for _, status in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    results = {"requests": requests_count, "concurrency": concurrency, "statuses": statuses,
+               "requests_per_s": round(requests_count / wall, 2)}
+    if len(latencies):
+        results.update({f"p{q}_ms": round(float(np.percentile(latencies, q)), 2) for q in (50, 95, 99)})
+    return results
+
+
+def bench_serving(prediction_requests: int = PREDICTION_REQUESTS, chat_requests: int = CHAT_REQUESTS,
+                  concurrency: int = CONCURRENCY, workers: int = SERVER_WORKERS) -> dict:
+    """Latence et débit de /api/predictions et /api/chat, serveur lancé sur le dossier courant."""
+    with running_server(workers) as (url, startup):
+        results = {"startup_s": round(startup, 4), "workers": workers}
+        points = requests.get(f"{url}/api/health/ready", timeout=10).json()["points"]
+        results["points"] = points
+        results["predictions"] = load_test(
+            lambda session, i: session.get(f"{url}/api/predictions", timeout=60),
+            prediction_requests, concurrency)
+        results["chat"] = load_test(
+            lambda session, i: session.post(f"{url}/api/chat", json={"message": f"Question {i} : où trouver du thon près de {43.5 + i * 0.01:.2f}N ?"}, timeout=60),
+            chat_requests, concurrency)
+    return results
+
+
+# --- RÉSULTATS ET RÉFÉRENCE ---
+def flatten(results: dict, prefix: str = "") -> dict:
+    """{'pipeline': {'0.1': {'grid': {'wall_s': 1.2}}}} -> {'pipeline/0.1/grid/wall_s': 1.2} (valeurs numériques seulement)."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}/{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list[dict]:
+    """Mesures qui régressent de plus de `tolerance` (écart relatif) par rapport à la référence."""
+    current, reference = flatten(results), flatten(baseline)
+    regressions = []
+    for name, value in current.items():
+        base = reference.get(name)
+        if not base:
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            change = (base - value) / base
+        elif name.endswith(LOWER_IS_BETTER):
+            change = (value - base) / base
+        else:
+            continue
+        if change > tolerance:
+            regressions.append({"metric": name, "baseline": base, "current": value, "change": round(change, 3)})
+    return regressions
+
+
+def host_info() -> dict:
+    return {"platform": platform.platform(), "machine": platform.machine(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def write_json(path: str, payload: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial_path = f"{path}.{os.getpid()}.part"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    os.replace(partial_path, path)
+
+
+def run(args) -> dict:
+    results = {stage: {} for stage in args.stages}
+    with tempfile.TemporaryDirectory(prefix="thonia-bench-") as workdir, working_directory(workdir):
+        if 'training' in args.stages:
+            print(f"-> Entraînement ({args.rows} lignes)...")
+            results['training'] = bench_training(args.rows)
+            print(f"   {results['training']['wall_s']:.1f}s, {results['training']['max_rss_mb']:.0f} Mo max")
+        for resolution in args.resolutions:
+            key = f"{resolution:g}"
+            # Un dossier par résolution : tables de regrillage et grille servie propres à cette grille
+            resolution_dir = os.path.join(workdir, f"res_{key}")
+            os.makedirs(resolution_dir)
+            with working_directory(resolution_dir):
+                if 'training' in args.stages:
+                    shutil.copytree(os.path.join(workdir, "models"), "models")
+                if 'pipeline' in args.stages or 'serving' in args.stages:
+                    print(f"-> Pipeline à {key}°...")
+                    pipeline = bench_pipeline(resolution, args.repeat)
+                    if 'pipeline' in args.stages:
+                        results['pipeline'][key] = pipeline
+                        print(f"   {pipeline['grid']['points']} points, {pipeline['total_s']:.2f}s")
+                if 'serving' in args.stages:
+                    if not os.path.isdir("models"):
+                        print(f"   ⚠️ Service à {key}° ignoré : aucun modèle (ajoutez l'étape 'training').")
+                        continue
+                    print(f"-> Service à {key}°...")
+                    serving = bench_serving(args.requests, args.chat_requests, args.concurrency, args.workers)
+                    results['serving'][key] = serving
+                    print(f"   /api/predictions p95 {serving['predictions'].get('p95_ms', float('nan')):.0f} ms, "
+                          f"/api/chat p95 {serving['chat'].get('p95_ms', float('nan')):.0f} ms")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks ThonIA (pipeline, entraînement, service) comparés à une référence.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Étapes mesurées.")
+    parser.add_argument("--resolutions", nargs="+", type=float, default=list(RESOLUTIONS), help="Résolutions de grille (degrés).")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Essais par mesure du pipeline (meilleur temps retenu).")
+    parser.add_argument("--rows", type=int, default=TRAINING_ROWS, help="Lignes du jeu d'entraînement simulé.")
+    parser.add_argument("--requests", type=int, default=PREDICTION_REQUESTS, help="Requêtes /api/predictions par résolution.")
+    parser.add_argument("--chat-requests", type=int, default=CHAT_REQUESTS, help="Requêtes /api/chat par résolution.")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Clients simultanés.")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Workers gunicorn du serveur mesuré.")
+    parser.add_argument("--output", default=RESULTS_PATH, help="Fichier JSON des résultats.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Référence à laquelle comparer les résultats.")
+    parser.add_argument("--save-baseline", action="store_true", help="Enregistre les résultats comme nouvelle référence.")
+    parser.add_argument("--require-baseline", action="store_true", help="Échoue (code 2) si la référence est absente.")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="Régression relative tolérée (0.25 = 25 %%).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    output, baseline_path = os.path.abspath(args.output), os.path.abspath(args.baseline)
+    if args.require_baseline and not args.save_baseline and not os.path.exists(baseline_path):
+        print(f"❌ Aucune référence ({baseline_path}) : créez-la avec --save-baseline sur la machine de référence.")
+        return 2
+    started = datetime.now()
+    results = run(args)
+    report = {
+        "created": started.isoformat(timespec="seconds"),
+        "host": host_info(),
+        "config": {name: getattr(args, name) for name in ("stages", "resolutions", "repeat", "rows", "requests", "chat_requests", "concurrency", "workers")},
+        "results": results,
+    }
+
+    regressions = []
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("host") != report["host"]:
+            print(f"⚠️ Référence mesurée sur une autre machine ({baseline.get('host', {}).get('platform')}) : comparaison indicative.")
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        report["baseline"] = {"path": baseline_path, "created": baseline.get("created"), "tolerance": args.tolerance, "regressions": regressions}
+    write_json(output, report)
+    print(f"✅ Résultats écrits dans {output}")
+    if args.save_baseline:
+        write_json(baseline_path, report)
+        print(f"✅ Nouvelle référence : {baseline_path}")
+    elif not os.path.exists(baseline_path):
+        print(f"-> Aucune référence ({baseline_path}) : relancez avec --save-baseline pour en créer une.")
+    if regressions:
+        print(f"❌ {len(regressions)} régression(s) au-delà de {args.tolerance:.0%} :")
+        for entry in regressions:
+            print(f"  {entry['metric']:<50} {entry['baseline']} -> {entry['current']} (+{entry['change']:.0%})")
+        return 1
+    if "baseline" in report:
+        print("✅ Aucune régression par rapport à la référence.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# chat_cache.py
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+CHAT_CACHE_SIZE = int(os.getenv("THONIA_CHAT_CACHE_SIZE", "512"))      # Nombre de réponses gardées (LRU)
+CHAT_CACHE_TTL_S = float(os.getenv("THONIA_CHAT_CACHE_TTL", "3600"))   # Durée de vie d'une réponse
+# Similarité cosinus minimale (trigrammes de caractères) pour réutiliser la réponse à une question voisine.
+# 0 (défaut) désactive la recherche approchée : seules les questions identiques après normalisation sont servies.
+# Les trigrammes ne distinguent pas « au nord » de « au sud » ni « à 10h » de « à 18h » : à activer en connaissance
+# de cause (ex. 0.92) ; même alors, nombres et directions doivent être identiques dans les deux questions.
+CHAT_CACHE_SIMILARITY = float(os.getenv("THONIA_CHAT_CACHE_SIMILARITY", "0"))
+NGRAM_SIZE = 3
+NGRAM_DIM = 1024  # Dimension du vecteur de trigrammes hachés
+# Mots qui changent le sens d'une question sans presque changer ses trigrammes (après normalize_question)
+DIRECTION_WORDS = frozenset({"nord", "sud", "est", "ouest", "north", "south", "east", "west"})
+
+
+def normalize_question(text: str) -> str:
+    """Minuscules, sans accents ni ponctuation, espaces réduits : « Où pêcher ? » == "ou pecher"."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def key_tokens(normalized: str) -> tuple:
+    """Nombres et mots de direction d'une question normalisée : ils doivent être identiques pour un hit par similarité."""
+    numbers = re.findall(r"\d+", normalized)
+    directions = [word for word in normalized.split() if word in DIRECTION_WORDS]
+    return tuple(sorted(numbers)), tuple(sorted(directions))
+
+
+def ngram_vector(normalized: str) -> np.ndarray:
+    """Sac de trigrammes de caractères haché sur NGRAM_DIM composantes, normé (L2)."""
+    padded = f" {normalized} "
+    vector = np.zeros(NGRAM_DIM, dtype=np.float32)
+    for i in range(max(len(padded) - NGRAM_SIZE + 1, 1)):
+        vector[zlib.crc32(padded[i:i + NGRAM_SIZE].encode("utf-8")) % NGRAM_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class ChatResponseCache:
+    """
+    Cache des réponses du chat, indexé par (version des données du jour, question normalisée).
+    La version change à chaque nouvelle grille ou nouveau modèle : une réponse n'est jamais servie
+    avec un autre contexte que celui pour lequel elle a été générée. Expiration (TTL) et éviction LRU.
+    """
+
+    def __init__(self, maxsize: int = CHAT_CACHE_SIZE, ttl_s: float = CHAT_CACHE_TTL_S, similarity: float = CHAT_CACHE_SIMILARITY):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.similarity = similarity
+        self._entries = OrderedDict()  # (version, question normalisée) -> (réponse, vecteur, expiration, nombres/directions)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def _expire(self, now: float):
+        for key in [key for key, (_, _, expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+            self.stats["expired"] += 1
+
+    def get(self, version: str, question: str) -> str | None:
+        normalized = normalize_question(question)
+        now = time.monotonic()
+        with self._lock:
+            key = (version, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            if self.similarity > 0:
+                self._expire(now)
+                tokens = key_tokens(normalized)
+                candidates = [(k, e) for k, e in self._entries.items() if k[0] == version and e[3] == tokens]
+                if candidates:
+                    scores = np.stack([e[1] for _, e in candidates]) @ ngram_vector(normalized)
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity:
+                        self._entries.move_to_end(candidates[best][0])
+                        self.stats["similar_hits"] += 1
+                        return candidates[best][1][0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, version: str, question: str, reply: str):
+        normalized = normalize_question(question)
+        key = (version, normalized)
+        with self._lock:
+            self._entries[key] = (reply, ngram_vector(normalized), time.monotonic() + self.ttl_s, key_tokens(normalized))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["similar_hits"] + self.stats["misses"]
+            hit_rate = (self.stats["hits"] + self.stats["similar_hits"]) / lookups if lookups else 0.0
+            return {**self.stats, "size": len(self._entries), "hit_rate": round(hit_rate, 3)}
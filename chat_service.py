@@ -0,0 +1,155 @@
+# chat_service.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Limites par processus. Les requêtes admises (en cours + en attente) occupent chacune un thread
+# du serveur : on les garde sous le nombre de threads pour que /api/predictions reste servi
+# même quand le chat est saturé.
+CHAT_MAX_CONCURRENT = int(os.getenv("THONIA_CHAT_CONCURRENCY", "2"))  # appels LLM simultanés
+CHAT_MAX_QUEUE = int(os.getenv("THONIA_CHAT_QUEUE", "2"))             # requêtes en attente d'un appel
+CHAT_TIMEOUT_S = float(os.getenv("THONIA_CHAT_TIMEOUT", "30"))        # délai maximal par appel
+_STREAM_END = object()
+
+
+class ChatOverloaded(Exception):
+    """File d'attente du chat pleine : la requête est refusée immédiatement."""
+
+
+class ChatTimeout(Exception):
+    """Le LLM n'a pas répondu dans le délai imparti."""
+
+
+class GeminiLLM:
+    """Adaptateur autour de `genai.GenerativeModel`."""
+
+    def __init__(self, gemini_model):
+        self.gemini_model = gemini_model
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        return self.gemini_model.generate_content(prompt, request_options={"timeout": timeout}).text
+
+    def stream(self, prompt: str, timeout: float):
+        for chunk in self.gemini_model.generate_content(prompt, stream=True, request_options={"timeout": timeout}):
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeLLM:
+    """
+    LLM local factice (THONIA_LLM_BACKEND=fake) : réponse déterministe, latence réglable.
+    Sert aux tests et aux mesures de charge sans clé API ni quota Gemini.
+    """
+
+    def __init__(self, latency_s: float = 0.2, token_delay_s: float = 0.01):
+        self.latency_s = latency_s
+        self.token_delay_s = token_delay_s
+
+    def _reply(self, prompt: str) -> str:
+        question = prompt.rsplit("Question de l'utilisateur :", 1)[-1].split("\n", 1)[0].strip()
+        return f"🎣 Réponse de test de ThonIA à {question} 🌊 Les zones en rouge/orange sont les plus prometteuses aujourd'hui."
+
+    def generate(self, prompt: str, timeout: float) -> str:
+        time.sleep(min(self.latency_s, timeout))
+        return self._reply(prompt)
+
+    def stream(self, prompt: str, timeout: float):
+        time.sleep(min(self.latency_s, timeout))
+        for word in self._reply(prompt).split(" "):
+            time.sleep(self.token_delay_s)
+            yield word + " "
+
+
+class _Admission:
+    """Place réservée dans le pool du chat ; libérée une seule fois, à la fin réelle de l'appel."""
+
+    def __init__(self, semaphore: threading.Semaphore):
+        self._semaphore = semaphore
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self, *_):
+        with self._lock:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+
+class ChatService:
+    """
+    Exécute les appels LLM sur un pool borné, avec délai par appel et contrôle d'admission :
+    au-delà de `max_concurrent + max_queue` requêtes, les suivantes sont refusées tout de suite
+    (ChatOverloaded) au lieu d'immobiliser des threads du serveur.
+    """
+
+    def __init__(self, llm, max_concurrent: int = CHAT_MAX_CONCURRENT, max_queue: int = CHAT_MAX_QUEUE, timeout_s: float = CHAT_TIMEOUT_S):
+        self.llm = llm
+        self.timeout_s = timeout_s
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="llm")
+        self._slots = threading.BoundedSemaphore(max_concurrent + max_queue)
+
+    def _admit(self) -> _Admission:
+        if not self._slots.acquire(blocking=False):
+            raise ChatOverloaded()
+        return _Admission(self._slots)
+
+    def ask(self, prompt: str) -> str:
+        """Réponse complète. Lève ChatOverloaded, ChatTimeout ou l'erreur du LLM."""
+        admission = self._admit()
+        try:
+            future = self._executor.submit(self.llm.generate, prompt, self.timeout_s)
+        except Exception:
+            admission.release()
+            raise
+        # La place n'est rendue qu'à la fin effective de l'appel, même si on abandonne l'attente.
+        future.add_done_callback(admission.release)
+        try:
+            return future.result(timeout=self.timeout_s)
+        except FutureTimeoutError:
+            raise ChatTimeout()
+
+    def stream(self, prompt: str):
+        """
+        Générateur de fragments de texte. L'admission est vérifiée dès l'appel (avant la réponse HTTP) ;
+        le premier fragment est attendu ici aussi, pour que les erreurs de quota remontent avec le bon statut.
+        """
+        admission = self._admit()
+        chunks = queue.Queue()
+
+        def produce():
+            try:
+                for chunk in self.llm.stream(prompt, self.timeout_s):
+                    chunks.put(chunk)
+                chunks.put(_STREAM_END)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                admission.release()
+
+        try:
+            self._executor.submit(produce)
+        except Exception:
+            admission.release()
+            raise
+        deadline = time.monotonic() + self.timeout_s
+
+        def next_chunk():
+            try:
+                item = chunks.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise ChatTimeout()
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+        first = next_chunk()
+
+        def remaining():
+            item = first
+            while item is not _STREAM_END:
+                yield item
+                item = next_chunk()
+
+        return remaining()
@@ -0,0 +1,215 @@
+# context_digest.py
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+DIGEST_SUFFIX = ".digest.json"
+TOP_CLUSTERS = 5           # Nombre de zones prometteuses décrites au chatbot
+CLUSTER_QUANTILE = 0.9     # Une cellule fait partie d'une zone si son score est dans les 10 % meilleurs
+PROVENANCE_LABELS = {
+    'is_real_sst_data': "température",
+    'is_real_chl_data': "chlorophylle",
+    'is_real_cur_data': "courants",
+    'is_real_mf_wind_data': "vent",
+    'is_real_mf_wave_data': "vagues",
+}
+
+
+def digest_path(grid_path: str) -> str:
+    """Résumé stocké à côté de la grille : data/daily_data_20240601.arrow -> data/daily_data_20240601.digest.json"""
+    return os.path.splitext(grid_path)[0] + DIGEST_SUFFIX
+
+
+def _round(value, digits: int = 2):
+    return None if value is None or not np.isfinite(value) else round(float(value), digits)
+
+
+def _column_stats(values: np.ndarray) -> dict | None:
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return None
+    return {
+        "mean": _round(values.mean()),
+        "min": _round(values.min()),
+        "max": _round(values.max()),
+        "p10": _round(np.percentile(values, 10)),
+        "p90": _round(np.percentile(values, 90)),
+    }
+
+
+def _masked_mean(values: np.ndarray | None, mask: np.ndarray):
+    if values is None:
+        return None
+    values = values[mask]
+    values = values[np.isfinite(values)]
+    return _round(values.mean()) if len(values) else None
+
+
+def _regions(lats: np.ndarray, lons: np.ndarray) -> dict:
+    """Découpe l'emprise de la grille en quatre quarts (masques booléens)."""
+    lat_mid = (lats.min() + lats.max()) / 2
+    lon_mid = (lons.min() + lons.max()) / 2
+    north, east = lats >= lat_mid, lons >= lon_mid
+    return {
+        "Nord-Ouest": north & ~east,
+        "Nord-Est": north & east,
+        "Sud-Ouest": ~north & ~east,
+        "Sud-Est": ~north & east,
+    }
+
+
+def build_environment_digest(grid_df: pd.DataFrame, provenance: dict | None = None, tide: dict | None = None, moon_phase: str | None = None) -> dict:
+    """
+    Partie du résumé qui ne dépend que des données du jour : statistiques SST/CHL globales et
+    par région, vent et vagues, marées, lune et provenance. Calculée une fois par le pipeline.
+    """
+    lats = grid_df['latitude'].to_numpy(dtype=np.float64)
+    lons = grid_df['longitude'].to_numpy(dtype=np.float64)
+    columns = {
+        name: grid_df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        for name in ('temp_surface_c', 'chlorophylle_mg_m3', 'vent_noeuds', 'wave_height_m', 'wave_period_s')
+        if name in grid_df.columns
+    }
+    empty = np.array([], dtype=np.float64)
+    regions = _regions(lats, lons)
+    provenance = provenance or {}
+    return {
+        "date": provenance.get("date"),
+        "provenance": {key: bool(provenance[key]) for key in PROVENANCE_LABELS if key in provenance},
+        "sst": _column_stats(columns.get('temp_surface_c', empty)),
+        "chl": _column_stats(columns.get('chlorophylle_mg_m3', empty)),
+        "regions": {
+            name: {
+                "sst_mean": _masked_mean(columns.get('temp_surface_c'), mask),
+                "chl_mean": _masked_mean(columns.get('chlorophylle_mg_m3'), mask),
+            }
+            for name, mask in regions.items() if mask.any()
+        },
+        "wind": _column_stats(columns.get('vent_noeuds', empty)),
+        "waves": _column_stats(columns.get('wave_height_m', empty)),
+        "wave_period": _column_stats(columns.get('wave_period_s', empty)),
+        "tide": tide,
+        "moon_phase": moon_phase,
+    }
+
+
+def top_clusters(raster, lats: np.ndarray, lons: np.ndarray, scores: np.ndarray, sst: np.ndarray | None = None, n: int = TOP_CLUSTERS) -> list[dict]:
+    """
+    Zones prometteuses : composantes connexes (8-voisinage) des cellules dont le score est dans
+    le quantile CLUSTER_QUANTILE, décrites par leur centre (pondéré par le score), leur taille et leur score.
+    """
+    if len(scores) == 0:
+        return []
+    threshold = np.quantile(scores, CLUSTER_QUANTILE)
+    mask = np.nan_to_num(raster.values, nan=-np.inf) >= threshold
+    labels, count = ndimage.label(mask, structure=np.ones((3, 3), dtype=bool))
+    if count == 0:
+        return []
+    ids = raster.point_id[mask]
+    label = labels[mask]
+    weights = scores[ids]
+    cells = np.bincount(label, minlength=count + 1)
+    weight_sum = np.bincount(label, weights=weights, minlength=count + 1)
+    lat_center = np.bincount(label, weights=weights * lats[ids], minlength=count + 1)
+    lon_center = np.bincount(label, weights=weights * lons[ids], minlength=count + 1)
+    score_max = np.zeros(count + 1)
+    np.maximum.at(score_max, label, weights)
+    if sst is not None:
+        sst_values = sst[ids]
+        valid = np.isfinite(sst_values)
+        sst_sum = np.bincount(label[valid], weights=sst_values[valid], minlength=count + 1)
+        sst_count = np.bincount(label[valid], minlength=count + 1)
+
+    clusters = []
+    # Meilleur score d'abord, puis les zones les plus étendues
+    for k in sorted(range(1, count + 1), key=lambda k: (-score_max[k], -cells[k]))[:n]:
+        clusters.append({
+            "lat": _round(lat_center[k] / weight_sum[k], 3),
+            "lon": _round(lon_center[k] / weight_sum[k], 3),
+            "score_max": _round(score_max[k]),
+            "score_mean": _round(weight_sum[k] / cells[k]),
+            "cells": int(cells[k]),
+            "sst_mean": _round(sst_sum[k] / sst_count[k], 1) if sst is not None and sst_count[k] else None,
+        })
+    return clusters
+
+
+def write_digest(path: str, digest: dict) -> str:
+    partial_path = f"{path}.{os.getpid()}.part"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        json.dump({"created": datetime.now().isoformat(timespec="seconds"), **digest}, f, ensure_ascii=False, indent=2)
+    os.replace(partial_path, path)
+    return path
+
+
+def read_digest(path: str) -> dict | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def find_digest(grid_path: str, provenance: dict | None = None) -> dict | None:
+    """
+    Résumé de la grille servie : celui écrit à côté du fichier, sinon celui du fichier daté écrit par le pipeline
+    (data/daily_data.arrow du 2024-06-01 -> data/daily_data_20240601.digest.json). Un résumé d'un autre jour que
+    la grille (provenance['date']) est ignoré : retourne None et le résumé est recalculé depuis la grille.
+    """
+    date = (provenance or {}).get("date")
+    candidates = [digest_path(grid_path)]
+    if date:
+        stem, ext = os.path.splitext(grid_path)
+        candidates.append(digest_path(f"{stem}_{date.replace('-', '')}{ext}"))
+    for path in candidates:
+        digest = read_digest(path)
+        if digest is not None and (date is None or digest.get("date") == date):
+            return digest
+    return None
+
+
+def _format_coord(lat: float, lon: float) -> str:
+    return f"{abs(lat):.2f}°{'N' if lat >= 0 else 'S'} {abs(lon):.2f}°{'E' if lon >= 0 else 'O'}"
+
+
+def format_prompt_context(digest: dict) -> str:
+    """Texte injecté tel quel dans le prompt du chatbot (construit une fois par snapshot)."""
+    lines = []
+    provenance = digest.get("provenance") or {}
+    if provenance:
+        simulated = [label for key, label in PROVENANCE_LABELS.items() if key in provenance and not provenance[key]]
+        origin = f"sources simulées (non mesurées) : {', '.join(simulated)}" if simulated else "toutes les sources sont réelles"
+        lines.append(f"Données du {digest.get('date') or 'jour'} ({origin}).")
+    sst = digest.get("sst")
+    if sst:
+        regional = ", ".join(f"{name} {r['sst_mean']:.1f}°C" for name, r in (digest.get("regions") or {}).items() if r.get("sst_mean") is not None)
+        lines.append(f"Température de l'eau : moyenne {sst['mean']:.1f}°C (de {sst['min']:.1f} à {sst['max']:.1f}°C)" + (f" ; par zone : {regional}." if regional else "."))
+    chl = digest.get("chl")
+    if chl:
+        lines.append(f"Chlorophylle : moyenne {chl['mean']:.2f} mg/m³ (10 % des zones au-dessus de {chl['p90']:.2f} mg/m³).")
+    wind = digest.get("wind")
+    if wind:
+        lines.append(f"Vent moyen {wind['mean']:.0f} noeuds (jusqu'à {wind['max']:.0f} noeuds).")
+    waves = digest.get("waves")
+    if waves:
+        period = digest.get("wave_period")
+        lines.append(f"Vagues : hauteur moyenne {waves['mean']:.1f} m (max {waves['max']:.1f} m)" + (f", période moyenne {period['mean']:.0f} s." if period else "."))
+    tide = digest.get("tide")
+    if tide and tide.get("tides"):
+        events = ", ".join(f"{'basse mer' if e['type'] == 'Low' else 'pleine mer'} à {e['time']} ({e['height_m']} m)" for e in tide["tides"])
+        lines.append(f"Marées ({tide.get('port_name', 'port de référence')}) : {events}.")
+    if digest.get("moon_phase"):
+        lines.append(f"Phase de la lune : {digest['moon_phase']}.")
+    clusters = digest.get("clusters") or []
+    if clusters:
+        zones = "; ".join(
+            f"{i}) autour de {_format_coord(c['lat'], c['lon'])}, score max {c['score_max']:.2f}, {c['cells']} cellule(s)"
+            + (f", eau à {c['sst_mean']:.1f}°C" if c.get('sst_mean') is not None else "")
+            for i, c in enumerate(clusters, start=1)
+        )
+        lines.append(f"Zones les plus prometteuses selon le modèle : {zones}.")
+    return " ".join(lines)
@@ -4,34 +4,32 @@ import pandas as pd
 import xarray as xr
 import os
 from datetime import datetime, timedelta
-import subprocess
 import shutil
+import subprocess
+import time
+import argparse
+import importlib.util
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 import requests # For Météo-France API (even if placeholder)
-
-# CMEMS Configuration (placeholders & Specifics for SST)
+from download_cache import cache_key, get_download_cache
+from regridding import get_regridder
+import bathymetry
+import grid_store
+import context_digest
+import static_features
+import synthetic_data
+import telemetry
+import variables
+
+# CMEMS Configuration (placeholders ; les produits de chaque source sont décrits dans SOURCES)
 CMEMS_USERNAME_PLACEHOLDER = "YOUR_CMEMS_USERNAME"  # Emphasize this is a placeholder
 CMEMS_PASSWORD_PLACEHOLDER = "YOUR_CMEMS_PASSWORD"  # Emphasize this is a placeholder
 # General CMEMS URL, can be overridden in functions if needed
 CMEMS_BASE_MOTU_URL = "https://nrt.cmems-du.eu/motu-web/Motu" # Example NRT URL
-
-# Specifics for SST product
-CMEMS_SST_MOTU_SERVER_URL = CMEMS_BASE_MOTU_URL
-CMEMS_SST_SERVICE_ID = "SST_EUR_PHY_L4_NRT_010_001-TDS" # Example for L4 European SST
-CMEMS_SST_PRODUCT_ID = "cmems_obs-sst_eur_phy_nrt_010_001" # Example product ID for L4 European SST
-CMEMS_SST_VARIABLE = "analysed_sst"
-
-# Specifics for Chlorophyll product (example for European NRT L4)
-CMEMS_CHL_MOTU_SERVER_URL = CMEMS_BASE_MOTU_URL # Often the same server for NRT products
-CMEMS_CHL_SERVICE_ID = "OCEANCOLOUR_EUR_CHL_L4_NRT_009_036-TDS" # Example: European Ocean Colour L4 NRT
-CMEMS_CHL_PRODUCT_ID = "cmems_obs-oc_eur_chl-l4-nrt_009_036"   # Example: Corresponding product ID
-CMEMS_CHL_VARIABLE = "CHL" # Typical variable name for Chlorophyll-a in mg/m^3
-
-# Specifics for Ocean Currents product (example for European NRT MultiOBS)
-CMEMS_CUR_MOTU_SERVER_URL = CMEMS_BASE_MOTU_URL
-CMEMS_CUR_SERVICE_ID = "MULTIOBS_EUR_PHY_NRT_015_003-TDS" # Example Service ID
-CMEMS_CUR_PRODUCT_ID = "cmems_obs_mob_eur_phy-cur_nrt_015_003" # Example Product ID
-CMEMS_CUR_VAR_U = "uo"  # Standard name for eastward sea water velocity
-CMEMS_CUR_VAR_V = "vo"  # Standard name for northward sea water velocity
+# Erreurs motuclient qu'une nouvelle tentative ne corrigera pas (module absent, identifiants refusés)
+CMEMS_PERMANENT_ERRORS = ("No module named", "401", "403", "Unauthorized", "authentication")
 
 # Météo-France Wind Configuration (Placeholders)
 # METEOFRANCE_API_KEY = os.getenv("METEOFRANCE_API_KEY_PAYSANS") # Example, use proper env var management
@@ -42,7 +40,7 @@ CMEMS_CUR_VAR_V = "vo"  # Standard name for northward sea water velocity
 # EMODnet Bathymetry Configuration
 # User needs to manually download this file and place it in the specified path.
 EMODNET_BATHYMETRY_FILEPATH = "data/bathymetry/emodnet_bay_of_biscay.tif"
-# import rioxarray # Would be needed for actual GeoTIFF processing
+# Lecture avec rasterio (optionnel), voir bathymetry.py
 
 # Tide & Moon Phase Configuration / Libraries
 # import some_tide_api_client # Placeholder for a specific tide API client library
@@ -52,106 +50,110 @@ TIDE_API_KEY_PLACEHOLDER = os.getenv("YOUR_TIDE_API_KEY") # Placeholder for API
 TIDE_REFERENCE_PORT_LAT = 43.48 # Example for Bayonne/Anglet (Grande Plage)
 TIDE_REFERENCE_PORT_LON = -1.56 # Example for Bayonne/Anglet (Grande Plage)
 
+# Graine des valeurs simulées (repli quand une source manque) : deux runs du même jour donnent les mêmes valeurs.
+SIMULATION_SEED = int(os.getenv("THONIA_SIMULATION_SEED", "0"))
+
+def simulation_rng(date: datetime | None = None) -> np.random.Generator:
+    """Générateur aléatoire reproductible, propre au jour `date` s'il est donné."""
+    return np.random.default_rng([SIMULATION_SEED, int(date.strftime('%Y%m%d'))] if date is not None else SIMULATION_SEED)
+
 
 # --- ÉTAPE 1: DÉFINIR NOTRE ZONE D'ÉTUDE (GRILLE FIXE) ---
-print("1. Création de la grille d'analyse pour le Golfe de Gascogne...")
 # Coordonnées du Golfe
 LAT_MIN, LAT_MAX = 43.5, 47.5
 LON_MIN, LON_MAX = -5.0, -1.5
 # Résolution de notre grille (un point tous les 0.1 degrés)
 RESOLUTION = 0.1
 
-# Créer les vecteurs de latitude et longitude
-lats_grid = np.arange(LAT_MIN, LAT_MAX, RESOLUTION)
-lons_grid = np.arange(LON_MIN, LON_MAX, RESOLUTION)
-
-# Créer la grille de points
-lon_mesh, lat_mesh = np.meshgrid(lons_grid, lats_grid)
-grid_df = pd.DataFrame({
-    'latitude': lat_mesh.ravel(),
-    'longitude': lon_mesh.ravel()
-})
-print(f"-> Grille créée avec {len(grid_df)} points.")
+def create_grid(lat_min: float = LAT_MIN, lat_max: float = LAT_MAX, lon_min: float = LON_MIN, lon_max: float = LON_MAX, resolution: float = RESOLUTION) -> pd.DataFrame:
+    """Crée la grille fixe de points (latitude, longitude) de la zone d'étude."""
+    print("1. Création de la grille d'analyse pour le Golfe de Gascogne...")
+    # Créer les vecteurs de latitude et longitude
+    # (arrondis : np.arange accumule des erreurs flottantes, ex. 44.80000000000002)
+    lats_grid = np.round(np.arange(lat_min, lat_max, resolution), 6)
+    lons_grid = np.round(np.arange(lon_min, lon_max, resolution), 6)
+
+    # Créer la grille de points
+    lon_mesh, lat_mesh = np.meshgrid(lons_grid, lats_grid)
+    grid_df = pd.DataFrame({
+        'latitude': lat_mesh.ravel(),
+        'longitude': lon_mesh.ravel()
+    })
+    print(f"-> Grille créée avec {len(grid_df)} points.")
+    return grid_df
 
 # --- Function to add Bathymetry (called in ÉTAPE 1 or early ÉTAPE 3) ---
-def add_bathymetry_to_grid(grid_df: pd.DataFrame, emodnet_filepath: str) -> pd.DataFrame:
+def add_bathymetry_to_grid(grid_df: pd.DataFrame, emodnet_filepath: str, resolution: float = RESOLUTION) -> pd.DataFrame:
     """
     Adds bathymetry data to the grid_df from a local EMODnet GeoTIFF file.
-    Uses placeholder logic if file exists, otherwise NaNs.
+    The GeoTIFF is read once per grid resolution (windowed to the grid bbox, averaged per cell) and the
+    result is cached as a memory-mapped array (see bathymetry.py). Falls back to simulated depths if the
+    file cannot be read, NaNs if it is missing.
     """
     print("\n-> Tentative de traitement des données de bathymétrie EMODnet...")
     if os.path.exists(emodnet_filepath):
         print(f"   Fichier bathymétrie EMODnet trouvé: {emodnet_filepath}.")
-        print("   NOTE: La logique de traitement réelle pour EMODnet (GeoTIFF) avec rioxarray n'est pas implémentée.")
-
-        # --- Pseudocode for actual rioxarray processing ---
-        # try:
-        #     # Open the GeoTIFF file
-        #     rds = rioxarray.open_rasterio(emodnet_filepath)
-        #     # Optional: Clip to a slightly larger area than grid_df for efficiency if the GeoTIFF is global/large
-        #     # min_lon, max_lon = grid_df['longitude'].min(), grid_df['longitude'].max()
-        #     # min_lat, max_lat = grid_df['latitude'].min(), grid_df['latitude'].max()
-        #     # rds_clipped = rds.rio.clip_box(minx=min_lon-0.1, miny=min_lat-0.1, maxx=max_lon+0.1, maxy=max_lat+0.1, crs="EPSG:4326")
-
-        #     # Ensure it's in WGS84 (EPSG:4326) if not already (grid_df lats/lons are assumed WGS84)
-        #     if rds.rio.crs and rds.rio.crs.to_string() != "EPSG:4326":
-        #          rds_wgs84 = rds.rio.reproject("EPSG:4326")
-        #     else:
-        #          rds_wgs84 = rds # Already in WGS84 or no CRS info (assume WGS84)
-
-        #     # Create DataArrays for latitude and longitude from grid_df for selection
-        #     lats_da = xr.DataArray(grid_df['latitude'], dims="points")
-        #     lons_da = xr.DataArray(grid_df['longitude'], dims="points")
-
-        #     # Select bathymetry data at grid points. '.interp()' might be better than '.sel()' for continuous data.
-        #     # Ensure the coordinates in the GeoTIFF are named 'x' and 'y' if using .sel or .interp directly.
-        #     # Bathymetry values from EMODnet are typically negative (depths below sea level).
-        #     # The .rio.reproject might change coord names, check rds_wgs84.coords
-        #     # bathy_values_raw = rds_wgs84.sel(x=lons_da, y=lats_da, method="nearest").values.squeeze()
-        #     # or using interp:
-        #     # bathy_values_raw = rds_wgs84.interp(x=lons_da, y=lats_da, method="linear").values.squeeze()
-
-        #     # grid_df['bathymetry_m'] = bathy_values_raw
-        #     # print(f"-> Bathymétrie EMODnet réelle traitée et ajoutée. Vérifier les signes (normalement négatifs).")
-
-        # except ImportError:
-        #     print("   ⚠️ rioxarray non installé. Impossible de traiter le fichier GeoTIFF.")
-        #     print("      Installation: pip install rioxarray")
-        #     grid_df['bathymetry_m'] = np.random.uniform(-2000, -10, len(grid_df)) # Fallback to simulation
-        #     print("   Utilisation de données de bathymétrie SIMULÉES car rioxarray est manquant.")
-        # except Exception as e:
-        #     print(f"   ❌ Erreur lors du traitement du fichier bathymétrique EMODnet: {e}")
-        #     grid_df['bathymetry_m'] = np.random.uniform(-2000, -10, len(grid_df)) # Fallback to simulation
-        #     print("   Utilisation de données de bathymétrie SIMULÉES suite à une erreur.")
-        # --- End of Pseudocode ---
-
-        # Functional placeholder for this subtask:
-        grid_df['bathymetry_m'] = np.random.uniform(-2000, -10, len(grid_df)) # Simulated depths
-        print("-> Bathymétrie SIMULÉE ajoutée (le fichier EMODnet a été trouvé, mais le traitement réel est un placeholder).")
+        try:
+            grid_df['bathymetry_m'] = bathymetry.load_bathymetry(emodnet_filepath, grid_df['latitude'].to_numpy(), grid_df['longitude'].to_numpy(), resolution)
+            grid_df.attrs['bathymetry_source'] = 'emodnet'
+            print(f"-> Bathymétrie EMODnet réelle ajoutée ({int(grid_df['bathymetry_m'].notna().sum())} points en mer).")
+            return grid_df
+        except ImportError as e:
+            print(f"   ⚠️ {e}")
+            grid_df['bathymetry_m'] = simulation_rng().uniform(-2000, -10, len(grid_df)) # Fallback to simulation
+            print("   Utilisation de données de bathymétrie SIMULÉES car rasterio est manquant.")
+        except Exception as e:
+            print(f"   ❌ Erreur lors du traitement du fichier bathymétrique EMODnet: {e}")
+            grid_df['bathymetry_m'] = simulation_rng().uniform(-2000, -10, len(grid_df)) # Fallback to simulation
+            print("   Utilisation de données de bathymétrie SIMULÉES suite à une erreur.")
+        grid_df.attrs['bathymetry_source'] = 'simulated'
     else:
         print(f"   Fichier bathymétrie EMODnet NON trouvé à: {emodnet_filepath}.")
         print("   La bathymétrie sera remplie avec NaN.")
         print("   NOTE: Téléchargez le fichier GeoTIFF depuis EMODnet et placez-le au chemin spécifié pour un traitement réel.")
         grid_df['bathymetry_m'] = np.nan
+        grid_df.attrs['bathymetry_source'] = 'missing'
     return grid_df
 
-# Appel de la fonction Bathymétrie après la création de la grille
-grid_df = add_bathymetry_to_grid(grid_df, EMODNET_BATHYMETRY_FILEPATH)
+def build_static_grid() -> pd.DataFrame:
+    """
+    Grille + variables statiques (bathymétrie, distances à la côte et au rebord du plateau, surface des cellules) :
+    identiques pour tous les jours, calculées une fois par définition de grille et résolution, puis relues
+    depuis le store en mémoire mappée (voir static_features.py). Partagées avec les workers en mode backfill.
+    """
+    key = static_features.grid_key(LAT_MIN, LAT_MAX, LON_MIN, LON_MAX, RESOLUTION, bathymetry.source_signature(EMODNET_BATHYMETRY_FILEPATH))
+
+    # Appel de la fonction Bathymétrie après la création de la grille (seulement si le store ne l'a pas déjà)
+    def build() -> pd.DataFrame:
+        with telemetry.span("grid", resolution=RESOLUTION) as record:
+            grid_df = create_grid()
+            record["points"] = len(grid_df)
+        with telemetry.span("bathymetry", path=EMODNET_BATHYMETRY_FILEPATH) as record:
+            grid_df = add_bathymetry_to_grid(grid_df, EMODNET_BATHYMETRY_FILEPATH)
+            record["bathymetry_source"] = grid_df.attrs.get('bathymetry_source')
+        return grid_df
+
+    with telemetry.span("static_grid", grid_key=key) as record:
+        static_df = static_features.load_static_features(key, RESOLUTION, build)
+        record.update(points=len(static_df), bathymetry_source=static_df.attrs.get('thonia', {}).get('bathymetry_source'))
+    return static_df
 
 
 # --- ÉTAPE 2: SIMULATION DU TÉLÉCHARGEMENT & LECTURE DES DONNÉES ---
 # Dans une vraie app, ici on téléchargerait les fichiers depuis Copernicus/Météo-France
-print("\n2. Traitement des données sources (simulation)...")
 
 # Pour cet exemple, nous créons un FAUX fichier NetCDF de température
 # pour pouvoir tester le reste du code sans se connecter aux APIs.
+FAKE_SOURCE_RESOLUTION = 0.05 # Résolution du fichier SST factice (pour les tests à plus haute résolution, voir synthetic_data.py)
+
 def create_fake_netcdf_data(file_path='fake_temperature_data.nc'):
     if os.path.exists(file_path):
         return
     print(f"-> Création d'un fichier de données de température de test ({file_path})...")
-    lats_source = np.arange(43, 48, 0.05)
-    lons_source = np.arange(-6, 0, 0.05)
-    temps = 15 + 5 * np.random.rand(len(lats_source), len(lons_source)) # Températures en Celsius pour la simulation
+    # Champ simulé reproductible et spatialement cohérent (voir synthetic_data.py), en Celsius
+    ocean = synthetic_data.SyntheticOcean(datetime(2024, 6, 1), bbox=(43.0, 48.0, -6.0, 0.0), resolution=FAKE_SOURCE_RESOLUTION, seed=SIMULATION_SEED)
+    lats_source, lons_source = ocean.lats, ocean.lons
+    temps = ocean.fields(0)['sst_c']
     ds = xr.Dataset(
         {"sst": (("lat", "lon"), temps)}, # Nom de variable 'sst' comme dans les vrais fichiers
         coords={"lat": lats_source, "lon": lons_source},
@@ -173,208 +175,132 @@ def create_fake_netcdf_data(file_path='fake_temperature_data.nc'):
     # This is optional but can help avoid issues if later code expects a time dimension
     # For this specific task, keeping it simple without time dim for fake data.
 
-# CMEMS Fetching Functions
-def fetch_cmems_sst(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/cmems") -> tuple[str | None, bool]:
+# Fenêtre téléchargée : `days` jours à partir de `date` (1 = le jour seul, > 1 = prévision sur plusieurs jours),
+# en une seule requête par produit.
+def window_end(date: datetime, days: int = 1) -> datetime:
+    """Dernière seconde du dernier jour de la fenêtre."""
+    return date + timedelta(days=days) - timedelta(seconds=1)
+
+def window_label(date: datetime, days: int = 1) -> str:
+    """Partie datée des noms de fichiers : 20240601 pour un jour, 20240601_7d pour une fenêtre de 7 jours."""
+    return date.strftime('%Y%m%d') + (f"_{days}d" if days > 1 else "")
+
+# CMEMS Fetching Function (générique, paramétrée par une entrée du registre SOURCES plus bas)
+def fetch_cmems(source: dict, date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/cmems", timeout: int = 300, days: int = 1) -> tuple[str | None, bool, bool]:
     """
-    Tente de télécharger les données SST de CMEMS pour une date et une zone données.
-    En cas d'échec, copie les données de 'fake_temperature_data.nc' vers un fichier daté.
-    Retourne un tuple: (chemin_du_fichier, is_real_data_flag)
+    Tente de télécharger les variables d'un produit CMEMS pour une date (ou `days` jours à partir de cette date) et une zone données.
+    En cas d'échec, copie le fichier de repli de la source (`fallback_file`, ex. 'fake_temperature_data.nc') s'il y en a un,
+    sinon retourne (None, False, ...).
+    Retourne un tuple: (chemin_du_fichier, is_real_data_flag, retryable) ; `retryable` est False quand l'échec est
+    permanent (motuclient absent, identifiants manquants ou refusés) : inutile de relancer.
     """
+    label = source['label']
     os.makedirs(output_dir, exist_ok=True)
-    output_filename = f"sst_{date.strftime('%Y%m%d')}.nc"
-    output_path = os.path.join(output_dir, output_filename)
-    is_real_data = False
-
-    print(f"-> Tentative de téléchargement des données SST CMEMS pour {date.strftime('%Y-%m-%d')}...")
+    output_filename = f"{source['file_prefix']}_{window_label(date, days)}.nc"
+    bbox = (lat_min, lat_max, lon_min, lon_max)
+    # Nom principal de chaque variable dans le produit (les autres noms ne servent qu'à la lecture)
+    file_variables = [names[0] for names in source['variables'].values()]
+
+    cache = get_download_cache(output_dir)
+    key = cache_key(source['product_id'], file_variables, bbox, date, days)
+    cached_path = cache.lookup(key, output_filename)
+    if cached_path:
+        print(f"-> ♻️ Données {label} CMEMS déjà téléchargées pour {date.strftime('%Y-%m-%d')}: {cached_path}")
+        return cached_path, True, False
+    partial_path = cache.partial_path(output_filename)
+    # Identifiants laissés à leur valeur d'exemple : motuclient serait refusé à chaque tentative
+    if CMEMS_USERNAME_PLACEHOLDER.startswith("YOUR_") or CMEMS_PASSWORD_PLACEHOLDER.startswith("YOUR_"):
+        print(f"-> ⚠️ Identifiants CMEMS non renseignés : téléchargement des données {label} impossible.")
+        return _cmems_fallback(source, date, bbox, file_variables, days, cache, output_filename, retryable=False)
+
+    print(f"-> Tentative de téléchargement des données {label} CMEMS pour {date.strftime('%Y-%m-%d')}...")
 
     # Formulate motuclient command
     motu_command = [
         "python3", "-m", "motuclient", # Ensure python3 is used if motuclient is installed for it
         "-u", CMEMS_USERNAME_PLACEHOLDER,
         "-p", CMEMS_PASSWORD_PLACEHOLDER,
-        "-m", CMEMS_SST_MOTU_SERVER_URL,
-        "-s", CMEMS_SST_SERVICE_ID,
-        "-d", CMEMS_SST_PRODUCT_ID,
+        "-m", source.get('server_url', CMEMS_BASE_MOTU_URL),
+        "-s", source['service_id'],
+        "-d", source['product_id'],
         "-x", str(lon_min), "-X", str(lon_max),
         "-y", str(lat_min), "-Y", str(lat_max),
         "-t", date.strftime('%Y-%m-%d %H:%M:%S'),
-        "-T", (date + timedelta(days=1) - timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S'), # End of the day
-        "-v", CMEMS_SST_VARIABLE,
+        "-T", window_end(date, days).strftime('%Y-%m-%d %H:%M:%S'), # Fin du dernier jour de la fenêtre
         "-o", output_dir, # motuclient will use this directory
-        "-f", output_filename
+        "-f", os.path.basename(partial_path) # Fichier temporaire, renommé une fois validé
     ]
+    # Une option -v par variable (plusieurs variables du même produit en une seule requête)
+    for variable in file_variables:
+        motu_command += ["-v", variable]
 
+    retryable = True
     try:
-        print(f"   Exécution de motuclient: {' '.join(motu_command)}")
+        print(f"   Exécution de motuclient pour {label}: {' '.join(motu_command)}")
         # Hide username and password in printout for security if needed in real logs, for now it's fine.
-        result = subprocess.run(motu_command, capture_output=True, text=True, check=False, timeout=300) # 5 min timeout
+        result = subprocess.run(motu_command, capture_output=True, text=True, check=False, timeout=timeout) # 5 min par défaut
 
         if result.returncode == 0:
-            print(f"   ✅ Téléchargement CMEMS SST réussi. Données sauvegardées dans {output_path}")
-            is_real_data = True
-            return output_path, is_real_data
+            output_path = cache.commit(key, partial_path, output_filename, product=source['product_id'], date=date.strftime('%Y-%m-%d'))
+            if output_path:
+                print(f"   ✅ Téléchargement CMEMS {label} réussi. Données sauvegardées dans {output_path}")
+                return output_path, True, False
         else:
-            print(f"   ⚠️ Échec du téléchargement CMEMS SST (code: {result.returncode}). Erreur:")
+            print(f"   ⚠️ Échec du téléchargement CMEMS {label} (code: {result.returncode}). Erreur:")
             print(f"   Stderr: {result.stderr}")
             print(f"   Stdout: {result.stdout}")
+            retryable = not any(marker in result.stderr + result.stdout for marker in CMEMS_PERMANENT_ERRORS)
 
     except FileNotFoundError:
-        print("   ⚠️ Erreur: motuclient non trouvé. Vérifiez l'installation et le PATH.")
+        print(f"   ⚠️ Erreur: motuclient non trouvé pour {label}. Vérifiez l'installation et le PATH.")
+        retryable = False
     except subprocess.TimeoutExpired:
-        print("   ⚠️ Erreur: Le téléchargement CMEMS SST a expiré (timeout).")
+        print(f"   ⚠️ Erreur: Le téléchargement CMEMS {label} a expiré (timeout).")
     except Exception as e:
-        print(f"   ⚠️ Erreur inattendue lors du téléchargement CMEMS SST: {e}")
+        print(f"   ⚠️ Erreur inattendue lors du téléchargement CMEMS {label}: {e}")
+    if not retryable:
+        print(f"   Échec permanent pour {label} : pas de nouvelle tentative.")
+    return _cmems_fallback(source, date, bbox, file_variables, days, cache, output_filename, retryable)
+
+def _cmems_fallback(source: dict, date: datetime, bbox: tuple, file_variables: list[str], days: int, cache, output_filename: str, retryable: bool) -> tuple[str | None, bool, bool]:
+    """Copie le fichier de repli de la source dans le cache (données factices). Retourne (chemin | None, False, retryable)."""
+    label = source['label']
+    fallback = source.get('fallback_file')
+    if fallback is None:
+        print(f"-> Échec du téléchargement des données {label} CMEMS. Aucune donnée {label} disponible pour {date.strftime('%Y-%m-%d')}.")
+        return None, False, retryable
 
     # Fallback to fake data
-    print("-> Basculement vers les données SST factices.")
-    os.makedirs(output_dir, exist_ok=True) # Ensure directory exists again just in case
-    fake_data_source_path = 'fake_temperature_data.nc' # Default name for the template
-
+    fake_data_source_path, create_fallback = fallback
+    print(f"-> Basculement vers les données {label} factices.")
     # Ensure the base fake data exists
     if not os.path.exists(fake_data_source_path):
         print(f"   Création du fichier source factice: {fake_data_source_path}")
-        create_fake_netcdf_data(file_path=fake_data_source_path)
+        create_fallback(file_path=fake_data_source_path)
 
     if not os.path.exists(fake_data_source_path): # If still not exists after attempt
         print(f"   ❌ Échec critique: Impossible de créer ou de trouver {fake_data_source_path}.")
-        return None, False
-
-    try:
-        shutil.copy(fake_data_source_path, output_path)
-        print(f"   Données SST factices copiées dans {output_path}")
-        return output_path, False # False because it's fake data
-    except Exception as e:
-        print(f"   ❌ Erreur lors de la copie des données SST factices: {e}")
-        return None, False
-
-def fetch_cmems_chlorophyll(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/cmems") -> tuple[str | None, bool]:
-    """
-    Tente de télécharger les données de Chlorophylle-a de CMEMS.
-    En cas d'échec, retourne (None, False).
-    """
-    os.makedirs(output_dir, exist_ok=True)
-    output_filename = f"chl_{date.strftime('%Y%m%d')}.nc"
-    output_path = os.path.join(output_dir, output_filename)
-    is_real_data = False
-
-    print(f"-> Tentative de téléchargement des données Chlorophylle CMEMS pour {date.strftime('%Y-%m-%d')}...")
-
-    motu_command_chl = [
-        "python3", "-m", "motuclient",
-        "-u", CMEMS_USERNAME_PLACEHOLDER,
-        "-p", CMEMS_PASSWORD_PLACEHOLDER,
-        "-m", CMEMS_CHL_MOTU_SERVER_URL,
-        "-s", CMEMS_CHL_SERVICE_ID,
-        "-d", CMEMS_CHL_PRODUCT_ID,
-        "-x", str(lon_min), "-X", str(lon_max),
-        "-y", str(lat_min), "-Y", str(lat_max),
-        "-t", date.strftime('%Y-%m-%d %H:%M:%S'),
-        "-T", (date + timedelta(days=1) - timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S'),
-        "-v", CMEMS_CHL_VARIABLE,
-        "-o", output_dir,
-        "-f", output_filename
-    ]
-
-    try:
-        print(f"   Exécution de motuclient pour CHL: {' '.join(motu_command_chl)}")
-        result = subprocess.run(motu_command_chl, capture_output=True, text=True, check=False, timeout=300)
-
-        if result.returncode == 0:
-            print(f"   ✅ Téléchargement CMEMS CHL réussi. Données sauvegardées dans {output_path}")
-            is_real_data = True
-            return output_path, is_real_data
-        else:
-            print(f"   ⚠️ Échec du téléchargement CMEMS CHL (code: {result.returncode}). Erreur:")
-            print(f"   Stderr: {result.stderr}")
-            print(f"   Stdout: {result.stdout}")
-
-    except FileNotFoundError:
-        print("   ⚠️ Erreur: motuclient non trouvé pour CHL. Vérifiez l'installation et le PATH.")
-    except subprocess.TimeoutExpired:
-        print("   ⚠️ Erreur: Le téléchargement CMEMS CHL a expiré (timeout).")
-    except Exception as e:
-        print(f"   ⚠️ Erreur inattendue lors du téléchargement CMEMS CHL: {e}")
-
-    # Fallback if download fails
-    print(f"-> Échec du téléchargement des données Chlorophylle CMEMS. Aucune donnée CHL disponible pour {date.strftime('%Y-%m-%d')}.")
-    return None, False
-
-
-def fetch_cmems_currents(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/cmems") -> tuple[str | None, bool]:
-    """
-    Tente de télécharger les données de courants océaniques (U et V) de CMEMS.
-    En cas d'échec, retourne (None, False).
-    """
-    os.makedirs(output_dir, exist_ok=True)
-    output_filename = f"cur_{date.strftime('%Y%m%d')}.nc"
-    output_path = os.path.join(output_dir, output_filename)
-    is_real_data = False
-
-    print(f"-> Tentative de téléchargement des données Courants CMEMS pour {date.strftime('%Y-%m-%d')}...")
-
-    # Note: motuclient usually requires variables to be specified one by one with multiple -v flags
-    # However, some API versions or client interpretations might handle comma-separated.
-    # For robustness, one could make two calls, or ensure the specific service supports multi-var requests this way.
-    # Here, we'll try with multiple -v flags in the command list if that's standard for motuclient.py
-    # Let's assume the client takes multiple --variable options.
-    # The variable list for the command:
-    variables_to_download = [
-        "--variable", CMEMS_CUR_VAR_U,
-        "--variable", CMEMS_CUR_VAR_V
-    ]
-    # Some products might have slightly different lat/lon names, e.g. 'latitude'/'longitude'
-    # This example assumes 'lat'/'lon' are standard for the product. Adjust if needed.
-
-    motu_command_cur = [
-        "python3", "-m", "motuclient",
-        "-u", CMEMS_USERNAME_PLACEHOLDER,
-        "-p", CMEMS_PASSWORD_PLACEHOLDER,
-        "-m", CMEMS_CUR_MOTU_SERVER_URL,
-        "-s", CMEMS_CUR_SERVICE_ID,
-        "-d", CMEMS_CUR_PRODUCT_ID,
-        "-x", str(lon_min), "-X", str(lon_max),
-        "-y", str(lat_min), "-Y", str(lat_max),
-        "-t", date.strftime('%Y-%m-%d %H:%M:%S'),
-        "-T", (date + timedelta(days=1) - timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S'),
-        # Variables are added below
-        "-o", output_dir,
-        "-f", output_filename
-    ]
-    # Add variables to the command. The subprocess module expects all arguments as strings.
-    for var_opt in variables_to_download:
-        motu_command_cur.append(var_opt)
+        return None, False, retryable
 
     try:
-        print(f"   Exécution de motuclient pour Courants: {' '.join(motu_command_cur)}")
-        result = subprocess.run(motu_command_cur, capture_output=True, text=True, check=False, timeout=300)
-
-        if result.returncode == 0:
-            print(f"   ✅ Téléchargement CMEMS Courants réussi. Données sauvegardées dans {output_path}")
-            is_real_data = True
-            return output_path, is_real_data
-        else:
-            print(f"   ⚠️ Échec du téléchargement CMEMS Courants (code: {result.returncode}). Erreur:")
-            print(f"   Stderr: {result.stderr}")
-            print(f"   Stdout: {result.stdout}")
-
-    except FileNotFoundError:
-        print("   ⚠️ Erreur: motuclient non trouvé pour Courants. Vérifiez l'installation et le PATH.")
-    except subprocess.TimeoutExpired:
-        print("   ⚠️ Erreur: Le téléchargement CMEMS Courants a expiré (timeout).")
+        # Les données factices sont mises en cache comme telles : pas de nouvelle copie au prochain run,
+        # mais le téléchargement réel sera retenté.
+        fake_key = cache_key("fake:" + fake_data_source_path, file_variables, bbox, date, days)
+        output_path = cache.put_copy(fake_key, fake_data_source_path, output_filename, is_real=False, date=date.strftime('%Y-%m-%d'))
+        print(f"   Données {label} factices disponibles dans {output_path}")
+        return output_path, False, retryable # False because it's fake data
     except Exception as e:
-        print(f"   ⚠️ Erreur inattendue lors du téléchargement CMEMS Courants: {e}")
-
-    print(f"-> Échec du téléchargement des données Courants CMEMS. Aucune donnée Courants disponible pour {date.strftime('%Y-%m-%d')}.")
-    return None, False
+        print(f"   ❌ Erreur lors de la copie des données {label} factices: {e}")
+        return None, False, retryable
 
 # Météo-France Fetching Function (Placeholder)
-def fetch_meteofrance_wind(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/meteofrance") -> tuple[str | None, bool]:
+def fetch_meteofrance_wind(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/meteofrance", days: int = 1) -> tuple[str | None, bool, bool]:
     """
     Placeholder pour le téléchargement des données de vent de Météo-France.
     Simule toujours un échec pour l'instant.
     """
     os.makedirs(output_dir, exist_ok=True)
-    output_filename = f"wind_mf_{date.strftime('%Y%m%d')}.grib2" # Example filename
+    output_filename = f"wind_mf_{window_label(date, days)}.grib2" # Example filename
     output_path = os.path.join(output_dir, output_filename)
 
     print(f"-> Tentative de téléchargement des données Vent Météo-France pour {date.strftime('%Y-%m-%d')} (Placeholder)...")
@@ -407,15 +333,15 @@ def fetch_meteofrance_wind(date: datetime, lat_min: float, lat_max: float, lon_m
     # --- Fin de la section de pseudocode ---
 
     print(f"-> Échec simulé du téléchargement des données Vent Météo-France pour {date.strftime('%Y-%m-%d')}.")
-    return None, False
+    return None, False, False # Échec permanent tant que le téléchargement n'est pas implémenté
 
-def fetch_meteofrance_waves(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/meteofrance") -> tuple[str | None, bool]:
+def fetch_meteofrance_waves(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, output_dir="data/meteofrance", days: int = 1) -> tuple[str | None, bool, bool]:
     """
     Placeholder pour le téléchargement des données de vagues de Météo-France.
     Simule toujours un échec pour l'instant.
     """
     os.makedirs(output_dir, exist_ok=True)
-    output_filename = f"waves_mf_{date.strftime('%Y%m%d')}.grib2" # Example filename
+    output_filename = f"waves_mf_{window_label(date, days)}.grib2" # Example filename
     output_path = os.path.join(output_dir, output_filename)
 
     print(f"-> Tentative de téléchargement des données Vagues Météo-France pour {date.strftime('%Y-%m-%d')} (Placeholder)...")
@@ -437,7 +363,7 @@ def fetch_meteofrance_waves(date: datetime, lat_min: float, lat_max: float, lon_
     # --- Fin de la section de pseudocode ---
 
     print(f"-> Échec simulé du téléchargement des données Vagues Météo-France pour {date.strftime('%Y-%m-%d')}.")
-    return None, False
+    return None, False, False # Échec permanent tant que le téléchargement n'est pas implémenté
 
 # --- Contextual Data Fetching Functions (Tides, Moon Phase) ---
 def fetch_tide_data(date: datetime, ref_lat: float, ref_lon: float) -> dict | None:
@@ -520,310 +446,570 @@ def get_moon_phase(date: datetime) -> str:
     return "Waning Gibbous (Simulated)"
 
 
-# --- ÉTAPE 2: TÉLÉCHARGEMENT & LECTURE DES DONNÉES --- (Modifié)
-print("\n2. Téléchargement et lecture des données sources et contextuelles...")
-current_date = datetime.now() # Use current date, or specific date for reproducibility
-# current_date = datetime(2024, 1, 15) # Example for a specific date
-
-# Télécharger/simuler les données CMEMS
-sst_file_path, is_real_sst_data = fetch_cmems_sst(current_date, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX)
-chl_file_path, is_real_chl_data = fetch_cmems_chlorophyll(current_date, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX)
-cur_file_path, is_real_cur_data = fetch_cmems_currents(current_date, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX)
-
-# Télécharger/simuler les données Météo-France
-mf_wind_filepath, is_real_mf_wind_data = fetch_meteofrance_wind(current_date, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX)
-mf_wave_filepath, is_real_mf_wave_data = fetch_meteofrance_waves(current_date, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX)
-
-# Récupérer les données contextuelles (Marées, Phase de la Lune)
-tide_data_today = fetch_tide_data(current_date, TIDE_REFERENCE_PORT_LAT, TIDE_REFERENCE_PORT_LON)
-moon_phase_today = get_moon_phase(current_date)
-
-print("\n--- Données Contextuelles du Jour ---")
-if tide_data_today:
-    print(f"Marées ({tide_data_today.get('port_name', 'N/A')}):")
-    for tide_event in tide_data_today.get('tides', []):
-        print(f"  - {tide_event['type']} à {tide_event['time']}, Hauteur: {tide_event['height_m']}m")
-else:
-    print("Aucune donnée de marée disponible.")
-print(f"Phase de la Lune: {moon_phase_today}")
-print("------------------------------------")
-
-
-# La création de fake_temperature_data.nc est maintenant gérée dans fetch_cmems_sst si besoin.
-# create_fake_netcdf_data() # Appel direct supprimé
+# --- Planificateur de téléchargement concurrent ---
+# Les sources sont indépendantes : on les télécharge en parallèle pour que la durée de l'étape
+# soit bornée par la source la plus lente, et non par la somme de toutes les sources.
+FETCH_MAX_WORKERS = 4          # Nombre maximum de téléchargements simultanés
+FETCH_RETRY_BACKOFF_S = 5      # Attente avant la 1re relance, doublée à chaque nouvel essai
+DOWNLOAD_CACHE_DIRS = ("data/cmems", "data/meteofrance") # Dossiers soumis à la politique d'éviction
+
+# --- REGISTRE DES SOURCES ---
+# Une entrée par source : téléchargement, variables lues, unités, repli et méthode de regrillage.
+# Ajouter une variable (salinité, profondeur de couche de mélange...) = ajouter une entrée ici
+# (et son unité/plage dans variables.VARIABLES pour qu'elle soit contrôlée).
+#   label        : nom affiché dans les messages
+#   fetch        : fonction de téléchargement spécifique (par défaut fetch_cmems avec les champs CMEMS ci-dessous),
+#                  qui retourne (chemin, is_real_data) ou (chemin, is_real_data, retryable) : retryable=False = échec permanent
+#   server_url, service_id, product_id, file_prefix : produit CMEMS (motuclient)
+#   variables    : {colonne de la grille: [noms possibles dans le fichier, le premier est celui demandé]}
+#   units        : unités du produit, utilisées si le fichier n'a pas d'attribut 'units' (conversion via variables.py)
+#   fallback_file: (fichier local, fonction qui le crée) copié si le téléchargement échoue ; ses données sont projetées
+#   simulate     : {colonne: ('uniform'|'randint', min, max)} si aucune donnée n'a pu être lue ; NaN sinon
+#   derive, columns : fonction (champs, unités) -> (colonnes, unités) et liste des colonnes calculées (ex. vent depuis U/V)
+#   open_kwargs  : options de xr.open_dataset (ex. moteur cfgrib pour les GRIB Météo-France)
+#   regrid       : 'nearest' ou 'bilinear' (voir regridding.py)
+#   timeout      : délai par tentative (s), retries : nombre de relances si la donnée réelle n'a pas été obtenue
+#   provenance   : clé de provenance enregistrée avec la grille (réel/simulé)
+def _wind_speed(fields: dict, units: dict) -> tuple[dict, dict]:
+    """Vitesse du vent (norme des composantes U/V à 10 m), dans l'unité des composantes."""
+    return {'vent_noeuds': np.hypot(fields['u10'], fields['v10'])}, {'vent_noeuds': units.get('u10', '')}
+
+SOURCES = {
+    'sst': {
+        'label': "SST",
+        'service_id': "SST_EUR_PHY_L4_NRT_010_001-TDS",       # Example for L4 European SST
+        'product_id': "cmems_obs-sst_eur_phy_nrt_010_001",   # Example product ID for L4 European SST
+        'file_prefix': "sst",
+        'variables': {'temp_surface_c': ["analysed_sst", "sst"]}, # 'sst' : données factices
+        'units': {'temp_surface_c': "K"},
+        'fallback_file': ('fake_temperature_data.nc', create_fake_netcdf_data),
+        'simulate': {'temp_surface_c': ('uniform', 10, 20)},
+        'regrid': "nearest", 'timeout': 300, 'retries': 2, 'provenance': "is_real_sst_data",
+    },
+    'chl': {
+        'label': "Chlorophylle",
+        'service_id': "OCEANCOLOUR_EUR_CHL_L4_NRT_009_036-TDS", # Example: European Ocean Colour L4 NRT
+        'product_id': "cmems_obs-oc_eur_chl-l4-nrt_009_036",   # Example: Corresponding product ID
+        'file_prefix': "chl",
+        'variables': {'chlorophylle_mg_m3': ["CHL", "chl", "CHL1_N"]},
+        'units': {'chlorophylle_mg_m3': "mg m-3"},
+        'simulate': {'chlorophylle_mg_m3': ('uniform', 0.1, 1.5)},
+        'regrid': "nearest", 'timeout': 300, 'retries': 2, 'provenance': "is_real_chl_data",
+    },
+    'cur': {
+        'label': "Courants",
+        'service_id': "MULTIOBS_EUR_PHY_NRT_015_003-TDS",      # Example Service ID
+        'product_id': "cmems_obs_mob_eur_phy-cur_nrt_015_003", # Example Product ID
+        'file_prefix': "cur",
+        # Standard names for eastward/northward sea water velocity ; U et V partagent la même grille source
+        'variables': {'eastward_current_m_s': ["uo"], 'northward_current_m_s': ["vo"]},
+        'units': {'eastward_current_m_s': "m s-1", 'northward_current_m_s': "m s-1"},
+        'regrid': "nearest", 'timeout': 300, 'retries': 2, 'provenance': "is_real_cur_data",
+    },
+    # Placeholders Météo-France : l'échec est simulé, inutile de relancer.
+    'mf_wind': {
+        'label': "Vent Météo-France",
+        'fetch': fetch_meteofrance_wind,
+        'variables': {'u10': ["u10", "10u"], 'v10': ["v10", "10v"]},
+        'units': {'u10': "m s-1", 'v10': "m s-1"},
+        'derive': _wind_speed, 'columns': ['vent_noeuds'],
+        'open_kwargs': {'engine': "cfgrib", 'backend_kwargs': {'filter_by_keys': {'typeOfLevel': 'heightAboveGround', 'level': 10, 'stepType': 'instant'}}},
+        'simulate': {'vent_noeuds': ('randint', 5, 25)},
+        'regrid': "nearest", 'timeout': None, 'retries': 0, 'provenance': "is_real_mf_wind_data",
+    },
+    'mf_waves': {
+        'label': "Vagues Météo-France",
+        'fetch': fetch_meteofrance_waves,
+        # Significant wave height, mean wave direction and mean period of wind waves (e.g., from MFWAM)
+        'variables': {'wave_height_m': ["VHM0"], 'wave_direction_deg': ["VMDR_WW"], 'wave_period_s': ["VTM02_WW"]},
+        'units': {'wave_height_m': "m", 'wave_direction_deg': "degree", 'wave_period_s': "s"},
+        'open_kwargs': {'engine': "cfgrib", 'backend_kwargs': {'filter_by_keys': {'typeOfLevel': 'surface'}}},
+        'regrid': "nearest", 'timeout': None, 'retries': 0, 'provenance': "is_real_mf_wave_data",
+    },
+}
+
+def source_columns(source: dict) -> list[str]:
+    """Colonnes de la grille produites par une source (celles de `derive` s'il y en a une)."""
+    return source.get('columns', list(source['variables']))
+
+def fetch_with_retry(name: str, source: dict, date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, days: int = 1) -> tuple[str | None, bool]:
+    """
+    Appelle la fonction de téléchargement d'une source, en la relançant avec un backoff exponentiel
+    tant que la donnée réelle n'est pas obtenue et que l'échec est transitoire (timeout, erreur réseau ou serveur).
+    Un échec permanent signalé par la fonction (retryable=False) arrête les relances. Retourne le dernier (chemin, is_real_data).
+    """
+    kwargs = {'timeout': source['timeout']} if source['timeout'] is not None else {}
+    if days > 1:
+        kwargs['days'] = days
+    path, is_real = None, False
+    with telemetry.span("fetch", source=name, provenance=source.get('provenance'), days=days) as record:
+        for attempt in range(source['retries'] + 1):
+            if attempt:
+                delay = FETCH_RETRY_BACKOFF_S * 2 ** (attempt - 1)
+                print(f"   🔁 [{name}] Nouvelle tentative {attempt}/{source['retries']} dans {delay}s...")
+                time.sleep(delay)
+            record["attempts"] = attempt + 1
+            try:
+                if source.get('fetch') is not None:
+                    result = source['fetch'](date, lat_min, lat_max, lon_min, lon_max, **kwargs)
+                else:
+                    result = fetch_cmems(source, date, lat_min, lat_max, lon_min, lon_max, **kwargs)
+            except Exception as e:
+                print(f"   ⚠️ [{name}] Erreur inattendue pendant le téléchargement: {e}")
+                record["error"] = f"{type(e).__name__}: {e}"
+                continue
+            # Sans indication de la fonction, un échec est considéré comme transitoire
+            path, is_real, retryable = result if len(result) == 3 else (*result, True)
+            if is_real:
+                break
+            if not retryable:
+                record["permanent_failure"] = True
+                break
+        record.update(real_data=bool(is_real), path=path, file_bytes=os.path.getsize(path) if path and os.path.exists(path) else None)
+    return path, is_real
+
+def source_deadline(source: dict) -> float | None:
+    """Durée maximale accordée à une source, relances et backoff compris (None = illimitée)."""
+    if source['timeout'] is None:
+        return None
+    retries = source['retries']
+    backoff = sum(FETCH_RETRY_BACKOFF_S * 2 ** i for i in range(retries))
+    return source['timeout'] * (retries + 1) + backoff + 30 # marge pour le repli sur données factices
+
+def run_fetch_stage(date: datetime, lat_min: float, lat_max: float, lon_min: float, lon_max: float, max_workers: int = FETCH_MAX_WORKERS, days: int = 1) -> dict:
+    """
+    Télécharge toutes les sources du registre SOURCES et les marées en parallèle (concurrence bornée).
+    Avec `days` > 1, chaque source est demandée sur toute la fenêtre en une seule requête.
+    Retourne {nom_source: (chemin, is_real_data), ..., 'tide': dict | None}.
+    """
+    with telemetry.span("fetch_stage", date=date.strftime('%Y-%m-%d'), days=days) as record:
+        started = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+        # Les spans des téléchargements sont rattachés à celui de l'étape malgré le changement de thread
+        futures = {
+            name: executor.submit(telemetry.bind(fetch_with_retry), name, source, date, lat_min, lat_max, lon_min, lon_max, days)
+            for name, source in SOURCES.items()
+        }
+        tide_future = executor.submit(fetch_tide_data, date, TIDE_REFERENCE_PORT_LAT, TIDE_REFERENCE_PORT_LON)
+
+        results = {}
+        for name, future in futures.items():
+            deadline = source_deadline(SOURCES[name])
+            remaining = None if deadline is None else max(deadline - (time.monotonic() - started), 0)
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                print(f"   ⚠️ [{name}] Délai maximal dépassé ({deadline}s). Source ignorée pour ce run.")
+                results[name] = (None, False)
+            except Exception as e:
+                print(f"   ⚠️ [{name}] Échec du téléchargement: {e}")
+                results[name] = (None, False)
+        try:
+            results['tide'] = tide_future.result()
+        except Exception as e:
+            print(f"   ⚠️ Échec de la récupération des marées: {e}")
+            results['tide'] = None
+        # On n'attend pas une source bloquée au-delà de son délai : son sous-processus a son propre timeout.
+        executor.shutdown(wait=False, cancel_futures=True)
+        for cache_dir in DOWNLOAD_CACHE_DIRS:
+            get_download_cache(cache_dir).evict()
+        print(f"-> Étape de téléchargement terminée en {time.monotonic() - started:.1f}s.")
+        record.update({SOURCES[name]['provenance']: bool(results[name][1]) for name in SOURCES})
+    return results
 
 
 # --- ÉTAPE 3: TRAITEMENT ET PROJECTION SUR NOTRE GRILLE ---
-print("\n3. Projection des données sur notre grille...")
-
-# Traitement SST
-if sst_file_path and os.path.exists(sst_file_path):
-    print(f"-> Chargement des données SST depuis {sst_file_path} (Réel: {is_real_sst_data})")
-    try:
-        source_sst_data = xr.open_dataset(sst_file_path)
-
-        # Sélectionner la variable SST. Le nom peut varier.
-        # Pour l'instant, on essaie 'analysed_sst' (CMEMS) puis 'sst' (fake data).
-        # Une approche plus robuste serait de vérifier source_sst_data.data_vars
-        sst_variable_name_in_file = CMEMS_SST_VARIABLE if CMEMS_SST_VARIABLE in source_sst_data.data_vars else 'sst'
-        if sst_variable_name_in_file not in source_sst_data.data_vars:
-            raise ValueError(f"Variable SST ('{CMEMS_SST_VARIABLE}' ou 'sst') non trouvée dans {sst_file_path}")
-
-        print(f"   Utilisation de la variable: {sst_variable_name_in_file}")
-        temperatures_raw = source_sst_data[sst_variable_name_in_file].sel(
-            lat=xr.DataArray(grid_df['latitude'], dims="points"),
-            lon=xr.DataArray(grid_df['longitude'], dims="points"),
-            method='nearest'
-        ).values
-
-        # Conversion d'unités: CMEMS SST est souvent en Kelvin. Notre simulation est en Celsius.
-        # Idéalement, vérifier les attributs 'units' du NetCDF.
-        sst_units = source_sst_data[sst_variable_name_in_file].attrs.get('units', '').lower()
-
-        if is_real_sst_data: # Assume real data might be Kelvin
-            if 'kelvin' in sst_units or sst_units == 'k': # Basic check
-                print(f"   Conversion de Kelvin ({sst_units}) vers Celsius.")
-                temperatures_celsius = temperatures_raw - 273.15
-            elif 'celsius' in sst_units or sst_units == 'c' or sst_units == 'degree_celsius': # More robust check for Celsius
-                 print(f"   Les données SST sont déjà en Celsius ({sst_units}).")
-                 temperatures_celsius = temperatures_raw
-            else: # Unknown units, assume Kelvin as per typical CMEMS, but warn
-                print(f"   Unités SST '{sst_units}' non reconnues ou absentes pour les données réelles. Tentative de conversion Kelvin -> Celsius.")
-                print("   NOTE: Vérifier les unités réelles des données CMEMS SST et ajuster si nécessaire.")
-                temperatures_celsius = temperatures_raw - 273.15
-        else: # Fake data is already Celsius (or should be)
-            if 'celsius' in sst_units or sst_units == 'degree_celsius':
-                print(f"   Données SST factices en Celsius ({sst_units}). Aucune conversion.")
-                temperatures_celsius = temperatures_raw
-            else: # If fake data units are missing or not Celsius, still don't convert, but log it.
-                print(f"   Données SST factices avec unités '{sst_units}'. Attendu 'degree_Celsius'. Aucune conversion appliquée.")
-                temperatures_celsius = temperatures_raw
-
-        grid_df['temp_surface_c'] = temperatures_celsius
-        print("-> Données de température projetées.")
-
-    except Exception as e:
-        print(f"   ❌ Erreur lors du traitement du fichier SST {sst_file_path}: {e}")
-        print("   Simulation des températures suite à l'erreur de traitement.")
-        grid_df['temp_surface_c'] = np.random.uniform(10, 20, len(grid_df))
-
-else:
-    print("-> Aucune donnée SST (réelle ou factice) disponible. Simulation des températures.")
-    grid_df['temp_surface_c'] = np.random.uniform(10, 20, len(grid_df)) # Valeur par défaut si échec
-
-
-# Traitement Chlorophylle
-if chl_file_path and is_real_chl_data and os.path.exists(chl_file_path):
-    print(f"-> Chargement des données Chlorophylle réelles depuis {chl_file_path}")
-    try:
-        source_chl_data = xr.open_dataset(chl_file_path)
-
-        chl_variable_name_in_file = CMEMS_CHL_VARIABLE if CMEMS_CHL_VARIABLE in source_chl_data.data_vars else 'chl'
-        if chl_variable_name_in_file not in source_chl_data.data_vars:
-            # Try another common one if the first fails, e.g. CHL1_N (for some products)
-            chl_variable_name_in_file = 'CHL1_N' if 'CHL1_N' in source_chl_data.data_vars else chl_variable_name_in_file
-
-        if chl_variable_name_in_file not in source_chl_data.data_vars:
-             raise ValueError(f"Variable Chlorophylle ('{CMEMS_CHL_VARIABLE}', 'chl', or 'CHL1_N') non trouvée dans {chl_file_path}")
-
-        print(f"   Utilisation de la variable Chlorophylle: {chl_variable_name_in_file}")
-
-        # Projection sur la grille (similaire à SST)
-        # Note: Assurez-vous que les noms de dimension (lat, lon) sont les mêmes dans le fichier CHL.
-        # Si ce n'est pas le cas, il faudra les renommer ou adapter la sélection.
-        # e.g., source_chl_data = source_chl_data.rename({'latitude': 'lat', 'longitude': 'lon'})
-
-        chl_values = source_chl_data[chl_variable_name_in_file].sel(
-            lat=xr.DataArray(grid_df['latitude'], dims="points"),
-            lon=xr.DataArray(grid_df['longitude'], dims="points"),
-            method='nearest'
-        ).values
-
-        grid_df['chlorophylle_mg_m3'] = chl_values
-        # TODO: Vérifier les unités de CHL et convertir si nécessaire.
-        # Les produits L4 NRT sont typiquement en mg/m^3.
-        print(f"-> Données de Chlorophylle réelles projetées. Unités supposées mg/m^3.")
-
-    except Exception as e:
-        print(f"   ❌ Erreur lors du traitement du fichier Chlorophylle {chl_file_path}: {e}")
-        print("   Simulation des données de Chlorophylle suite à l'erreur de traitement.")
-        grid_df['chlorophylle_mg_m3'] = np.random.uniform(0.1, 1.5, len(grid_df))
-else:
-    if is_real_chl_data and not (chl_file_path and os.path.exists(chl_file_path)):
-        print("-> Fichier de données Chlorophylle réel non trouvé après téléchargement supposé réussi. Simulation.")
-    elif not is_real_chl_data and chl_file_path: # Should not happen with current logic
-        print("-> Incohérence: Chemin de fichier CHL présent mais marqué comme non réel. Simulation.")
-    # Default case: No real data attempted or download failed
-    print("-> Aucune donnée de Chlorophylle réelle disponible, simulation des valeurs.")
-    grid_df['chlorophylle_mg_m3'] = np.random.uniform(0.1, 1.5, len(grid_df))
-
-# Traitement Courants
-grid_df['eastward_current_m_s'] = np.nan # Initialize columns
-grid_df['northward_current_m_s'] = np.nan
-
-if cur_file_path and is_real_cur_data and os.path.exists(cur_file_path):
-    print(f"-> Chargement des données Courants réelles depuis {cur_file_path}")
-    try:
-        source_cur_data = xr.open_dataset(cur_file_path)
-
-        u_var_name = CMEMS_CUR_VAR_U if CMEMS_CUR_VAR_U in source_cur_data.data_vars else 'uo'
-        v_var_name = CMEMS_CUR_VAR_V if CMEMS_CUR_VAR_V in source_cur_data.data_vars else 'vo'
-
-        found_u = u_var_name in source_cur_data.data_vars
-        found_v = v_var_name in source_cur_data.data_vars
-
-        if found_u and found_v:
-            print(f"   Utilisation des variables courants: U='{u_var_name}', V='{v_var_name}'")
-
-            # Ensure lat/lon coordinate names match if they differ in currents product
-            # Example: source_cur_data = source_cur_data.rename({'latitude': 'lat', 'longitude': 'lon'})
-
-            u_values = source_cur_data[u_var_name].sel(
-                lat=xr.DataArray(grid_df['latitude'], dims="points"),
-                lon=xr.DataArray(grid_df['longitude'], dims="points"),
-                method='nearest'
-            ).values
-
-            v_values = source_cur_data[v_var_name].sel(
-                lat=xr.DataArray(grid_df['latitude'], dims="points"),
-                lon=xr.DataArray(grid_df['longitude'], dims="points"),
-                method='nearest'
-            ).values
-
-            grid_df['eastward_current_m_s'] = u_values
-            grid_df['northward_current_m_s'] = v_values
-            # TODO: Unit conversion if necessary. Assume m/s for now.
-            print(f"-> Données de Courants réelles projetées. Unités supposées m/s.")
+# Marge (degrés) gardée autour de la zone d'étude lors de la lecture des fichiers sources,
+# pour que les points en bordure de grille aient toujours leurs voisins.
+SOURCE_BBOX_MARGIN = 0.25
+# Découpage dask des fichiers sources (si dask est installé) ; sinon lecture paresseuse simple de xarray.
+SOURCE_CHUNKS = "auto"
+
+@contextmanager
+def open_source_subset(file_path: str, lat_min: float = LAT_MIN, lat_max: float = LAT_MAX, lon_min: float = LON_MIN, lon_max: float = LON_MAX, margin: float = SOURCE_BBOX_MARGIN, open_kwargs: dict | None = None):
+    """
+    Ouvre un fichier NetCDF sans le charger et le restreint à l'emprise de la grille avant toute lecture.
+    Seules les valeurs de la zone d'étude sont lues : la mémoire dépend de la zone, pas de la taille du fichier
+    (les fichiers L4 CMEMS couvrent tout le plateau européen). Le fichier est fermé en sortie du bloc `with`.
+    """
+    chunks = SOURCE_CHUNKS if importlib.util.find_spec("dask") is not None else None
+    with xr.open_dataset(file_path, chunks=chunks, **(open_kwargs or {})) as source_ds:
+        lat_name = 'lat' if 'lat' in source_ds.coords else 'latitude'
+        lon_name = 'lon' if 'lon' in source_ds.coords else 'longitude'
+        selection = {}
+        for name, low, high in ((lat_name, lat_min - margin, lat_max + margin), (lon_name, lon_min - margin, lon_max + margin)):
+            axis = source_ds[name].values
+            # Les coordonnées peuvent être décroissantes (latitudes de certains produits)
+            selection[name] = slice(low, high) if len(axis) < 2 or axis[0] <= axis[-1] else slice(high, low)
+        yield source_ds.sel(selection)
+
+# Méthode de projection des champs sources sur la grille ('nearest' ou 'bilinear').
+# Les tables d'indices/poids sont calculées une fois par couple de grilles puis réutilisées (data/regrid_weights).
+REGRID_METHOD = "nearest"
+
+def read_source_fields(source_ds: xr.Dataset, source: dict, days: int = 1) -> tuple[dict, dict]:
+    """
+    Champs (jours, lat, lon) des variables d'une source et leurs unités. Pour un fichier multi-jours, un pas de temps
+    par jour (le dernier disponible s'il y en a moins) ; un champ sans dimension temps sert pour tous les jours.
+    Pour les autres dimensions (profondeur), le premier niveau est utilisé.
+    """
+    lat_name = 'lat' if 'lat' in source_ds.coords else 'latitude'
+    lon_name = 'lon' if 'lon' in source_ds.coords else 'longitude'
+    fields, units = {}, {}
+    for column, names in source['variables'].items():
+        name = next((n for n in names if n in source_ds.data_vars), None)
+        if name is None:
+            raise ValueError(f"variable {' / '.join(repr(n) for n in names)} non trouvée")
+        field = source_ds[name]
+        if 'time' in field.dims:
+            # Sélection avant lecture : seuls les pas de temps utiles sont lus
+            values = field.isel(time=np.minimum(np.arange(days), field.sizes['time'] - 1)).transpose('time', ..., lat_name, lon_name).values
         else:
-            if not found_u:
-                print(f"   ⚠️ Variable courant Est ('{CMEMS_CUR_VAR_U}' ou 'uo') non trouvée dans {cur_file_path}.")
-            if not found_v:
-                print(f"   ⚠️ Variable courant Nord ('{CMEMS_CUR_VAR_V}' ou 'vo') non trouvée dans {cur_file_path}.")
-            print("   Simulation des données de courants (NaN) car variables manquantes.")
-            # Columns already initialized to np.nan
+            values = field.transpose(..., lat_name, lon_name).values[np.newaxis]
+        values = values.reshape((len(values), -1) + values.shape[-2:])[:, 0]
+        fields[column] = np.broadcast_to(values, (days,) + values.shape[1:])
+        units[column] = field.attrs.get('units') or source.get('units', {}).get(column, '')
+    return fields, units
+
+def simulate_values(spec: tuple, shape: tuple, rng: np.random.Generator) -> np.ndarray:
+    kind, low, high = spec
+    if kind == 'randint':
+        return rng.integers(low, high, shape)
+    return rng.uniform(low, high, shape)
+
+def sample_sources(grid_df: pd.DataFrame, fetch_results: dict, days: int = 1, rng: np.random.Generator | None = None) -> tuple[dict, dict]:
+    """
+    Projette toutes les sources du registre sur les points de la grille, pour `days` jours à la fois.
+    Les fichiers sont lus un par un (restreints à la zone), puis toutes les variables qui partagent une même
+    grille source sont projetées en un seul gather. Retourne ({colonne: (jours, points)}, {colonne: unités source}).
+    """
+    dst_lat, dst_lon = grid_df['latitude'].to_numpy(), grid_df['longitude'].to_numpy()
+    groups = {}   # Regridder partagé -> (regridder, {(source, colonne): champ})
+    source_units, loaded = {}, {}
+    for name, source in SOURCES.items():
+        path, is_real = fetch_results[name]
+        if not (path and os.path.exists(path)):
+            continue
+        print(f"-> Chargement des données {source['label']} depuis {path} (Réel: {is_real})")
+        # Lecture de la zone utile et tables de regrillage (calculées au premier passage sur ce couple de grilles)
+        with telemetry.span("source_read", source=name, path=path, file_bytes=os.path.getsize(path), real_data=bool(is_real)) as record:
+            try:
+                with open_source_subset(path, open_kwargs=source.get('open_kwargs')) as source_ds:
+                    fields, units = read_source_fields(source_ds, source, days)
+                    lat_name = 'lat' if 'lat' in source_ds.coords else 'latitude'
+                    lon_name = 'lon' if 'lon' in source_ds.coords else 'longitude'
+                    regridder = get_regridder(source_ds[lat_name].values, source_ds[lon_name].values, dst_lat, dst_lon, source.get('regrid', REGRID_METHOD))
+            except Exception as e:
+                print(f"   ❌ Erreur lors du traitement du fichier {source['label']} {path}: {e}")
+                record["error"] = f"{type(e).__name__}: {e}"
+                continue
+        _, group = groups.setdefault(id(regridder), (regridder, {}))
+        group.update({(name, column): values for column, values in fields.items()})
+        loaded[name] = units
+
+    # Un gather par grille source, toutes variables et tous jours confondus
+    sampled = {name: {} for name in loaded}
+    for regridder, fields in groups.values():
+        sources = sorted({name for name, _ in fields})
+        with telemetry.span("regrid", source=",".join(sources), method=regridder.method, variables=len(fields), days=days, points=len(grid_df)):
+            for (name, column), values in regridder.apply_many(fields).items():
+                sampled[name][column] = values
+
+    columns, shape = {}, (days, len(grid_df))
+    rng = rng if rng is not None else simulation_rng()
+    for name, source in SOURCES.items():
+        fields = sampled.get(name)
+        if fields is not None:
+            units = loaded[name]
+            if source.get('derive') is not None:
+                fields, units = source['derive'](fields, units)
+            columns.update(fields)
+            source_units.update(units)
+            print(f"-> Données {source['label']} projetées ({', '.join(fields)}).")
+            continue
+        # Repli : valeurs simulées (déjà dans l'unité attendue) ou NaN
+        simulate = source.get('simulate') or {}
+        for column in source_columns(source):
+            columns[column] = simulate_values(simulate[column], shape, rng) if column in simulate else np.full(shape, np.nan)
+        print(f"-> Aucune donnée {source['label']} disponible : {'valeurs simulées' if simulate else 'valeurs mises à NaN'}.")
+    return columns, source_units
+
+def project_forecast_on_grid(grid_df: pd.DataFrame, fetch_results: dict, days: int, rng: np.random.Generator | None = None) -> list[pd.DataFrame]:
+    """
+    Une grille par jour de la fenêtre téléchargée (copies de `grid_df` complétées par toutes les sources),
+    unités converties et plages contrôlées (valeurs implausibles masquées : NaN + qc_flags).
+    """
+    print("\n3. Projection des données sur notre grille...")
+    columns, source_units = sample_sources(grid_df, fetch_results, days, rng)
+    print("-> Normalisation des unités et contrôle des plages de valeurs...")
+    day_frames = []
+    with telemetry.span("normalize", days=days, points=len(grid_df)):
+        for time_index in range(days):
+            day_df = grid_df.assign(**{column: values[time_index] for column, values in columns.items()})
+            day_frames.append(variables.normalize_grid(day_df, source_units))
+    return day_frames
+
+def project_sources_on_grid(grid_df: pd.DataFrame, fetch_results: dict, rng: np.random.Generator | None = None) -> pd.DataFrame:
+    """Projette les données téléchargées (ou simulées) du jour sur la grille. Retourne la grille complétée."""
+    return project_forecast_on_grid(grid_df, fetch_results, 1, rng)[0]
+
+
+# --- ÉTAPE 2 à 4 POUR UNE JOURNÉE ---
+DAILY_OUTPUT_DIR = "data"
+
+def daily_output_path(date: datetime, output_dir: str = DAILY_OUTPUT_DIR, extension: str = grid_store.ARROW_EXTENSION) -> str:
+    return os.path.join(output_dir, f"daily_data_{date.strftime('%Y%m%d')}{extension}")
+
+def daily_output_exists(date: datetime) -> bool:
+    # Sans pyarrow, la sortie est un CSV (voir grid_store.write_table)
+    extension = grid_store.ARROW_EXTENSION if grid_store.pa is not None else grid_store.CSV_EXTENSION
+    return os.path.exists(daily_output_path(date, extension=extension))
+
+def build_provenance(current_date: datetime, fetch_results: dict) -> dict:
+    """Métadonnées enregistrées avec la grille : origine réelle/simulée de chaque source."""
+    return {
+        "date": current_date.strftime('%Y-%m-%d'),
+        "bbox": [LAT_MIN, LAT_MAX, LON_MIN, LON_MAX],
+        "resolution": RESOLUTION,
+        **{source['provenance']: bool(fetch_results[name][1]) for name, source in SOURCES.items()},
+    }
 
-    except Exception as e:
-        print(f"   ❌ Erreur lors du traitement du fichier Courants {cur_file_path}: {e}")
-        print("   Simulation des données de courants (NaN) suite à l'erreur de traitement.")
-        # Columns already initialized to np.nan
-else:
-    if is_real_cur_data and not (cur_file_path and os.path.exists(cur_file_path)):
-        print("-> Fichier de données courants réel non trouvé après téléchargement supposé réussi. Simulation (NaN).")
-    # Default case: No real data attempted or download failed
-    print("-> Aucune donnée de courants réelle disponible, valeurs mises à NaN.")
-    # Columns already initialized to np.nan
-
-# Traitement Vent Météo-France
-# Default simulation, will be overwritten if real data is processed successfully
-grid_df['vent_noeuds'] = np.random.randint(5, 25, len(grid_df))
-print("-> Vent (vitesse en noeuds) simulé (par défaut).")
-
-if mf_wind_filepath and is_real_mf_wind_data and os.path.exists(mf_wind_filepath):
-    print(f"-> Tentative de traitement des données Vent Météo-France réelles depuis {mf_wind_filepath}...")
-    try:
-        # Example GRIB loading - requires cfgrib engine and correct GRIB keys
-        # ds_wind = xr.open_dataset(
-        #     mf_wind_filepath,
-        #     engine="cfgrib",
-        #     backend_kwargs={'filter_by_keys': {'typeOfLevel': 'heightAboveGround', 'level': 10, 'stepType': 'instant'}}
-        #     # Adjust keys based on GRIB file content: e.g. typeOfLevel: 'surface' or 'heightAboveGround', level for 10m winds.
-        # )
-        print("   NOTE: La logique de traitement réelle pour les données Vent Météo-France (GRIB) n'est pas implémentée.")
-
-        # Placeholder variable names for U and V components at 10m
-        # wind_u_var_name = 'u10' # Or '10u', check GRIB shortName or paramId
-        # wind_v_var_name = 'v10' # Or '10v'
-
-        # if wind_u_var_name in ds_wind and wind_v_var_name in ds_wind:
-        #     u10_wind = ds_wind[wind_u_var_name]
-        #     v10_wind = ds_wind[wind_v_var_name]
-
-        #     # Calculate wind speed from U and V components
-        #     # Data is likely on its own grid, needs projection to our grid_df
-        #     # This is a complex step involving reprojection if grids don't match.
-        #     # For simplicity, let's assume for this placeholder that we can select nearest like others.
-        #     # This would need lat/lon alignment similar to other xr.sel operations.
-
-        #     # wind_speed_ms_raw = np.sqrt(u10_wind**2 + v10_wind**2)
-
-        #     # # Example projection (assuming ds_wind has 'latitude' and 'longitude' coordinates aligned with our needs)
-        #     # wind_speed_ms_points = wind_speed_ms_raw.sel(
-        #     #     latitude=xr.DataArray(grid_df['latitude'], dims="points"),
-        #     #     longitude=xr.DataArray(grid_df['longitude'], dims="points"),
-        #     #     method='nearest'
-        #     # ).values
-
-        #     # wind_speed_knots = wind_speed_ms_points * 1.94384 # Convert m/s to knots
-        #     # grid_df['vent_noeuds'] = wind_speed_knots
-        #     # print(f"-> Données de Vent Météo-France réelles projetées en noeuds.")
-        # else:
-        #     print(f"   ⚠️ Variables Vent U/V non trouvées dans {mf_wind_filepath}. Utilisation des données simulées.")
-
-        # Since actual processing is not implemented, we explicitly state it and keep simulated data.
-        print("   Traitement réel des données Vent non effectué. Utilisation des données simulées.")
+def grid_columns(static_grid_df: pd.DataFrame) -> list[str]:
+    """Colonnes de la grille statique recopiées dans chaque sortie : les variables statiques seulement sans store."""
+    columns = [static_features.CELL_ID_COLUMN, 'latitude', 'longitude']
+    if not static_grid_df.attrs.get('thonia', {}).get("store_path"):
+        columns += static_features.STATIC_COLUMNS
+    return columns
 
-    except Exception as e:
-        print(f"   ❌ Erreur lors du traitement du fichier Vent Météo-France {mf_wind_filepath}: {e}")
-        print("   Utilisation des données de vent simulées suite à l'erreur de traitement.")
-        # Ensures vent_noeuds retains its simulated values if an error occurs here
-else:
-    if is_real_mf_wind_data and not (mf_wind_filepath and os.path.exists(mf_wind_filepath)):
-        print("-> Fichier de données Vent Météo-France réel non trouvé après téléchargement supposé. Simulation.")
-    # Default case: No real data attempted or download failed, message already printed by default simulation.
-
-# Traitement Vagues Météo-France
-grid_df['wave_height_m'] = np.nan
-grid_df['wave_direction_deg'] = np.nan
-grid_df['wave_period_s'] = np.nan
-print("-> Données de vagues initialisées à NaN (placeholder).")
-
-if mf_wave_filepath and is_real_mf_wave_data and os.path.exists(mf_wave_filepath):
-    print(f"-> Tentative de traitement des données Vagues Météo-France réelles depuis {mf_wave_filepath}...")
+def process_day(current_date: datetime, static_grid_df: pd.DataFrame, export_csv: bool = False) -> str:
+    """
+    Télécharge, projette et sauvegarde les données d'une journée. Retourne le chemin du fichier produit.
+    Seules les variables dynamiques sont écrites, avec `cell_id` pour rejoindre les variables statiques du store
+    (static_features.attach_static_features) ; sans store (bathymétrie simulée), elles sont écrites dans la grille.
+    """
+    with telemetry.span("day", date=current_date.strftime('%Y-%m-%d')):
+        print(f"\n2. Téléchargement et lecture des données sources et contextuelles ({current_date.strftime('%Y-%m-%d')})...")
+        grid_df = static_grid_df[grid_columns(static_grid_df)].copy()
+
+        # Télécharger/simuler les données CMEMS, Météo-France et marées en parallèle
+        fetch_results = run_fetch_stage(current_date, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX)
+        tide_data_today = fetch_results['tide']
+
+        # Phase de la Lune (calcul local)
+        moon_phase_today = get_moon_phase(current_date)
+
+        print("\n--- Données Contextuelles du Jour ---")
+        if tide_data_today:
+            print(f"Marées ({tide_data_today.get('port_name', 'N/A')}):")
+            for tide_event in tide_data_today.get('tides', []):
+                print(f"  - {tide_event['type']} à {tide_event['time']}, Hauteur: {tide_event['height_m']}m")
+        else:
+            print("Aucune donnée de marée disponible.")
+        print(f"Phase de la Lune: {moon_phase_today}")
+        print("------------------------------------")
+
+        grid_df = project_sources_on_grid(grid_df, fetch_results, simulation_rng(current_date))
+
+        # --- ÉTAPE 4: SAUVEGARDER LE RÉSULTAT DU JOUR ---
+        os.makedirs(DAILY_OUTPUT_DIR, exist_ok=True) # S'assurer que le dossier de sortie final existe
+        # Arrow IPC typé (float32/int8) + provenance, écrit de façon atomique : un fichier existant est
+        # toujours complet (utile pour la reprise d'un backfill). Le CSV n'est plus qu'un export optionnel.
+        provenance = build_provenance(current_date, fetch_results)
+        provenance["static_features"] = static_grid_df.attrs.get('thonia', {}).get("store_path")
+        # Résumé du jour pour le chatbot (statistiques, marées, lune, provenance), écrit avant la grille
+        # pour qu'il soit déjà en place quand le serveur détecte le nouveau fichier.
+        digest = context_digest.build_environment_digest(grid_df, provenance, tide_data_today, moon_phase_today)
+        with telemetry.span("write", rows=len(grid_df)) as record:
+            context_digest.write_digest(context_digest.digest_path(daily_output_path(current_date)), digest)
+            output_path = grid_store.write_table(grid_df, daily_output_path(current_date), metadata=provenance)
+            record.update(path=output_path, bytes_written=os.path.getsize(output_path))
+            if export_csv and not output_path.endswith(grid_store.CSV_EXTENSION):
+                csv_path = grid_store.write_table(grid_df, daily_output_path(current_date, extension=grid_store.CSV_EXTENSION))
+                record["bytes_written"] += os.path.getsize(csv_path)
+                print(f"   Export CSV: '{csv_path}'.")
+        print(f"\n4. ✅ Pipeline terminé ! Les données du jour ont été sauvegardées dans '{output_path}'.")
+        print("\nAperçu des données prêtes à l'emploi :")
+        print(grid_df.head())
+        return output_path
+
+
+# Grille servie par 3_app.py (DAILY_DATA_STEM) : copie de la dernière grille datée publiée.
+SERVED_OUTPUT_STEM = os.path.join(DAILY_OUTPUT_DIR, "daily_data")
+
+def _copy_atomically(source_path: str, destination_path: str):
+    partial_path = f"{destination_path}.{os.getpid()}.part"
+    shutil.copyfile(source_path, partial_path)
+    os.replace(partial_path, destination_path)
+
+def publish_daily_output(output_path: str) -> str | None:
+    """
+    Publie une grille datée comme grille servie (data/daily_data.arrow), avec son résumé : copies atomiques,
+    résumé d'abord, pour que le serveur ne voie jamais une grille sans son résumé ni un fichier partiel.
+    Une grille plus ancienne que celle déjà publiée (backfill) n'est pas publiée. Retourne le chemin publié.
+    """
+    served_path = SERVED_OUTPUT_STEM + os.path.splitext(output_path)[1]
+    digest = context_digest.read_digest(context_digest.digest_path(output_path)) or {}
+    published = context_digest.read_digest(context_digest.digest_path(served_path)) or {}
+    if os.path.exists(served_path) and published.get("date", "") > digest.get("date", ""):
+        print(f"-> Grille servie du {published['date']} conservée ('{output_path}' est plus ancienne).")
+        return None
+    if digest:
+        _copy_atomically(context_digest.digest_path(output_path), context_digest.digest_path(served_path))
+    _copy_atomically(output_path, served_path)
+    print(f"-> Grille publiée pour le serveur : '{served_path}'.")
+    return served_path
+
+
+# --- MODE PRÉVISION : CUBE SUR PLUSIEURS JOURS ---
+FORECAST_OUTPUT_STEM = os.path.join(DAILY_OUTPUT_DIR, "forecast") # Dernière prévision, lue par le serveur
+
+def process_forecast(start: datetime, days: int, static_grid_df: pd.DataFrame, export_csv: bool = False) -> str:
+    """
+    Prévision sur `days` jours à partir de `start` : une seule requête par produit pour toute la fenêtre,
+    puis un cube (jours × cellules × variables) écrit en une table, une ligne par cellule et par jour
+    (colonne grid_store.FORECAST_DATE_COLUMN). Les résumés du chatbot de chaque jour sont écrits à côté.
+    """
+    with telemetry.span("forecast", date=start.strftime('%Y-%m-%d'), days=days):
+        dates = date_range(start, start + timedelta(days=days - 1))
+        print(f"\n2. Téléchargement des prévisions du {dates[0].strftime('%Y-%m-%d')} au {dates[-1].strftime('%Y-%m-%d')} ({days} jours)...")
+        fetch_results = run_fetch_stage(start, LAT_MIN, LAT_MAX, LON_MIN, LON_MAX, days=days)
+
+        # Toutes les sources et tous les jours projetés en une passe
+        day_frames = project_forecast_on_grid(static_grid_df[grid_columns(static_grid_df)], fetch_results, days, simulation_rng(start))
+        digests = {}
+        for time_index, (current_date, grid_df) in enumerate(zip(dates, day_frames)):
+            day = current_date.strftime('%Y-%m-%d')
+            # Marées du premier jour déjà obtenues avec les téléchargements ; calcul local pour les suivants
+            tide = fetch_results['tide'] if time_index == 0 else fetch_tide_data(current_date, TIDE_REFERENCE_PORT_LAT, TIDE_REFERENCE_PORT_LON)
+            digests[day] = context_digest.build_environment_digest(grid_df, build_provenance(current_date, fetch_results), tide, get_moon_phase(current_date))
+            grid_df.insert(0, grid_store.FORECAST_DATE_COLUMN, day)
+        cube_df = pd.concat(day_frames, ignore_index=True)
+        # Dates en catégories : stockées une fois (dictionnaire Arrow), pas une chaîne par ligne
+        cube_df[grid_store.FORECAST_DATE_COLUMN] = pd.Categorical(cube_df[grid_store.FORECAST_DATE_COLUMN], categories=list(digests))
+
+        os.makedirs(DAILY_OUTPUT_DIR, exist_ok=True)
+        provenance = build_provenance(start, fetch_results)
+        provenance.update({"dates": list(digests), "static_features": static_grid_df.attrs.get('thonia', {}).get("store_path")})
+        output_path = FORECAST_OUTPUT_STEM + grid_store.ARROW_EXTENSION
+        # Résumés écrits avant le cube, comme pour la grille du jour
+        with telemetry.span("write", rows=len(cube_df)) as record:
+            context_digest.write_digest(context_digest.digest_path(output_path), {"days": digests})
+            output_path = grid_store.write_table(cube_df, output_path, metadata=provenance)
+            record.update(path=output_path, bytes_written=os.path.getsize(output_path))
+            if export_csv and not output_path.endswith(grid_store.CSV_EXTENSION):
+                csv_path = grid_store.write_table(cube_df, FORECAST_OUTPUT_STEM + grid_store.CSV_EXTENSION)
+                record["bytes_written"] += os.path.getsize(csv_path)
+                print(f"   Export CSV: '{csv_path}'.")
+        print(f"\n4. ✅ Prévision sur {days} jours ({len(cube_df)} lignes) sauvegardée dans '{output_path}'.")
+        return output_path
+
+
+# --- MODE BACKFILL : PLUSIEURS JOURS EN PARALLÈLE ---
+_worker_static_grid = None
+
+def _init_backfill_worker(static_grid_df: pd.DataFrame, telemetry_settings: dict | None = None):
+    """Reçoit la grille statique une seule fois par processus, et non une fois par jour."""
+    global _worker_static_grid
+    _worker_static_grid = static_grid_df
+    # Spans des workers dans le même journal et sous le même run_id que le processus principal
+    if telemetry_settings is not None:
+        telemetry.configure(**telemetry_settings)
+
+def _process_day_in_worker(current_date: datetime, export_csv: bool) -> str:
+    return process_day(current_date, _worker_static_grid, export_csv=export_csv)
+
+def date_range(start: datetime, end: datetime) -> list[datetime]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+def run_pipeline(start: datetime, end: datetime, workers: int = 1, force: bool = False, export_csv: bool = False) -> tuple[list[str], list[datetime]]:
+    """
+    Traite tous les jours de [start, end]. Les jours dont le fichier de sortie existe déjà sont ignorés
+    (sauf `force`). Avec plusieurs jours et `workers` > 1, les jours sont répartis sur un pool de processus.
+    Dans les deux cas, un jour en échec n'interrompt pas les suivants. Retourne (fichiers produits, jours en échec).
+    """
+    days = date_range(start, end)
+    todo = [day for day in days if force or not daily_output_exists(day)]
+    skipped = len(days) - len(todo)
+    if skipped:
+        print(f"-> {skipped} jour(s) déjà traité(s) ignoré(s) (utilisez --force pour les recalculer).")
+    if not todo:
+        return [], []
+
+    static_grid_df = build_static_grid()
+    outputs, failures = [], []
+    started = time.monotonic()
+
+    with ExitStack() as stack:
+        if workers <= 1 or len(todo) == 1:
+            # Jours traités l'un après l'autre dans ce processus
+            completed = ((day, partial(process_day, day, static_grid_df, export_csv=export_csv)) for day in todo)
+        else:
+            # Créé avant le lancement des workers pour qu'ils ne l'écrivent pas en même temps.
+            create_fake_netcdf_data()
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers, initializer=_init_backfill_worker,
+                                                           initargs=(static_grid_df, telemetry.current().settings() if telemetry.current() else None)))
+            futures = {pool.submit(_process_day_in_worker, day, export_csv): day for day in todo}
+            completed = ((futures[future], future.result) for future in as_completed(futures))
+        for done, (day, result) in enumerate(completed, start=1):
+            try:
+                outputs.append(result())
+                status = "✅"
+            except Exception as e:
+                failures.append(day)
+                status = f"❌ ({type(e).__name__}: {e})"
+            elapsed = time.monotonic() - started
+            eta = elapsed / done * (len(todo) - done)
+            print(f"[backfill {done}/{len(todo)}] {day.strftime('%Y-%m-%d')} {status} — {elapsed:.0f}s écoulées, ~{eta:.0f}s restantes")
+
+    if failures:
+        print(f"⚠️ {len(failures)} jour(s) en échec: {', '.join(d.strftime('%Y-%m-%d') for d in sorted(failures))}")
+    if outputs:
+        # Noms datés (daily_data_AAAAMMJJ) : le plus grand est le jour le plus récent
+        publish_daily_output(max(outputs))
+    return outputs, failures
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pipeline de données ThonIA (un jour ou une période).")
+    parser.add_argument("--start", type=lambda v: datetime.strptime(v, "%Y-%m-%d"), help="Premier jour (AAAA-MM-JJ). Par défaut : aujourd'hui.")
+    parser.add_argument("--end", type=lambda v: datetime.strptime(v, "%Y-%m-%d"), help="Dernier jour inclus (AAAA-MM-JJ). Par défaut : --start.")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de processus pour le backfill.")
+    parser.add_argument("--force", action="store_true", help="Recalcule les jours dont le fichier de sortie existe déjà.")
+    parser.add_argument("--export-csv", action="store_true", help="Écrit aussi une copie CSV de chaque grille journalière.")
+    parser.add_argument("--forecast-days", type=int, default=1, help="Prévision sur N jours à partir de --start (cube servi par /api/predictions?date=).")
+    parser.add_argument("--run-log", default=telemetry.RUN_LOG_PATH, help="Journal JSON-lines des étapes (durée, CPU, mémoire, octets, provenance). Vide pour désactiver.")
+    parser.add_argument("--prometheus-textfile", default=telemetry.PROMETHEUS_TEXTFILE, help="Fichier texte Prometheus (node_exporter) résumant le dernier run.")
+    parser.add_argument("--profile-stage", action="append", default=[], metavar="ÉTAPE", help="Profile une étape (grid, bathymetry, fetch, source_read, regrid, normalize, write...). Répétable.")
+    parser.add_argument("--profiler", choices=telemetry.PROFILERS, default="cprofile", help="Profileur des étapes choisies (pyinstrument : optionnel).")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = args.start or datetime.now() # Use current date, or specific date for reproducibility
+    end = args.end or start
+    if end < start:
+        raise SystemExit("❌ --end doit être postérieur ou égal à --start.")
+    if args.forecast_days > 1 and args.end:
+        raise SystemExit("❌ --forecast-days ne se combine pas avec --end (la fenêtre part de --start).")
+    recorder = None
+    failures = []
+    if args.run_log:
+        recorder = telemetry.configure(log_path=args.run_log, prometheus_path=args.prometheus_textfile,
+                                       profile_stages=args.profile_stage, profiler=args.profiler)
     try:
-        # Example GRIB loading for waves
-        # ds_wave = xr.open_dataset(
-        #     mf_wave_filepath,
-        #     engine="cfgrib",
-        #     backend_kwargs={'filter_by_keys': {'typeOfLevel': 'surface'}} # Or other relevant keys for wave products
-        # )
-        print("   NOTE: La logique de traitement réelle pour les données Vagues Météo-France (GRIB) n'est pas implémentée.")
-
-        # Placeholder variable names for wave parameters
-        # wave_height_var = 'VHM0'       # Significant wave height (e.g., from MFWAM)
-        # wave_direction_var = 'VMDR_WW' # Mean wave direction from wind waves (e.g., from MFWAM)
-        # wave_period_var = 'VTM02_WW'   # Mean period of wind waves (e.g., VTM02 in MFWAM) or primary/secondary period.
-                                         # Could also be TMW, TP, etc. depending on product.
-
-        # if wave_height_var in ds_wave and wave_direction_var in ds_wave and wave_period_var in ds_wave:
-        #     swh_raw = ds_wave[wave_height_var]
-        #     mwd_raw = ds_wave[wave_direction_var]
-        #     mwp_raw = ds_wave[wave_period_var]
-
-        #     # Project onto grid_df - similar complex step as wind if grids/coords don't match
-        #     # grid_df['wave_height_m'] = swh_raw.sel(...).values
-        #     # grid_df['wave_direction_deg'] = mwd_raw.sel(...).values
-        #     # grid_df['wave_period_s'] = mwp_raw.sel(...).values
-        #     print(f"-> Données de Vagues Météo-France réelles projetées.")
-        #     # TODO: Ensure units are m, degrees, seconds. Add conversions if needed.
-        # else:
-        #     print(f"   ⚠️ Variables Vagues (hauteur, direction, période) non trouvées dans {mf_wave_filepath}. Valeurs restent NaN.")
-
-        print("   Traitement réel des données Vagues non effectué. Valeurs restent NaN.")
-
-    except Exception as e:
-        print(f"   ❌ Erreur lors du traitement du fichier Vagues Météo-France {mf_wave_filepath}: {e}")
-        print("   Valeurs des données de vagues restent NaN suite à l'erreur de traitement.")
-else:
-    if is_real_mf_wave_data and not (mf_wave_filepath and os.path.exists(mf_wave_filepath)):
-        print("-> Fichier de données Vagues Météo-France réel non trouvé après téléchargement supposé. Valeurs restent NaN.")
-    # Default case: No real data attempted or download failed, message already printed by initialization.
-
-
-# --- ÉTAPE 4: SAUVEGARDER LE RÉSULTAT DU JOUR ---
-output_dir_final = "data"
-os.makedirs(output_dir_final, exist_ok=True) # S'assurer que le dossier de sortie final existe
-output_path = os.path.join(output_dir_final, f"daily_data_{current_date.strftime('%Y%m%d')}.csv")
-grid_df.to_csv(output_path, index=False, float_format='%.2f')
-print(f"\n4. ✅ Pipeline terminé ! Les données du jour ont été sauvegardées dans '{output_path}'.")
-print("\nAperçu des données prêtes à l'emploi :")
-print(grid_df.head())
\ No newline at end of file
+        with telemetry.span("run", first_day=start.strftime('%Y-%m-%d'), last_day=end.strftime('%Y-%m-%d'),
+                            forecast_days=args.forecast_days, workers=args.workers):
+            if args.forecast_days > 1:
+                process_forecast(start, args.forecast_days, build_static_grid(), export_csv=args.export_csv)
+            else:
+                _, failures = run_pipeline(start, end, workers=args.workers, force=args.force, export_csv=args.export_csv)
+    finally:
+        if recorder is not None:
+            prometheus_path = recorder.write_prometheus()
+            print(f"-> Journal du run {recorder.run_id} : {recorder.log_path}" + (f", métriques Prometheus : {prometheus_path}" if prometheus_path else ""))
+    if failures:
+        # Jours restants traités quand même ; le code de sortie signale l'échec (cron, orchestrateur)
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
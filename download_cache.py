@@ -0,0 +1,157 @@
+# download_cache.py
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+META_SUFFIX = ".meta.json"
+PARTIAL_SUFFIX = ".part"
+CACHE_MAX_BYTES = 2 * 1024 ** 3   # Taille maximale par dossier de cache (2 Go)
+CACHE_MAX_AGE_DAYS = 30           # Les fichiers plus anciens sont supprimés
+
+
+def cache_key(product_id: str, variables: list[str], bbox: tuple, date: datetime, days: int = 1) -> str:
+    """Clé d'un téléchargement : (produit, variables, emprise, premier jour, nombre de jours)."""
+    window = date.strftime('%Y-%m-%d') + (f"+{days}d" if days > 1 else "")
+    parts = [product_id, ",".join(sorted(variables)), ",".join(f"{v:.4f}" for v in bbox), window]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadCache:
+    """
+    Cache des fichiers sources (NetCDF/GRIB) d'un dossier comme data/cmems.
+    Chaque fichier a un fichier compagnon `.<nom>.meta.json` (clé, taille, empreinte SHA-256) ;
+    un fichier n'est réutilisé que s'il est intact. Pas d'index partagé : plusieurs processus
+    (backfill) peuvent alimenter le même dossier sans se marcher dessus.
+    Les écritures passent par un fichier temporaire renommé atomiquement, donc un run interrompu
+    ne laisse jamais de fichier à moitié écrit.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _meta_path(self, filename: str) -> str:
+        return os.path.join(self.root_dir, f".{filename}{META_SUFFIX}")
+
+    def _read_meta(self, filename: str) -> dict | None:
+        try:
+            with open(self._meta_path(filename), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, filename: str, entry: dict):
+        meta_path = self._meta_path(filename)
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}{PARTIAL_SUFFIX}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, meta_path)
+
+    def partial_path(self, filename: str) -> str:
+        """Chemin temporaire dans lequel écrire un téléchargement avant de le valider."""
+        return os.path.join(self.root_dir, f".{filename}.{os.getpid()}.{threading.get_ident()}{PARTIAL_SUFFIX}")
+
+    def lookup(self, key: str, filename: str, require_real: bool = True) -> str | None:
+        """Chemin du fichier en cache s'il correspond à la clé et que sa taille et son empreinte sont correctes."""
+        entry = self._read_meta(filename)
+        if entry is None or entry.get("key") != key or (require_real and not entry.get("is_real")):
+            return None
+        path = os.path.join(self.root_dir, filename)
+        try:
+            if os.path.getsize(path) != entry["size"] or file_sha256(path) != entry["sha256"]:
+                print(f"   ⚠️ Fichier en cache corrompu ou remplacé: {path}. Nouveau téléchargement nécessaire.")
+                return None
+        except FileNotFoundError:
+            return None
+        return path
+
+    def commit(self, key: str, partial_path: str, filename: str, is_real: bool = True, **metadata) -> str | None:
+        """Valide un fichier temporaire : contrôle, renommage atomique, puis écriture des métadonnées."""
+        if not os.path.exists(partial_path) or os.path.getsize(partial_path) == 0:
+            print(f"   ⚠️ Téléchargement vide ou absent ({partial_path}). Fichier ignoré.")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return None
+        entry = {
+            "key": key,
+            "size": os.path.getsize(partial_path),
+            "sha256": file_sha256(partial_path),
+            "is_real": is_real,
+            "created": time.time(),
+            **metadata,
+        }
+        final_path = os.path.join(self.root_dir, filename)
+        os.replace(partial_path, final_path)
+        # Écrites après le renommage : un crash entre les deux provoque seulement un nouveau téléchargement.
+        self._write_meta(filename, entry)
+        return final_path
+
+    def put_copy(self, key: str, source_path: str, filename: str, is_real: bool = False, **metadata) -> str | None:
+        """Copie un fichier local dans le cache (ex. données factices), sans recopier s'il est déjà en place."""
+        cached = self.lookup(key, filename, require_real=False)
+        if cached:
+            return cached
+        partial = self.partial_path(filename)
+        shutil.copyfile(source_path, partial)
+        return self.commit(key, partial, filename, is_real=is_real, **metadata)
+
+    def evict(self, max_bytes: int = CACHE_MAX_BYTES, max_age_days: float = CACHE_MAX_AGE_DAYS) -> int:
+        """Supprime les fichiers trop anciens, puis les plus anciens tant que le dossier dépasse `max_bytes`."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            if name.endswith(PARTIAL_SUFFIX):
+                # Fichiers temporaires laissés par un run interrompu
+                try:
+                    if now - os.path.getmtime(path) > 24 * 3600:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+            elif name.startswith(".") and name.endswith(META_SUFFIX):
+                filename = name[1:-len(META_SUFFIX)]
+                entry = self._read_meta(filename)
+                if entry is not None:
+                    entries.append((entry.get("created", 0), entry.get("size", 0), filename))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for created, size, filename in entries:
+            if now - created <= max_age_days * 24 * 3600 and total <= max_bytes:
+                break
+            for path in (os.path.join(self.root_dir, filename), self._meta_path(filename)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        if removed:
+            print(f"-> Cache {self.root_dir}: {removed} fichier(s) supprimé(s) (âge/taille).")
+        return removed
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_download_cache(root_dir: str) -> DownloadCache:
+    """Une instance partagée par dossier (les téléchargements tournent en parallèle)."""
+    with _caches_lock:
+        cache = _caches.get(root_dir)
+        if cache is None:
+            cache = _caches[root_dir] = DownloadCache(root_dir)
+        return cache
@@ -29,11 +29,12 @@ chatForm.addEventListener('submit', async (event) => {
         addMessageToChat("...", 'bot-typing');
 
         try {
-            // 3. Appelle notre propre backend pour obtenir une réponse de l'IA
+            // 3. Appelle notre propre backend ; la réponse arrive au fil de l'eau (Server-Sent Events)
             const response = await fetch('http://127.0.0.1:5000/api/chat', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                 },
                 body: JSON.stringify({ message: userMessage }),
             });
@@ -41,13 +42,44 @@ chatForm.addEventListener('submit', async (event) => {
             // Supprime l'indicateur "..."
             document.querySelector('.bot-typing').remove();
 
-            if (!response.ok) {
-                throw new Error('La réponse du serveur n\'était pas OK');
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!contentType.startsWith('text/event-stream')) {
+                // Refus (ThonIA très demandé, délai dépassé...) : réponse JSON classique
+                const data = await response.json();
+                if (!data.reply) {
+                    throw new Error('La réponse du serveur n\'était pas OK');
+                }
+                addMessageToChat(data.reply, 'bot');
+                return;
             }
 
-            const data = await response.json();
-            // 4. Affiche la vraie réponse de l'IA
-            addMessageToChat(data.reply, 'bot');
+            // 4. Affiche la réponse de l'IA au fur et à mesure
+            addMessageToChat("", 'bot');
+            const botMessage = chatDisplay.lastElementChild;
+            let botText = '';
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                for (const rawEvent of events) {
+                    const eventLine = rawEvent.split('\n').find(line => line.startsWith('event: '));
+                    const dataLine = rawEvent.split('\n').find(line => line.startsWith('data: '));
+                    if (!dataLine) continue;
+                    const data = JSON.parse(dataLine.slice(6));
+                    if (eventLine === 'event: error') {
+                        botText += (botText ? '\n' : '') + data.reply;
+                    } else if (data.delta) {
+                        botText += data.delta;
+                    }
+                    botMessage.innerHTML = botText.replace(/\n/g, '<br>');
+                    chatDisplay.scrollTop = chatDisplay.scrollHeight;
+                }
+            }
 
         } catch (error) {
             console.error("Erreur lors de la communication avec le chatbot:", error);
@@ -0,0 +1,148 @@
+# grid_raster.py
+import math
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+TILE_SIZE = 256          # Taille standard des tuiles Leaflet (pixels)
+TILE_CACHE_SIZE = 512    # Nombre de tuiles gardées en mémoire (LRU)
+MAX_TILE_ZOOM = 18
+TILE_FORMATS = ('png', 'f16')
+F16_TILE_MAGIC = b'THT1' # En-tête du format binaire : magic, largeur, hauteur (uint16 little-endian)
+
+
+class GridRaster:
+    """
+    Vue 2D (lat × lon) d'une colonne de la grille journalière.
+    La grille du pipeline est régulière : l'indice d'un point se calcule directement,
+    sans recherche de plus proche voisin.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        lat_axis = np.unique(lats)
+        lon_axis = np.unique(lons)
+        self.lat_min, self.lon_min = lat_axis[0], lon_axis[0]
+        self.lat_step = float(np.median(np.diff(lat_axis))) if len(lat_axis) > 1 else 1.0
+        self.lon_step = float(np.median(np.diff(lon_axis))) if len(lon_axis) > 1 else 1.0
+        self.n_lat = int(round((lat_axis[-1] - self.lat_min) / self.lat_step)) + 1
+        self.n_lon = int(round((lon_axis[-1] - self.lon_min) / self.lon_step)) + 1
+        # Emprise couverte par les cellules (chaque point représente ± un demi-pas)
+        self.bounds = (
+            self.lat_min - self.lat_step / 2, self.lat_min + (self.n_lat - 0.5) * self.lat_step,
+            self.lon_min - self.lon_step / 2, self.lon_min + (self.n_lon - 0.5) * self.lon_step,
+        )
+        self.row = np.rint((lats - self.lat_min) / self.lat_step).astype(np.int64)
+        self.col = np.rint((lons - self.lon_min) / self.lon_step).astype(np.int64)
+        self.values = np.full((self.n_lat, self.n_lon), np.nan, dtype=np.float32)
+        self.values[self.row, self.col] = values
+        # Numéro de ligne du DataFrame pour chaque cellule (-1 si la cellule n'a pas de point)
+        self.point_id = np.full((self.n_lat, self.n_lon), -1, dtype=np.int64)
+        self.point_id[self.row, self.col] = np.arange(len(lats))
+
+    def cell_index(self, lat, lon):
+        """Indices (ligne, colonne) de la cellule contenant chaque position, et masque de validité."""
+        row = np.rint((np.asarray(lat, dtype=np.float64) - self.lat_min) / self.lat_step).astype(np.int64)
+        col = np.rint((np.asarray(lon, dtype=np.float64) - self.lon_min) / self.lon_step).astype(np.int64)
+        inside = (row >= 0) & (row < self.n_lat) & (col >= 0) & (col < self.n_lon)
+        return np.clip(row, 0, self.n_lat - 1), np.clip(col, 0, self.n_lon - 1), inside
+
+    def sample(self, lat, lon) -> np.ndarray:
+        """Valeur de la cellule la plus proche, NaN hors de la grille."""
+        row, col, inside = self.cell_index(lat, lon)
+        return np.where(inside, self.values[row, col], np.nan)
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """Emprise (lat_min, lat_max, lon_min, lon_max) d'une tuile Web Mercator z/x/y."""
+    n = 2 ** z
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def render_tile(raster: GridRaster, z: int, x: int, y: int, size: int = TILE_SIZE) -> np.ndarray | None:
+    """Rééchantillonne le raster sur les pixels de la tuile. Retourne None si la tuile est hors grille."""
+    lat_min, lat_max, lon_min, lon_max = tile_bounds(z, x, y)
+    g_lat_min, g_lat_max, g_lon_min, g_lon_max = raster.bounds
+    if lat_max < g_lat_min or lat_min > g_lat_max or lon_max < g_lon_min or lon_min > g_lon_max:
+        return None
+    n = 2 ** z
+    pixel = (np.arange(size) + 0.5) / size
+    lons = (x + pixel) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixel) / n))))
+    lat_px, lon_px = np.meshgrid(lats, lons, indexing='ij')
+    return raster.sample(lat_px, lon_px)
+
+
+def encode_png(values: np.ndarray | None, size: int = TILE_SIZE) -> bytes:
+    """PNG niveaux de gris + alpha : score quantifié sur 8 bits, transparent hors données."""
+    if values is None:
+        values = np.full((size, size), np.nan, dtype=np.float32)
+    height, width = values.shape
+    valid = ~np.isnan(values)
+    gray = np.where(valid, np.rint(np.clip(values, 0, 1) * 255), 0).astype(np.uint8)
+    alpha = np.where(valid, 255, 0).astype(np.uint8)
+    rows = np.dstack([gray, alpha]).reshape(height, width * 2)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes() # filtre PNG "None" par ligne
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 4, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw, 6))
+        + chunk(b'IEND', b'')
+    )
+
+
+def encode_f16(values: np.ndarray | None, size: int = TILE_SIZE) -> bytes:
+    """Format brut : en-tête (magic, largeur, hauteur) puis scores float16 little-endian, NaN hors données."""
+    if values is None:
+        values = np.full((size, size), np.nan, dtype=np.float32)
+    height, width = values.shape
+    return struct.pack('<4sHH', F16_TILE_MAGIC, width, height) + values.astype('<f2').tobytes()
+
+
+TILE_ENCODERS = {'png': encode_png, 'f16': encode_f16}
+
+
+class TileCache:
+    """Cache LRU des tuiles encodées pour une version donnée de la grille."""
+
+    def __init__(self, raster: GridRaster, maxsize: int = TILE_CACHE_SIZE):
+        self.raster = raster
+        self.maxsize = maxsize
+        self._tiles = OrderedDict()
+        self._empty = {}
+        self._lock = threading.Lock()
+
+    def get(self, z: int, x: int, y: int, fmt: str) -> bytes:
+        key = (z, x, y, fmt)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+
+        values = render_tile(self.raster, z, x, y)
+        if values is None:
+            # Toutes les tuiles hors grille sont identiques : une seule copie par format.
+            if fmt not in self._empty:
+                self._empty[fmt] = TILE_ENCODERS[fmt](None)
+            return self._empty[fmt]
+        tile = TILE_ENCODERS[fmt](values)
+
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.maxsize:
+                self._tiles.popitem(last=False)
+        return tile
@@ -0,0 +1,203 @@
+# grid_store.py
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # pyarrow absent : on reste sur le CSV
+    pa = None
+    pq = None
+
+ARROW_EXTENSION = ".arrow"      # Grille du jour : Arrow IPC, lisible en mémoire mappée
+PARQUET_EXTENSION = ".parquet"  # Jeu d'entraînement : Parquet compressé, lisible par lots
+CSV_EXTENSION = ".csv"          # Export uniquement (et lecture des anciens fichiers)
+METADATA_KEY = b"thonia"
+# Cube de prévision (jours × cellules) : une ligne par cellule et par jour, le jour dans cette colonne (AAAA-MM-JJ)
+FORECAST_DATE_COLUMN = 'forecast_date'
+
+# Types des colonnes connues. Les coordonnées restent en float64 : ce sont les clés des points.
+COLUMN_TYPES = {
+    'cell_id': np.int32,     # Indice de la cellule dans le store des variables statiques
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'bathymetry_m': np.float32,
+    'dist_shelf_break_km': np.float32,
+    'dist_coast_km': np.float32,
+    'cell_area_km2': np.float32,
+    'temp_surface_c': np.float32,
+    'chlorophylle_mg_m3': np.float32,
+    'eastward_current_m_s': np.float32,
+    'northward_current_m_s': np.float32,
+    'vent_noeuds': np.int8,
+    'wave_height_m': np.float32,
+    'wave_direction_deg': np.float32,
+    'wave_period_s': np.float32,
+    'thon_present': np.int8,
+    'qc_flags': np.int16,    # Un bit par variable masquée (voir variables.py)
+}
+
+
+def _arrow_column(name: str, series: pd.Series):
+    dtype = COLUMN_TYPES.get(name)
+    if dtype is None:
+        dtype = np.float32 if pd.api.types.is_float_dtype(series) else None
+        if dtype is None:
+            return pa.array(series)
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if np.issubdtype(dtype, np.integer):
+        # Entiers nullables : une valeur manquante devient null, pas une valeur sentinelle
+        missing = np.isnan(values)
+        return pa.array(np.where(missing, 0, np.rint(values)).astype(dtype), mask=missing if missing.any() else None)
+    return pa.array(values.astype(dtype))
+
+
+def to_arrow_table(df: pd.DataFrame, metadata: dict | None = None):
+    """Table Arrow typée (float32/int8) avec les métadonnées de provenance dans le schéma."""
+    table = pa.table({name: _arrow_column(name, df[name]) for name in df.columns})
+    payload = {"created": datetime.now().isoformat(timespec="seconds"), **(metadata or {})}
+    return table.replace_schema_metadata({METADATA_KEY: json.dumps(payload).encode("utf-8")})
+
+
+def write_table(df: pd.DataFrame, path: str, metadata: dict | None = None) -> str:
+    """
+    Écrit `df` au format indiqué par l'extension (.arrow, .parquet ou .csv), de façon atomique.
+    Sans pyarrow, bascule sur un CSV à côté du chemin demandé. Retourne le chemin écrit.
+    """
+    base, ext = os.path.splitext(path)
+    if ext != CSV_EXTENSION and pa is None:
+        print("   ⚠️ pyarrow non installé (pip install pyarrow). Sauvegarde en CSV à la place.")
+        path, ext = base + CSV_EXTENSION, CSV_EXTENSION
+    partial_path = f"{path}.{os.getpid()}.part"
+    if ext == ARROW_EXTENSION:
+        table = to_arrow_table(df, metadata)
+        with pa.OSFile(partial_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif ext == PARQUET_EXTENSION:
+        pq.write_table(to_arrow_table(df, metadata), partial_path, compression="zstd")
+    elif ext == CSV_EXTENSION:
+        df.to_csv(partial_path, index=False, float_format='%.2f')
+    else:
+        raise ValueError(f"Format de fichier non supporté: {path}")
+    os.replace(partial_path, path)
+    return path
+
+
+def write_batches(batches, path: str, metadata: dict | None = None) -> str:
+    """
+    Écrit une suite de DataFrames de mêmes colonnes dans un seul fichier (.parquet, .arrow ou .csv), lot par lot :
+    la mémoire dépend de la taille d'un lot, pas du fichier. Atomique comme `write_table`. Retourne le chemin écrit.
+    """
+    base, ext = os.path.splitext(path)
+    if ext != CSV_EXTENSION and pa is None:
+        print("   ⚠️ pyarrow non installé (pip install pyarrow). Sauvegarde en CSV à la place.")
+        path, ext = base + CSV_EXTENSION, CSV_EXTENSION
+    if ext not in (ARROW_EXTENSION, PARQUET_EXTENSION, CSV_EXTENSION):
+        raise ValueError(f"Format de fichier non supporté: {path}")
+    partial_path = f"{path}.{os.getpid()}.part"
+    writer = schema = None
+    try:
+        for i, df in enumerate(batches):
+            if ext == CSV_EXTENSION:
+                df.to_csv(partial_path, index=False, float_format='%.2f', mode='w' if i == 0 else 'a', header=i == 0)
+                continue
+            table = to_arrow_table(df, metadata)
+            if writer is None:
+                # Schéma (types et métadonnées) fixé par le premier lot
+                schema = table.schema
+                writer = pa.ipc.new_file(partial_path, schema) if ext == ARROW_EXTENSION else pq.ParquetWriter(partial_path, schema, compression="zstd")
+            writer.write_table(table.cast(schema))
+        if writer is not None:
+            writer.close()
+            writer = None
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    if not os.path.exists(partial_path):
+        raise ValueError(f"Aucune donnée à écrire dans {path}")
+    os.replace(partial_path, path)
+    return path
+
+
+def read_metadata(path: str) -> dict:
+    """Métadonnées de provenance d'un fichier Arrow/Parquet (vide pour un CSV)."""
+    ext = os.path.splitext(path)[1]
+    if pa is None or ext == CSV_EXTENSION:
+        return {}
+    if ext == ARROW_EXTENSION:
+        with pa.memory_map(path, "r") as source:
+            schema = pa.ipc.open_file(source).schema
+    else:
+        schema = pq.read_schema(path)
+    raw = (schema.metadata or {}).get(METADATA_KEY)
+    return json.loads(raw) if raw else {}
+
+
+def read_table(path: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Lit un fichier de grille ou d'entraînement. Les fichiers Arrow sont mappés en mémoire ;
+    les métadonnées de provenance sont disponibles dans `df.attrs['thonia']`.
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == CSV_EXTENSION:
+        df = pd.read_csv(path, usecols=columns)
+        df.attrs['thonia'] = {}
+        return df
+    if pa is None:
+        raise ImportError(f"pyarrow est nécessaire pour lire {path} (pip install pyarrow)")
+    if ext == ARROW_EXTENSION:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    else:
+        table = pq.read_table(path, columns=columns)
+    raw = (table.schema.metadata or {}).get(METADATA_KEY)
+    df = table.to_pandas(split_blocks=True)
+    df.attrs['thonia'] = json.loads(raw) if raw else {}
+    return df
+
+
+def iter_table(path: str, columns: list[str] | None = None, batch_size: int = 65536):
+    """Lit un fichier par lots de `batch_size` lignes (DataFrames), sans le charger entièrement en mémoire."""
+    ext = os.path.splitext(path)[1]
+    if ext == CSV_EXTENSION:
+        yield from pd.read_csv(path, usecols=columns, chunksize=batch_size)
+        return
+    if pa is None:
+        raise ImportError(f"pyarrow est nécessaire pour lire {path} (pip install pyarrow)")
+    if ext == ARROW_EXTENSION:
+        with pa.memory_map(path, "r") as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                yield (batch.select(columns) if columns is not None else batch).to_pandas()
+        return
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def resolve_path(stem: str, extensions=(ARROW_EXTENSION, PARQUET_EXTENSION, CSV_EXTENSION)) -> str:
+    """Premier fichier existant parmi `stem` + extensions (format colonnaire d'abord, CSV en dernier recours)."""
+    for ext in extensions:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    raise FileNotFoundError(f"Aucun fichier trouvé pour {stem} ({', '.join(extensions)})")
+
+
+if __name__ == '__main__':
+    # Conversion entre formats, ex. : python grid_store.py data/dataset.csv data/dataset.parquet
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python grid_store.py <source.csv|.arrow|.parquet> <destination.csv|.arrow|.parquet>")
+        sys.exit(1)
+    source_path, destination_path = sys.argv[1:]
+    written = write_table(read_table(source_path), destination_path, metadata={"converted_from": os.path.basename(source_path), **read_metadata(source_path)})
+    print(f"✅ {source_path} -> {written}")
@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+# Mode production : gunicorn -c gunicorn.conf.py
+# Le modèle et la grille sont chargés dans le processus maître avant le fork (preload_app) :
+# les workers partagent ces pages mémoire en copy-on-write au lieu d'avoir chacun leur copie.
+import gc
+import multiprocessing
+import os
+
+wsgi_app = "wsgi:app"
+bind = os.getenv("THONIA_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("THONIA_WORKERS", min(multiprocessing.cpu_count(), 4)))
+threads = int(os.getenv("THONIA_THREADS", "8"))  # au moins 2x les requêtes chat admises (chat_service.py)
+worker_class = "gthread" if threads > 1 else "sync"
+preload_app = True
+timeout = int(os.getenv("THONIA_TIMEOUT", "60"))                    # /api/chat peut attendre le LLM
+graceful_timeout = int(os.getenv("THONIA_GRACEFUL_TIMEOUT", "30"))  # délai pour finir les requêtes en cours à l'arrêt
+keepalive = 5
+max_requests = int(os.getenv("THONIA_MAX_REQUESTS", "0"))           # recyclage périodique des workers (0 = désactivé)
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+
+def when_ready(server):
+    # Les objets chargés par le maître ne bougeront plus : on les sort du ramasse-miettes pour que
+    # ses passages dans les workers ne touchent pas ces pages (ce qui casserait le partage copy-on-write).
+    gc.freeze()
+    server.log.info("ThonIA prêt : modèle et grille chargés avant le fork (%s workers x %s threads).", workers, threads)
+
+
+def post_fork(server, worker):
+    # Les threads ne survivent pas au fork : chaque worker lance sa propre surveillance des fichiers.
+    from wsgi import thonia_app
+    thonia_app.start_background_tasks()
+
+
+def worker_int(worker):
+    from wsgi import thonia_app
+    thonia_app.stop_background_tasks()
+
+
+def worker_exit(server, worker):
+    from wsgi import thonia_app
+    thonia_app.stop_background_tasks()
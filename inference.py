@@ -0,0 +1,149 @@
+# inference.py
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+try:
+    import onnxruntime
+    from onnxmltools import convert_xgboost
+    from onnxmltools.convert.common.data_types import FloatTensorType
+except ImportError: # Backend ONNX optionnel (pip install onnxmltools onnxruntime)
+    onnxruntime = None
+
+FEATURES = ['latitude', 'longitude', 'temp_surface_c', 'chlorophylle_mg_m3', 'vent_noeuds']
+INFERENCE_BACKENDS = ('xgboost', 'onnx', 'sklearn')
+INFERENCE_BACKEND = os.getenv("THONIA_INFERENCE_BACKEND", "xgboost")
+INFERENCE_THREADS = int(os.getenv("THONIA_INFERENCE_THREADS", "0"))   # 0 = tous les cœurs
+INFERENCE_CHUNK_ROWS = 262144   # Lignes scorées par appel (borne la mémoire des tampons intermédiaires)
+
+
+def stack_features(daily_dfs: list[pd.DataFrame], features: list[str] = FEATURES) -> np.ndarray:
+    """Empile plusieurs grilles journalières de même taille en un cube (jours × cellules × variables), float32."""
+    cube = np.empty((len(daily_dfs), len(daily_dfs[0]), len(features)), dtype=np.float32)
+    for day, daily_df in enumerate(daily_dfs):
+        for j, name in enumerate(features):
+            cube[day, :, j] = daily_df[name].to_numpy(dtype=np.float32, na_value=np.nan)
+    return cube
+
+
+class InferenceEngine:
+    """
+    Scoring par lots d'un tableau (..., variables) : une grille (cellules × variables) ou un cube
+    (jours × cellules × variables). Les lignes sont scorées par tranches de `chunk_rows`.
+
+    Backends :
+    - 'xgboost' : booster natif (`inplace_predict`, sans DataFrame ni DMatrix intermédiaire), threads réglables ;
+    - 'onnx'    : modèle converti et exécuté par onnxruntime (optionnel) ;
+    - 'sklearn' : `predict_proba` du modèle, pour les modèles non XGBoost et comme référence.
+
+    `model` est un classifieur sklearn (ancien models/thonia_model.joblib) ou un `xgb.Booster` du registre.
+    """
+
+    def __init__(self, model, backend: str = INFERENCE_BACKEND, n_threads: int = INFERENCE_THREADS, chunk_rows: int = INFERENCE_CHUNK_ROWS):
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Backend d'inférence inconnu: {backend} (attendu: {', '.join(INFERENCE_BACKENDS)})")
+        self.model = model
+        self.chunk_rows = chunk_rows
+        self.n_threads = n_threads
+        is_booster = isinstance(model, xgb.Booster)
+        if is_booster and backend == 'sklearn':
+            backend = 'xgboost'   # Un booster natif n'a pas de predict_proba
+        if backend != 'sklearn' and not (is_booster or hasattr(model, 'get_booster')):
+            print(f"⚠️ Backend '{backend}' réservé aux modèles XGBoost : utilisation de predict_proba.")
+            backend = 'sklearn'
+        if backend == 'onnx' and onnxruntime is None:
+            print("⚠️ onnxruntime/onnxmltools non installés (pip install onnxmltools onnxruntime) : backend xgboost utilisé.")
+            backend = 'xgboost'
+        self.backend = backend
+
+        if backend == 'xgboost':
+            # Copie du booster : le réglage des threads ne touche pas le modèle partagé
+            self.booster = (model if is_booster else model.get_booster()).copy()
+            if n_threads:
+                self.booster.set_param({'nthread': n_threads})
+        elif backend == 'onnx':
+            # Le convertisseur attend des variables nommées f0, f1... : on convertit une copie sans noms.
+            booster = (model if is_booster else model.get_booster()).copy()
+            booster.feature_names = None
+            onnx_model = convert_xgboost(booster, initial_types=[('input', FloatTensorType([None, booster.num_features()]))])
+            options = onnxruntime.SessionOptions()
+            if n_threads:
+                options.intra_op_num_threads = n_threads
+            self.session = onnxruntime.InferenceSession(onnx_model.SerializeToString(), options, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+
+    def _predict_rows(self, rows: np.ndarray) -> np.ndarray:
+        if self.backend == 'xgboost':
+            return self.booster.inplace_predict(rows)
+        if self.backend == 'onnx':
+            # Sorties du classifieur converti : [labels, probabilités (n, 2)]
+            return self.session.run(None, {self.input_name: rows})[1][:, 1]
+        return self.model.predict_proba(pd.DataFrame(rows, columns=FEATURES))[:, 1]
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Probabilité de présence pour chaque ligne de `features` (..., variables) -> (...)."""
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.ascontiguousarray(features.reshape(-1, features.shape[-1]))
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.chunk_rows):
+            stop = start + self.chunk_rows
+            scores[start:stop] = self._predict_rows(rows[start:stop])
+        return scores.reshape(features.shape[:-1])
+
+    def predict_frame(self, daily_df: pd.DataFrame, features: list[str] = FEATURES) -> np.ndarray:
+        return self.predict(stack_features([daily_df], features)[0])
+
+
+def benchmark(model, days: int = 8, cells: int = 100000, repeat: int = 3, n_threads: int = INFERENCE_THREADS, seed: int = 0) -> dict:
+    """Débit (lignes/s) de chaque backend disponible sur un cube aléatoire (jours × cellules), comparé au scoring par DataFrame."""
+    rng = np.random.default_rng(seed)
+    cube = np.stack([
+        rng.uniform(43.5, 47.5, (days, cells)), rng.uniform(-5.0, -1.5, (days, cells)),
+        rng.uniform(12, 22, (days, cells)), rng.uniform(0.1, 1.5, (days, cells)), rng.integers(0, 30, (days, cells)),
+    ], axis=-1).astype(np.float32)
+    frames = [pd.DataFrame(cube[d], columns=FEATURES) for d in range(days)]
+
+    def best_time(fn):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    # Référence : predict_proba pour un classifieur sklearn, predict sur DMatrix pour un booster du registre
+    if isinstance(model, xgb.Booster):
+        baseline_name, baseline = "dmatrix_predict", lambda frame: model.predict(xgb.DMatrix(frame))
+    else:
+        baseline_name, baseline = "predict_proba", lambda frame: model.predict_proba(frame)[:, 1]
+    results = {"rows": days * cells}
+    reference = np.stack([baseline(frame) for frame in frames])
+    results[baseline_name] = {"seconds": best_time(lambda: [baseline(frame) for frame in frames])}
+    for backend in INFERENCE_BACKENDS[:2]:
+        engine = InferenceEngine(model, backend=backend, n_threads=n_threads)
+        if engine.backend != backend:
+            continue
+        seconds = best_time(lambda: engine.predict(cube))
+        results[backend] = {"seconds": seconds, "max_abs_diff": float(np.abs(engine.predict(cube) - reference).max())}
+    for entry in results.values():
+        if isinstance(entry, dict):
+            entry["rows_per_s"] = round(results["rows"] / entry["seconds"])
+            entry["speedup"] = round(results[baseline_name]["seconds"] / entry["seconds"], 2)
+    return results
+
+
+if __name__ == '__main__':
+    # Comparaison des backends : python inference.py [jours] [cellules]
+    import sys
+    import model_registry
+    model = model_registry.load_model(model_registry.current_model_path('models/thonia_model.joblib'))
+    days, cells = (int(v) for v in (sys.argv[1:3] if len(sys.argv) >= 3 else (8, 100000)))
+    results = benchmark(model, days=days, cells=cells)
+    print(f"Scoring de {results['rows']} lignes ({days} jours × {cells} cellules) :")
+    for name, entry in results.items():
+        if isinstance(entry, dict):
+            diff = f", écart max {entry['max_abs_diff']:.2e}" if "max_abs_diff" in entry else ""
+            print(f"  {name:<14} {entry['seconds']:.3f}s  {entry['rows_per_s']:>12,} lignes/s  x{entry['speedup']}{diff}")
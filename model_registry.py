@@ -0,0 +1,96 @@
+# model_registry.py
+import json
+import os
+import shutil
+from datetime import datetime
+
+import joblib
+import xgboost as xgb
+
+REGISTRY_DIR = "models/registry"
+CURRENT_FILE = "CURRENT"          # Contient l'identifiant de la version servie (ex. v0003)
+MODEL_FILENAME = "model.ubj"      # Format natif XGBoost (portable entre versions, contrairement au pickle)
+METADATA_FILENAME = "meta.json"
+
+
+def source_signature(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def list_versions(registry_dir: str = REGISTRY_DIR) -> list[str]:
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(name for name in os.listdir(registry_dir) if name.startswith("v") and name[1:].isdigit())
+
+
+def current_version(registry_dir: str = REGISTRY_DIR) -> str | None:
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def version_dir(version: str, registry_dir: str = REGISTRY_DIR) -> str:
+    return os.path.join(registry_dir, version)
+
+
+def load_metadata(version: str, registry_dir: str = REGISTRY_DIR) -> dict:
+    with open(os.path.join(version_dir(version, registry_dir), METADATA_FILENAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_model_path(default: str, registry_dir: str = REGISTRY_DIR) -> str:
+    """Modèle à servir : version courante du registre, sinon `default` (ancien models/thonia_model.joblib)."""
+    version = current_version(registry_dir)
+    if version is None:
+        return default
+    return os.path.join(version_dir(version, registry_dir), MODEL_FILENAME)
+
+
+def load_model(path: str):
+    """Booster XGBoost natif (registre) ou modèle sklearn sérialisé avec joblib (ancien format)."""
+    if path.endswith(".joblib"):
+        return joblib.load(path)
+    return xgb.Booster(model_file=path)
+
+
+def load_booster(version: str, registry_dir: str = REGISTRY_DIR) -> xgb.Booster:
+    return xgb.Booster(model_file=os.path.join(version_dir(version, registry_dir), MODEL_FILENAME))
+
+
+def publish(booster: xgb.Booster, metadata: dict, registry_dir: str = REGISTRY_DIR, make_current: bool = True) -> str:
+    """
+    Enregistre une nouvelle version (vNNNN/model.ubj + meta.json) puis, si demandé, la désigne comme
+    version courante. Le dossier est écrit à part puis renommé, et CURRENT est remplacé atomiquement :
+    le serveur ne voit jamais une version incomplète.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    versions = list_versions(registry_dir)
+    version = f"v{int(versions[-1][1:]) + 1 if versions else 1:04d}"
+    partial_dir = os.path.join(registry_dir, f".{version}.{os.getpid()}.part")
+    os.makedirs(partial_dir)
+    try:
+        booster.save_model(os.path.join(partial_dir, MODEL_FILENAME))
+        with open(os.path.join(partial_dir, METADATA_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "created": datetime.now().isoformat(timespec="seconds"), **metadata}, f, indent=2, ensure_ascii=False)
+        os.rename(partial_dir, version_dir(version, registry_dir))
+    except Exception:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+    if make_current:
+        set_current(version, registry_dir)
+    return version
+
+
+def set_current(version: str, registry_dir: str = REGISTRY_DIR):
+    """Change la version servie (aussi pour revenir à une version précédente)."""
+    if not os.path.exists(os.path.join(version_dir(version, registry_dir), MODEL_FILENAME)):
+        raise FileNotFoundError(f"Version inconnue dans le registre: {version}")
+    current_path = os.path.join(registry_dir, CURRENT_FILE)
+    partial_path = f"{current_path}.{os.getpid()}.part"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(partial_path, current_path)
@@ -0,0 +1,312 @@
+# prediction_cache.py
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+import context_digest
+import grid_store
+import model_registry
+import static_features
+import variables
+from grid_raster import GridRaster, TileCache
+from inference import FEATURES, InferenceEngine
+from spatial_index import SpatialIndex
+
+# Formats de réponse disponibles pour /api/predictions (?format=...)
+LEGACY_FORMAT = 'points'
+COLUMNAR_FORMAT = 'columnar'
+PAYLOAD_FORMATS = (LEGACY_FORMAT, COLUMNAR_FORMAT)
+
+# Intervalle de surveillance des fichiers du modèle et de la grille du jour (secondes)
+RELOAD_INTERVAL_S = float(os.getenv("THONIA_RELOAD_INTERVAL", "60"))
+
+# Un point au format historique, déjà sérialisé comme `jsonify` (clés triées, non-ASCII échappé).
+_LEGACY_POINT_TEMPLATE = (
+    '{"details":{"Temp\\u00e9rature":"%s\\u00b0C","Vent":"%s noeuds"},'
+    '"lat":%r,"lon":%r,"prediction_score":%r}'
+)
+
+
+def serialize_json(payload) -> bytes:
+    """
+    Sérialise comme le ferait `jsonify` en mode non-debug (clés triées, ASCII, compact),
+    pour que le frontend reçoive exactement les mêmes octets qu'avant.
+    """
+    return (json.dumps(payload, ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n").encode('utf-8')
+
+
+def build_point_fragments(daily_df: pd.DataFrame, scores: np.ndarray) -> np.ndarray:
+    """
+    Sérialise chaque point au format historique à partir des colonnes NumPy, sans iterrows().
+    Les fragments sont gardés pour composer aussi les réponses filtrées (bbox, near, top).
+    """
+    temp_txt = np.char.mod('%.1f', daily_df['temp_surface_c'].to_numpy(dtype=np.float64))
+    wind_txt = np.char.mod('%.0f', daily_df['vent_noeuds'].to_numpy(dtype=np.float64))
+    lats = daily_df['latitude'].to_numpy(dtype=np.float64).tolist()
+    lons = daily_df['longitude'].to_numpy(dtype=np.float64).tolist()
+    fragments = np.empty(len(daily_df), dtype=object)
+    fragments[:] = [
+        _LEGACY_POINT_TEMPLATE % (temp, wind, lat, lon, round(score, 2))
+        for temp, wind, lat, lon, score in zip(temp_txt.tolist(), wind_txt.tolist(), lats, lons, scores.tolist())
+    ]
+    return fragments
+
+
+def build_points_payload(fragments: np.ndarray) -> bytes:
+    """
+    Liste historique d'objets par point. Pour la grille complète, le résultat est identique
+    octet pour octet à l'ancien `jsonify(results)` lu par frontend/script.js.
+    """
+    return ('[' + ','.join(fragments.tolist()) + ']\n').encode('utf-8')
+
+
+def build_columnar_payload(lats: np.ndarray, lons: np.ndarray, scores: np.ndarray) -> bytes:
+    """Format compact : tableaux parallèles `lat`/`lon`/`score` (même ordre que la grille)."""
+    return serialize_json({
+        'count': len(lats),
+        'lat': lats.astype(np.float64).tolist(),
+        'lon': lons.astype(np.float64).tolist(),
+        'score': np.round(scores.astype(np.float64), 2).tolist(),
+    })
+
+
+class CachedPayload:
+    """Octets JSON prêts à servir, leur version gzip et l'ETag associé."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+        self.etag = hashlib.sha1(body).hexdigest()
+
+
+class PredictionSnapshot:
+    """
+    Modèle + grille du jour + tout ce qui en est dérivé (scores, réponses sérialisées, index, tuiles).
+    Immuable une fois construit : une requête lit un seul snapshot du début à la fin, même si un
+    rechargement a lieu pendant ce temps.
+    """
+
+    def __init__(self, model, daily_df: pd.DataFrame, signature: tuple, environment_digest: dict | None = None, engine: InferenceEngine | None = None,
+                 scores: np.ndarray | None = None, forecast: dict | None = None):
+        self.model = model
+        self.engine = engine or InferenceEngine(model)
+        self.daily_df = daily_df
+        self.provenance = daily_df.attrs.get('thonia', {})
+        self.signature = signature
+        # Scores déjà calculés (jours d'un cube de prévision, scorés en une passe), sinon scoring de la grille
+        self.scores = scores if scores is not None else self.engine.predict_frame(daily_df)
+        # Snapshots des jours de prévision, par date (AAAA-MM-JJ), préparés avec celui-ci
+        self.forecast = forecast or {}
+        lats = daily_df['latitude'].to_numpy(dtype=np.float64)
+        lons = daily_df['longitude'].to_numpy(dtype=np.float64)
+        self._fragments = build_point_fragments(daily_df, self.scores)
+        self.payloads = {
+            LEGACY_FORMAT: CachedPayload(build_points_payload(self._fragments)),
+            COLUMNAR_FORMAT: CachedPayload(build_columnar_payload(lats, lons, self.scores)),
+        }
+        # Les tuiles sont rendues à la demande ; on ne prépare ici que le raster des scores.
+        raster = GridRaster(lats, lons, self.scores)
+        self.tiles = TileCache(raster)
+        self.index = SpatialIndex(raster, lats, lons, self.scores)
+        self.version = self.payloads[LEGACY_FORMAT].etag
+        # Résumé du jour pour le chatbot : conditions (écrites par le pipeline à côté de la grille,
+        # recalculées ici pour les anciens fichiers) + zones prometteuses selon les scores du modèle.
+        if environment_digest is None:
+            environment_digest = context_digest.build_environment_digest(daily_df, self.provenance)
+        sst = daily_df['temp_surface_c'].to_numpy(dtype=np.float64, na_value=np.nan)
+        self.digest = {**environment_digest, "clusters": context_digest.top_clusters(raster, lats, lons, self.scores, sst)}
+        self.prompt_context = context_digest.format_prompt_context(self.digest)
+
+    def validate(self):
+        """Refuse un snapshot incohérent avant qu'il ne soit servi (ValueError)."""
+        if len(self.daily_df) == 0:
+            raise ValueError("la grille du jour est vide (ou aucun point valide)")
+        coords = self.daily_df[['latitude', 'longitude']].to_numpy(dtype=np.float64)
+        if not np.isfinite(coords).all():
+            raise ValueError("coordonnées manquantes ou invalides dans la grille")
+        if len(self.scores) != len(self.daily_df) or not np.isfinite(self.scores).all():
+            raise ValueError("le modèle a produit des scores manquants ou invalides")
+        if ((self.scores < 0) | (self.scores > 1)).any():
+            raise ValueError("scores hors de l'intervalle [0, 1]")
+
+    def for_date(self, date: str):
+        """Snapshot du jour demandé (AAAA-MM-JJ) : la grille du jour ou un jour de la prévision, None sinon."""
+        if date == self.provenance.get('date'):
+            return self
+        return self.forecast.get(date)
+
+    def dates(self) -> list[str]:
+        return sorted(set(self.forecast) | ({self.provenance['date']} if self.provenance.get('date') else set()))
+
+    def get(self, fmt: str = LEGACY_FORMAT) -> CachedPayload:
+        return self.payloads[fmt]
+
+    def query(self, fmt: str = LEGACY_FORMAT, **filters) -> tuple[bytes, str]:
+        """
+        Sous-ensemble de la grille servi depuis l'index spatial (voir SpatialIndex.query pour les filtres).
+        Retourne le corps JSON et un ETag propre à la version des données et aux filtres.
+        """
+        ids = self.index.query(**filters)
+        if fmt == COLUMNAR_FORMAT:
+            body = build_columnar_payload(self.index.lats[ids], self.index.lons[ids], self.index.scores[ids])
+        else:
+            body = build_points_payload(self._fragments[ids])
+        return body, f"{self.version[:16]}-{hashlib.sha1(body).hexdigest()[:16]}"
+
+    def get_tile(self, z: int, x: int, y: int, fmt: str) -> tuple[bytes, str]:
+        """Tuile encodée et ETag (version de la grille + coordonnées de la tuile)."""
+        return self.tiles.get(z, x, y, fmt), f"{self.version[:16]}-{z}-{x}-{y}-{fmt}"
+
+
+def _file_signature(path: str) -> tuple:
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def _scorable_rows(df: pd.DataFrame, path: str) -> pd.DataFrame:
+    """Vérifie les colonnes du modèle et écarte les points masqués par le pipeline ou hors plage (ex. SST mal convertie)."""
+    missing = [c for c in FEATURES if c not in df.columns]
+    if missing:
+        raise ValueError(f"colonnes manquantes dans {path}: {', '.join(missing)}")
+    valid = variables.valid_rows(df, FEATURES)
+    if not valid.any():
+        raise ValueError(f"aucun point valide dans {path} (valeurs manquantes ou hors plage)")
+    if not valid.all():
+        print(f"⚠️ {int((~valid).sum())} point(s) sur {len(df)} ignoré(s) : valeurs manquantes ou hors plage dans {path}.")
+        attrs = df.attrs
+        df = df[valid].reset_index(drop=True)
+        df.attrs = attrs
+    return df
+
+
+def build_forecast_snapshots(model, engine: InferenceEngine, path: str, signature: tuple) -> dict:
+    """
+    Snapshots par jour d'un cube de prévision : toutes les lignes (jours × cellules) sont scorées en une
+    seule passe, puis chaque jour est sérialisé et indexé comme une grille du jour.
+    """
+    cube_df = _scorable_rows(static_features.attach_static_features(grid_store.read_table(path)), path)
+    if grid_store.FORECAST_DATE_COLUMN not in cube_df.columns:
+        raise ValueError(f"colonne '{grid_store.FORECAST_DATE_COLUMN}' absente de {path}")
+    scores = engine.predict_frame(cube_df)
+    provenance = cube_df.attrs.get('thonia', {})
+    digests = (context_digest.read_digest(context_digest.digest_path(path)) or {}).get("days", {})
+    dates = cube_df[grid_store.FORECAST_DATE_COLUMN].astype(str).to_numpy()
+    snapshots = {}
+    for date in sorted(set(dates.tolist())):
+        rows = np.flatnonzero(dates == date)
+        day_df = cube_df.iloc[rows].drop(columns=grid_store.FORECAST_DATE_COLUMN).reset_index(drop=True)
+        day_df.attrs['thonia'] = {**provenance, "date": date}
+        snapshot = PredictionSnapshot(model, day_df, signature, digests.get(date), engine=engine, scores=scores[rows])
+        snapshot.validate()
+        snapshots[date] = snapshot
+    return snapshots
+
+
+class PredictionCache:
+    """
+    Garde le snapshot courant et le remplace quand le pipeline publie une nouvelle grille
+    ou qu'un nouveau modèle est entraîné. Le rechargement (lecture, validation, scoring,
+    sérialisation) se fait hors des requêtes ; le remplacement est une simple affectation
+    de référence, donc atomique. En cas d'échec, l'ancien snapshot reste servi tel quel.
+    """
+
+    def __init__(self, model_path: str, data_stem: str, forecast_stem: str | None = None):
+        self.model_path = model_path   # Ancien modèle, servi tant que le registre (models/registry) est vide
+        self.data_stem = data_stem   # ex. 'data/daily_data' -> .arrow, ou .csv à défaut
+        self.forecast_stem = forecast_stem   # ex. 'data/forecast' : cube de prévision multi-jours (optionnel)
+        self.snapshot = None
+        self.last_error = None
+        self._failed_signature = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self.reload(force=True)
+        if self.snapshot is None:
+            raise FileNotFoundError(self.last_error)
+
+    def _signatures(self) -> tuple[tuple, tuple, tuple | None]:
+        # Version courante du registre : un nouvel entraînement (ou un retour arrière) est pris en compte au prochain passage
+        model_path = model_registry.current_model_path(self.model_path)
+        forecast_signature = None
+        if self.forecast_stem is not None:
+            try:
+                forecast_signature = _file_signature(grid_store.resolve_path(self.forecast_stem))
+            except FileNotFoundError:
+                pass
+        return _file_signature(model_path), _file_signature(grid_store.resolve_path(self.data_stem)), forecast_signature
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Recharge le modèle et/ou la grille s'ils ont changé sur disque.
+        Retourne True si un nouveau snapshot a été publié.
+        """
+        with self._lock:
+            current = self.snapshot
+            signature = None
+            try:
+                model_signature, data_signature, forecast_signature = self._signatures()
+                signature = (model_signature, data_signature, forecast_signature)
+                if not force and (signature == self._failed_signature or (current is not None and current.signature == signature)):
+                    return False
+                same_model = current is not None and current.signature[0] == model_signature
+                model = current.model if same_model else model_registry.load_model(model_signature[0])
+                if not (isinstance(model, xgb.Booster) or hasattr(model, 'predict_proba')):
+                    raise ValueError(f"{model_signature[0]} ne contient pas de classifieur")
+                engine = current.engine if same_model else InferenceEngine(model)
+                # Variables dynamiques du jour + variables statiques de la grille, rejointes par cell_id
+                daily_df = _scorable_rows(static_features.attach_static_features(grid_store.read_table(data_signature[0])), data_signature[0])
+                forecast = self._load_forecast(current, same_model, model, engine, signature)
+                # Résumé du même jour que la grille (marées, lune...), sinon recalculé par le snapshot
+                environment_digest = context_digest.find_digest(data_signature[0], daily_df.attrs.get('thonia', {}))
+                snapshot = PredictionSnapshot(model, daily_df, signature, environment_digest, engine=engine, forecast=forecast)
+                snapshot.validate()
+            except Exception as e:
+                # Fichier absent, en cours d'écriture ou invalide : on garde le snapshot actuel
+                # (et on ne retente pas ces mêmes fichiers tant qu'ils n'ont pas changé).
+                self._failed_signature = signature
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"⚠️ Rechargement des données/modèle ignoré: {self.last_error}")
+                return False
+            self.snapshot = snapshot
+            self.last_error = None
+            print(f"✅ Grille du jour scorée et mise en cache ({len(daily_df)} points, ETag {snapshot.version[:8]}).")
+            return True
+
+    def _load_forecast(self, current, same_model: bool, model, engine: InferenceEngine, signature: tuple) -> dict:
+        """
+        Jours de prévision du cube `forecast_stem`, réutilisés tels quels si ni le cube ni le modèle n'ont changé.
+        Un cube invalide n'empêche pas de servir la grille du jour : la prévision précédente est gardée.
+        """
+        forecast_signature = signature[2]
+        if forecast_signature is None:
+            return {}
+        if current is not None and same_model and current.signature[2] == forecast_signature:
+            return current.forecast
+        try:
+            forecast = build_forecast_snapshots(model, engine, forecast_signature[0], signature)
+        except Exception as e:
+            print(f"⚠️ Prévision {forecast_signature[0]} ignorée: {type(e).__name__}: {e}")
+            return current.forecast if current is not None and same_model else {}
+        print(f"✅ Prévision scorée et mise en cache ({len(forecast)} jours : {', '.join(forecast)}).")
+        return forecast
+
+    def start_watcher(self, interval: float = RELOAD_INTERVAL_S):
+        """Surveille les fichiers du modèle et de la grille en tâche de fond."""
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                self.reload()
+
+        self._watcher = threading.Thread(target=watch, name="thonia-reload", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
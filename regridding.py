@@ -0,0 +1,143 @@
+# regridding.py
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+REGRID_WEIGHTS_DIR = "data/regrid_weights"
+REGRID_METHODS = ("nearest", "bilinear")
+
+
+def _sorted_axis(axis: np.ndarray):
+    order = np.argsort(axis, kind="stable")
+    return order, axis[order]
+
+
+def _nearest_index(axis: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Indice du point de `axis` le plus proche de chaque valeur (axe croissant ou décroissant)."""
+    order, sorted_axis = _sorted_axis(axis)
+    if len(sorted_axis) == 1:
+        return np.zeros(len(points), dtype=np.int64)
+    pos = np.searchsorted(sorted_axis, points).clip(1, len(sorted_axis) - 1)
+    closer_to_left = (points - sorted_axis[pos - 1]) <= (sorted_axis[pos] - points)
+    return order[pos - closer_to_left]
+
+
+def _bracket(axis: np.ndarray, points: np.ndarray):
+    """Indices des deux voisins encadrant chaque valeur et position relative (0..1) entre eux."""
+    order, sorted_axis = _sorted_axis(axis)
+    if len(sorted_axis) == 1:
+        zeros = np.zeros(len(points), dtype=np.int64)
+        return zeros, zeros, np.zeros(len(points))
+    pos = np.searchsorted(sorted_axis, points, side="right").clip(1, len(sorted_axis) - 1)
+    lower, upper = sorted_axis[pos - 1], sorted_axis[pos]
+    t = ((points - lower) / (upper - lower)).clip(0, 1)
+    return order[pos - 1], order[pos], t
+
+
+class Regridder:
+    """
+    Tables d'indices et de poids pour projeter un champ (lat × lon) sur une liste de points.
+    Calculées une fois par couple (grille source, grille cible) : projeter une variable
+    se réduit ensuite à un gather NumPy (plus proche voisin) ou à une somme pondérée (bilinéaire).
+    """
+
+    def __init__(self, indices: np.ndarray, weights: np.ndarray, src_shape: tuple[int, int], method: str):
+        self.indices = indices   # (n_points, k) indices à plat dans le champ source
+        self.weights = weights   # (n_points, k)
+        self.src_shape = tuple(int(n) for n in src_shape)
+        self.method = method
+
+    @classmethod
+    def build(cls, src_lat, src_lon, dst_lat, dst_lon, method: str = "nearest") -> "Regridder":
+        src_lat, src_lon = np.asarray(src_lat, dtype=np.float64), np.asarray(src_lon, dtype=np.float64)
+        dst_lat, dst_lon = np.asarray(dst_lat, dtype=np.float64), np.asarray(dst_lon, dtype=np.float64)
+        n_lon = len(src_lon)
+        if method == "nearest":
+            rows = _nearest_index(src_lat, dst_lat)
+            cols = _nearest_index(src_lon, dst_lon)
+            indices = (rows * n_lon + cols)[:, None]
+            weights = np.ones_like(indices, dtype=np.float64)
+        elif method == "bilinear":
+            r0, r1, ty = _bracket(src_lat, dst_lat)
+            c0, c1, tx = _bracket(src_lon, dst_lon)
+            indices = np.stack([r0 * n_lon + c0, r0 * n_lon + c1, r1 * n_lon + c0, r1 * n_lon + c1], axis=1)
+            weights = np.stack([(1 - ty) * (1 - tx), (1 - ty) * tx, ty * (1 - tx), ty * tx], axis=1)
+        else:
+            raise ValueError(f"Méthode de regrillage inconnue: {method} (attendu: {', '.join(REGRID_METHODS)})")
+        return cls(indices.astype(np.int64), weights, (len(src_lat), n_lon), method)
+
+    def apply(self, values: np.ndarray) -> np.ndarray:
+        """
+        Projette un champ (..., lat, lon) sur les points cibles -> (..., n_points).
+        En bilinéaire, les voisins NaN (terre, nuages) sont ignorés et les poids restants renormalisés.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape[-2:] != self.src_shape:
+            raise ValueError(f"Champ de forme {values.shape} incompatible avec la grille source {self.src_shape}")
+        flat = values.reshape(values.shape[:-2] + (-1,))
+        gathered = np.take(flat, self.indices, axis=-1)  # (..., n_points, k)
+        if self.indices.shape[1] == 1:
+            return gathered[..., 0]
+        valid = ~np.isnan(gathered)
+        weights = np.where(valid, self.weights, 0.0)
+        total = weights.sum(axis=-1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(total > 0, (np.where(valid, gathered, 0.0) * weights).sum(axis=-1) / total, np.nan)
+
+    def apply_many(self, fields: dict) -> dict:
+        """Projette plusieurs variables de la même grille source en un seul gather."""
+        names = list(fields)
+        stacked = self.apply(np.stack([np.asarray(fields[name], dtype=np.float64) for name in names]))
+        return {name: stacked[i] for i, name in enumerate(names)}
+
+    def save(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.part.npz"
+        np.savez(tmp_path, indices=self.indices, weights=self.weights, src_shape=np.array(self.src_shape), method=self.method)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Regridder":
+        with np.load(path) as data:
+            return cls(data["indices"], data["weights"], tuple(data["src_shape"]), str(data["method"]))
+
+
+def regridder_key(src_lat, src_lon, dst_lat, dst_lon, method: str) -> str:
+    digest = hashlib.sha1(method.encode("utf-8"))
+    for axis in (src_lat, src_lon, dst_lat, dst_lon):
+        digest.update(np.ascontiguousarray(axis, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+_regridders = {}
+_regridders_lock = threading.Lock()
+
+
+def get_regridder(src_lat, src_lon, dst_lat, dst_lon, method: str = "nearest", weights_dir: str = REGRID_WEIGHTS_DIR) -> Regridder:
+    """
+    Regridder pour ce couple de grilles : en mémoire, sinon depuis `weights_dir`, sinon calculé puis sauvegardé.
+    Les grilles source CMEMS et notre grille ne changent pas d'un jour à l'autre : les tables sont réutilisées
+    pour toutes les variables et tous les jours (backfill compris).
+    """
+    key = regridder_key(src_lat, src_lon, dst_lat, dst_lon, method)
+    with _regridders_lock:
+        regridder = _regridders.get(key)
+    if regridder is not None:
+        return regridder
+
+    path = os.path.join(weights_dir, f"{method}_{key[:20]}.npz")
+    regridder = None
+    if os.path.exists(path):
+        try:
+            regridder = Regridder.load(path)
+        except Exception as e:
+            print(f"   ⚠️ Tables de regrillage illisibles ({path}): {e}. Recalcul.")
+    if regridder is None:
+        regridder = Regridder.build(src_lat, src_lon, dst_lat, dst_lon, method)
+        os.makedirs(weights_dir, exist_ok=True)
+        regridder.save(path)
+        print(f"   Tables de regrillage ({method}) calculées et sauvegardées dans {path}")
+    with _regridders_lock:
+        _regridders[key] = regridder
+    return regridder
@@ -0,0 +1,83 @@
+# spatial_index.py
+import numpy as np
+
+from grid_raster import GridRaster
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.2
+DEFAULT_NEAR_RADIUS_KM = 55.6  # 30 milles nautiques
+MAX_NEAR_RADIUS_KM = 20015.0   # Demi-circonférence terrestre : au-delà, tout le globe est couvert
+LAT_RANGE = (-90.0, 90.0)
+LON_RANGE = (-180.0, 180.0)
+MAX_TOP_K = 1000
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Distance orthodromique (km), vectorisée."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class SpatialIndex:
+    """
+    Index des points de la grille du jour, construit une fois au chargement des données.
+    La grille étant régulière, une emprise se traduit directement en plage de lignes/colonnes
+    du raster : le coût d'une requête dépend de la zone demandée, pas de la taille de la grille.
+    """
+
+    def __init__(self, raster: GridRaster, lats: np.ndarray, lons: np.ndarray, scores: np.ndarray):
+        self.raster = raster
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        # Ordre global par score décroissant, pour ?top=K sans autre filtre
+        self.order_by_score = np.argsort(-self.scores, kind='stable')
+
+    def in_bbox(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> np.ndarray:
+        """Indices (ordre de la grille) des points situés dans l'emprise."""
+        r = self.raster
+        # Bornes ramenées sur le raster tant qu'elles sont flottantes : une emprise démesurée (ou une
+        # longitude de recherche qui diverge près des pôles) ne doit pas dépasser la capacité de int().
+        # Un débordement vers ±inf est voulu : la borne est ensuite ramenée sur le raster.
+        with np.errstate(over='ignore'):
+            row_start = int(np.ceil(np.clip((lat_min - r.lat_min) / r.lat_step - 1e-9, 0, r.n_lat)))
+            row_stop = int(np.floor(np.clip((lat_max - r.lat_min) / r.lat_step + 1e-9, -1, r.n_lat - 1))) + 1
+            col_start = int(np.ceil(np.clip((lon_min - r.lon_min) / r.lon_step - 1e-9, 0, r.n_lon)))
+            col_stop = int(np.floor(np.clip((lon_max - r.lon_min) / r.lon_step + 1e-9, -1, r.n_lon - 1))) + 1
+        if row_start >= row_stop or col_start >= col_stop:
+            return np.empty(0, dtype=np.int64)
+        ids = r.point_id[row_start:row_stop, col_start:col_stop].ravel()
+        return np.sort(ids[ids >= 0])
+
+    def near(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Indices des points à moins de `radius_km` de (lat, lon) : pré-filtre par emprise puis distance exacte."""
+        d_lat = radius_km / KM_PER_DEGREE_LAT
+        d_lon = radius_km / (KM_PER_DEGREE_LAT * max(np.cos(np.radians(lat)), 1e-6))
+        candidates = self.in_bbox(lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon)
+        distances = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        return candidates[distances <= radius_km]
+
+    def top(self, k: int, candidates: np.ndarray | None = None) -> np.ndarray:
+        """Les `k` meilleurs points (score décroissant), parmi `candidates` si fourni."""
+        if candidates is None:
+            return self.order_by_score[:k]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-self.scores[candidates], k - 1)[:k]]
+        return candidates[np.argsort(-self.scores[candidates], kind='stable')]
+
+    def query(self, bbox=None, near=None, radius_km=DEFAULT_NEAR_RADIUS_KM, top=None) -> np.ndarray:
+        """
+        Combine les filtres de /api/predictions.
+        bbox = (lon_min, lat_min, lon_max, lat_max), near = (lat, lon), top = nombre de points.
+        """
+        candidates = None
+        if bbox is not None:
+            lon_min, lat_min, lon_max, lat_max = bbox
+            candidates = self.in_bbox(lat_min, lat_max, lon_min, lon_max)
+        if near is not None:
+            around = self.near(near[0], near[1], radius_km)
+            candidates = around if candidates is None else np.intersect1d(candidates, around, assume_unique=True)
+        if top is not None:
+            return self.top(top, candidates)
+        return candidates
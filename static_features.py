@@ -0,0 +1,133 @@
+# static_features.py
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+import grid_store
+
+STATIC_FEATURES_DIR = "data/static"
+SHELF_BREAK_DEPTH_M = -200.0   # Rebord du plateau continental
+KM_PER_DEGREE = 111.32
+CELL_ID_COLUMN = 'cell_id'
+STATIC_COLUMNS = ['bathymetry_m', 'dist_shelf_break_km', 'dist_coast_km', 'cell_area_km2']
+
+
+def grid_key(lat_min: float, lat_max: float, lon_min: float, lon_max: float, resolution: float, bathymetry_source: str = "") -> str:
+    """Identifiant d'une définition de grille (emprise, résolution) et de la source de bathymétrie utilisée."""
+    definition = f"{lat_min:.6f},{lat_max:.6f},{lon_min:.6f},{lon_max:.6f}|{resolution:.6f}|{bathymetry_source}"
+    return hashlib.sha1(definition.encode("utf-8")).hexdigest()[:16]
+
+
+def store_path(key: str, resolution: float, store_dir: str = STATIC_FEATURES_DIR) -> str:
+    return os.path.join(store_dir, f"static_features_{resolution:g}_{key}{grid_store.ARROW_EXTENSION}")
+
+
+def _distance_km(targets: np.ndarray, lat_step_km: float, lon_step_km: float) -> np.ndarray:
+    """Distance (km) de chaque cellule à la cellule cible la plus proche ; NaN s'il n'y a aucune cible dans la grille."""
+    if not targets.any():
+        return np.full(targets.shape, np.nan)
+    return ndimage.distance_transform_edt(~targets, sampling=(lat_step_km, lon_step_km))
+
+
+def compute_static_features(grid_df: pd.DataFrame, resolution: float) -> pd.DataFrame:
+    """
+    Invariants par cellule à partir de la grille et de sa bathymétrie : distance au rebord du plateau
+    (-200 m), distance à la côte (cellules à terre ou sans données) et surface de la cellule.
+    """
+    lats = grid_df['latitude'].to_numpy(dtype=np.float64)
+    lons = grid_df['longitude'].to_numpy(dtype=np.float64)
+    lat0, lon0 = lats.min(), lons.min()
+    row = np.rint((lats - lat0) / resolution).astype(np.int64)
+    col = np.rint((lons - lon0) / resolution).astype(np.int64)
+    depth = np.full((row.max() + 1, col.max() + 1), np.nan)
+    depth[row, col] = grid_df['bathymetry_m'].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    lat_step_km = resolution * KM_PER_DEGREE
+    lon_step_km = resolution * KM_PER_DEGREE * np.cos(np.radians((lats.min() + lats.max()) / 2))
+    if np.isfinite(depth).any():
+        land = ~np.isfinite(depth) | (depth >= 0)
+        deep = np.isfinite(depth) & (depth < SHELF_BREAK_DEPTH_M)
+        # Cellules du plateau qui touchent une cellule plus profonde que le rebord
+        shelf_break = ~land & ~deep & ndimage.binary_dilation(deep, structure=np.ones((3, 3), dtype=bool))
+        dist_coast = _distance_km(land, lat_step_km, lon_step_km)
+        dist_shelf = _distance_km(shelf_break, lat_step_km, lon_step_km)
+    else:
+        # Pas de bathymétrie : côte et plateau inconnus
+        dist_coast = dist_shelf = np.full(depth.shape, np.nan)
+
+    return pd.DataFrame({
+        CELL_ID_COLUMN: np.arange(len(grid_df), dtype=np.int32),
+        'latitude': lats,
+        'longitude': lons,
+        'bathymetry_m': depth[row, col],
+        'dist_shelf_break_km': dist_shelf[row, col],
+        'dist_coast_km': dist_coast[row, col],
+        'cell_area_km2': lat_step_km * resolution * KM_PER_DEGREE * np.cos(np.radians(lats)),
+    })
+
+
+def load_static_features(key: str, resolution: float, build, store_dir: str = STATIC_FEATURES_DIR) -> pd.DataFrame:
+    """
+    Invariants de la grille `key`, lus en mémoire mappée depuis le store (Arrow IPC).
+    À la première demande, `build()` doit renvoyer la grille avec sa bathymétrie ; le résultat n'est
+    enregistré que si la bathymétrie n'est pas simulée (attrs['bathymetry_source'] != 'simulated').
+    """
+    path = store_path(key, resolution, store_dir)
+    if os.path.exists(path):
+        print(f"-> Variables statiques de la grille lues depuis {path}.")
+        static_df = grid_store.read_table(path)
+        static_df.attrs['thonia']["store_path"] = path
+        return static_df
+
+    grid_df = build()
+    source = grid_df.attrs.get('bathymetry_source', 'unknown')
+    static_df = compute_static_features(grid_df, resolution)
+    static_df.attrs['thonia'] = {"grid_key": key, "resolution": resolution, "bathymetry_source": source}
+    if source == 'simulated':
+        print("-> Bathymétrie simulée : variables statiques non enregistrées (recalculées au prochain run).")
+        return static_df
+    os.makedirs(store_dir, exist_ok=True)
+    grid_store.write_table(static_df, path, metadata=static_df.attrs['thonia'])
+    # Chemin connu seulement une fois le fichier écrit : c'est lui que les grilles journalières référencent
+    static_df.attrs['thonia']["store_path"] = path
+    print(f"-> Variables statiques calculées ({len(static_df)} cellules) et enregistrées dans {path}.")
+    return static_df
+
+
+def join_static(daily_df: pd.DataFrame, static_df: pd.DataFrame, columns: list[str] = STATIC_COLUMNS) -> pd.DataFrame:
+    """Ajoute les variables statiques à une grille journalière par indice de cellule (simple take, sans fusion)."""
+    cell_ids = daily_df[CELL_ID_COLUMN].to_numpy(dtype=np.int64)
+    for name in columns:
+        daily_df[name] = static_df[name].to_numpy()[cell_ids]
+    return daily_df
+
+
+def read_static_store(provenance: dict | None) -> pd.DataFrame | None:
+    """
+    Store des variables statiques référencé par la provenance d'une grille (clé 'static_features'),
+    en mémoire mappée. None si la grille n'en référence pas ou si le fichier a disparu.
+    """
+    path = (provenance or {}).get("static_features")
+    if not path:
+        return None
+    if not os.path.exists(path):
+        print(f"⚠️ Variables statiques introuvables ({path}) : grille utilisée sans bathymétrie.")
+        return None
+    return grid_store.read_table(path)
+
+
+def attach_static_features(daily_df: pd.DataFrame, static_df: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    Grille du pipeline (jour ou cube de prévision) complétée par ses variables statiques. Les grilles qui les
+    contiennent déjà (bathymétrie simulée, anciens fichiers) ou sans `cell_id` sont retournées telles quelles.
+    """
+    if CELL_ID_COLUMN not in daily_df.columns or all(name in daily_df.columns for name in STATIC_COLUMNS):
+        return daily_df
+    if static_df is None:
+        static_df = read_static_store(daily_df.attrs.get('thonia'))
+    if static_df is None:
+        return daily_df
+    return join_static(daily_df, static_df)
@@ -0,0 +1,199 @@
+# synthetic_data.py
+import argparse
+import importlib.util
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import ndimage
+
+import grid_store
+
+# Zone et résolution par défaut : celles de la grille du pipeline (data_pipeline.py)
+DEFAULT_BBOX = (43.5, 47.5, -5.0, -1.5)   # lat_min, lat_max, lon_min, lon_max
+DEFAULT_RESOLUTION = 0.1
+CORRELATION_DEG = 0.5      # Échelle spatiale des anomalies (≈ 50 km, tourbillons et fronts de méso-échelle)
+CORRELATION_DAYS = 3.0     # Échelle temporelle des anomalies
+BATCH_ROWS = 500000        # Lignes générées et écrites par lot pour les jeux d'entraînement
+KNOTS_PER_M_S = 1.943844
+
+# Produits NetCDF simulés, au format des fichiers CMEMS / Météo-France lus par le pipeline :
+# {produit: {variable du fichier: (champ généré, unités)}}
+PRODUCTS = {
+    'sst': {'analysed_sst': ('sst_k', 'K')},
+    'chl': {'CHL': ('chl', 'mg m-3')},
+    'cur': {'uo': ('current_u', 'm s-1'), 'vo': ('current_v', 'm s-1')},
+    'wind': {'u10': ('wind_u', 'm s-1'), 'v10': ('wind_v', 'm s-1')},
+}
+TRAINING_COLUMNS = ['latitude', 'longitude', 'temp_surface_c', 'chlorophylle_mg_m3', 'vent_noeuds', 'thon_present']
+
+
+def grid_axis(low: float, high: float, resolution: float) -> np.ndarray:
+    """Axe de la grille, construit comme data_pipeline.create_grid (bornes supérieures exclues)."""
+    return np.round(np.arange(low, high, resolution), 6)
+
+
+class SyntheticOcean:
+    """
+    Champs océaniques et météo simulés, reproductibles (graine) et corrélés dans l'espace et le temps,
+    à n'importe quelle résolution. Les anomalies sont tirées sur une grille grossière (jours × CORRELATION_DEG)
+    puis interpolées : le coût et l'aspect ne dépendent pas de la résolution, et chaque jour se calcule
+    indépendamment des autres (génération par lots, éventuellement en parallèle avec dask).
+    """
+
+    def __init__(self, start: datetime, days: int = 1, bbox: tuple = DEFAULT_BBOX, resolution: float = DEFAULT_RESOLUTION, seed: int = 0):
+        self.start = start
+        self.days = days
+        self.bbox = bbox
+        self.resolution = resolution
+        self.seed = seed
+        lat_min, lat_max, lon_min, lon_max = bbox
+        self.lats = grid_axis(lat_min, lat_max, resolution)
+        self.lons = grid_axis(lon_min, lon_max, resolution)
+        # Une grille d'anomalies grossière par variable indépendante, avec une marge pour l'interpolation cubique
+        coarse_shape = (int(np.ceil(days / CORRELATION_DAYS)) + 4,
+                        int(np.ceil((lat_max - lat_min) / CORRELATION_DEG)) + 4,
+                        int(np.ceil((lon_max - lon_min) / CORRELATION_DEG)) + 4)
+        rng = np.random.default_rng(seed)
+        self._anomalies = {name: ndimage.gaussian_filter(rng.standard_normal(coarse_shape), sigma=1.0)
+                           for name in ('sst', 'chl', 'stream', 'wind_u', 'wind_v')}
+        for noise in self._anomalies.values():
+            noise /= noise.std()
+        # Position de chaque point de la grille fine dans la grille grossière
+        self._rows = 1.5 + (self.lats - lat_min) / CORRELATION_DEG
+        self._cols = 1.5 + (self.lons - lon_min) / CORRELATION_DEG
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.lats), len(self.lons)
+
+    def _anomaly(self, name: str, day: int) -> np.ndarray:
+        """Anomalie centrée réduite (lat × lon) du jour `day`."""
+        rows, cols = np.meshgrid(self._rows, self._cols, indexing='ij')
+        times = np.full(rows.shape, 1.5 + day / CORRELATION_DAYS)
+        return ndimage.map_coordinates(self._anomalies[name], [times, rows, cols], order=3, mode='nearest')
+
+    def fields(self, day: int) -> dict:
+        """Champs du jour `day` (0 = `start`), tableaux (lat × lon) float32."""
+        lat_min, lat_max, lon_min, lon_max = self.bbox
+        date = self.start + timedelta(days=day)
+        lat_frac = ((self.lats - lat_min) / (lat_max - lat_min))[:, None]   # 0 au sud, 1 au nord
+        lon_frac = ((self.lons - lon_min) / (lon_max - lon_min))[None, :]   # 0 au large, 1 vers la côte
+        season = np.sin(2 * np.pi * (date.timetuple().tm_yday - 110) / 365.25)
+
+        # SST : plus chaude au sud, cycle saisonnier, anomalies de ±1 °C
+        sst_c = 16.5 + 4.0 * season - 3.0 * lat_frac + 1.0 * self._anomaly('sst', day)
+        # Chlorophylle : log-normale, plus forte près de la côte et au printemps
+        chl = np.exp(np.log(0.35) + 1.2 * lon_frac ** 2 + 0.3 * max(season, 0) + 0.6 * self._anomaly('chl', day)).clip(0.02, 50)
+        # Courants géostrophiques dérivés d'une fonction de courant : champ sans divergence, ≈ 0,2 m/s
+        stream = self._anomaly('stream', day)
+        d_lat, d_lon = np.gradient(stream)
+        current_u, current_v = -0.2 * d_lat / d_lat.std(), 0.2 * d_lon / d_lon.std()
+        # Vent : flux d'ouest moyen de 5 m/s et perturbations de grande échelle
+        wind_u = 5.0 + 4.0 * self._anomaly('wind_u', day)
+        wind_v = 4.0 * self._anomaly('wind_v', day)
+        fields = {
+            'sst_c': sst_c, 'sst_k': sst_c + 273.15, 'chl': chl,
+            'current_u': current_u, 'current_v': current_v, 'wind_u': wind_u, 'wind_v': wind_v,
+            'wind_knots': np.hypot(wind_u, wind_v) * KNOTS_PER_M_S,
+        }
+        return {name: np.asarray(values, dtype=np.float32) for name, values in fields.items()}
+
+    def dataset(self, product: str) -> xr.Dataset:
+        """
+        Fichier simulé d'un produit (time × lat × lon), avec les noms de variables et unités du vrai produit.
+        Avec dask, les jours sont calculés à l'écriture, un par un (la mémoire dépend d'un jour, pas de la période).
+        """
+        times = pd.date_range(self.start, periods=self.days, freq='D')
+        data_vars = {}
+        for variable, (field, units) in PRODUCTS[product].items():
+            if importlib.util.find_spec("dask") is not None:
+                import dask
+                import dask.array as da
+                daily = [da.from_delayed(dask.delayed(lambda d, f=field: self.fields(d)[f])(day), self.shape, np.float32) for day in range(self.days)]
+                values = da.stack(daily)
+            else:
+                values = np.stack([self.fields(day)[field] for day in range(self.days)])
+            data_vars[variable] = (('time', 'lat', 'lon'), values, {'units': units})
+        ds = xr.Dataset(data_vars, coords={'time': times, 'lat': self.lats, 'lon': self.lons})
+        ds['lat'].attrs.update(units='degrees_north', long_name='Latitude')
+        ds['lon'].attrs.update(units='degrees_east', long_name='Longitude')
+        ds.attrs.update(Conventions='CF-1.6', title=f'Synthetic {product} data', seed=self.seed)
+        return ds
+
+    def write_netcdf(self, product: str, path: str) -> str:
+        """Écrit le produit simulé en NetCDF (fichier temporaire renommé atomiquement). Retourne le chemin."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        partial_path = f"{path}.{os.getpid()}.part"
+        ds = self.dataset(product)
+        encoding = {name: {'zlib': True, 'complevel': 4, 'chunksizes': (1,) + self.shape} for name in ds.data_vars}
+        ds.to_netcdf(partial_path, encoding=encoding)
+        os.replace(partial_path, path)
+        return path
+
+    def training_batches(self, rows: int, batch_rows: int = BATCH_ROWS):
+        """
+        Jeu d'entraînement étiqueté (colonnes de data/dataset.csv) : positions tirées au hasard dans la zone et
+        sur la période, variables lues dans les champs simulés du jour, présence tirée selon une probabilité
+        qui dépend de la SST (optimum vers 18 °C), de la chlorophylle et du vent. Généré jour par jour, par lots.
+        """
+        lat_min, lat_max, lon_min, lon_max = self.bbox
+        rng = np.random.default_rng([self.seed, rows])
+        per_day = np.bincount(rng.integers(0, self.days, rows), minlength=self.days)
+        pending, pending_rows = [], 0
+        for day, count in enumerate(per_day):
+            if count == 0:
+                continue
+            fields = self.fields(day)
+            lats = rng.uniform(lat_min, lat_max, count)
+            lons = rng.uniform(lon_min, lon_max, count)
+            row = np.clip(np.rint((lats - self.lats[0]) / self.resolution).astype(np.int64), 0, len(self.lats) - 1)
+            col = np.clip(np.rint((lons - self.lons[0]) / self.resolution).astype(np.int64), 0, len(self.lons) - 1)
+            sst, chl, wind = fields['sst_c'][row, col], fields['chl'][row, col], fields['wind_knots'][row, col]
+            logit = -0.5 - ((sst - 18.0) / 2.5) ** 2 + 0.8 * np.log(chl / 0.5) - 0.08 * (wind - 12.0) + rng.normal(0, 0.5, count)
+            pending.append(pd.DataFrame({
+                'latitude': lats, 'longitude': lons, 'temp_surface_c': sst, 'chlorophylle_mg_m3': chl,
+                'vent_noeuds': np.rint(wind), 'thon_present': (rng.random(count) < 1 / (1 + np.exp(-logit))).astype(np.int8),
+            }))
+            pending_rows += count
+            if pending_rows >= batch_rows:
+                yield pd.concat(pending, ignore_index=True)
+                pending, pending_rows = [], 0
+        if pending:
+            yield pd.concat(pending, ignore_index=True)
+
+    def write_training_set(self, path: str, rows: int, batch_rows: int = BATCH_ROWS) -> str:
+        """Écrit `rows` lignes étiquetées (.parquet, .arrow ou .csv) lot par lot. Retourne le chemin écrit."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        metadata = {"synthetic": True, "seed": self.seed, "start": self.start.strftime('%Y-%m-%d'), "days": self.days,
+                    "bbox": list(self.bbox), "resolution": self.resolution, "rows": rows}
+        return grid_store.write_batches(self.training_batches(rows, batch_rows), path, metadata=metadata)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Données synthétiques ThonIA (reproductibles) pour les tests de charge.")
+    parser.add_argument("kind", choices=["dataset", *PRODUCTS], help="'dataset' : jeu d'entraînement ; sinon produit NetCDF simulé.")
+    parser.add_argument("--output", required=True, help="Fichier à écrire (.parquet/.arrow/.csv pour 'dataset', .nc sinon).")
+    parser.add_argument("--start", type=lambda v: datetime.strptime(v, "%Y-%m-%d"), default=datetime(2024, 6, 1), help="Premier jour (AAAA-MM-JJ).")
+    parser.add_argument("--days", type=int, default=1, help="Nombre de jours simulés.")
+    parser.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION, help="Résolution de la grille (degrés).")
+    parser.add_argument("--rows", type=int, default=1000000, help="Lignes du jeu d'entraînement.")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ocean = SyntheticOcean(args.start, days=args.days, resolution=args.resolution, seed=args.seed)
+    if args.kind == "dataset":
+        path = ocean.write_training_set(args.output, args.rows)
+        print(f"✅ {args.rows} lignes d'entraînement synthétiques écrites dans {path}.")
+    else:
+        path = ocean.write_netcdf(args.kind, args.output)
+        print(f"✅ Produit '{args.kind}' simulé ({args.days} jour(s), grille {ocean.shape[0]}×{ocean.shape[1]}) écrit dans {path}.")
+
+
+if __name__ == '__main__':
+    main()
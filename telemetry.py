@@ -0,0 +1,274 @@
+# telemetry.py
+# Instrumentation du pipeline : une ligne JSON par étape (span) dans le journal des runs, avec temps mur, temps CPU,
+# pic de mémoire (RSS), octets lus/écrits et attributs de l'étape (source, provenance réelle/simulée, fichier...).
+# Optionnel : un fichier texte Prometheus (collecteur textfile de node_exporter) résumant le dernier run, et le
+# profilage (cProfile ou pyinstrument) des étapes choisies. Sans configuration, les spans ne coûtent rien.
+import contextlib
+import cProfile
+import functools
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError: # Profilage pyinstrument optionnel (pip install pyinstrument) ; cProfile sinon
+    PyinstrumentProfiler = None
+
+RUN_LOG_PATH = os.getenv("THONIA_RUN_LOG", "data/logs/pipeline_runs.jsonl")
+PROMETHEUS_TEXTFILE = os.getenv("THONIA_PROMETHEUS_TEXTFILE")   # ex. /var/lib/node_exporter/textfile/thonia_pipeline.prom
+PROFILE_DIR = "data/logs/profiles"
+PROFILERS = ('cprofile', 'pyinstrument')
+METRIC_PREFIX = "thonia_pipeline"
+
+
+def _io_bytes() -> tuple[int, int] | None:
+    """Octets lus et écrits par le processus (tous threads, appels système read/write : fichiers et réseau). Linux uniquement."""
+    try:
+        with open("/proc/self/io", encoding="ascii") as f:
+            counters = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss_bytes() -> int:
+    """Pic de mémoire résidente du processus depuis son démarrage (ru_maxrss : Ko sous Linux, octets sous macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RunRecorder:
+    """
+    Enregistre les spans d'un run. Chaque span est écrit dans `log_path` à sa fin (une ligne JSON, en ajout :
+    les workers du backfill écrivent dans le même journal) avec :
+    - run_id, id, parent (span englobant, y compris depuis les threads de téléchargement via `bind`), pid, thread ;
+    - wall_s, cpu_s (CPU du processus, tous threads), thread_cpu_s (CPU du thread du span) ;
+    - peak_rss_mb (pic du processus à la fin du span) et peak_rss_growth_mb (hausse de ce pic pendant le span) ;
+    - io_read_bytes / io_write_bytes (octets lus/écrits par le processus pendant le span) ;
+    - status ('ok' ou 'error') et les attributs de l'étape.
+    Les étapes listées dans `profile_stages` sont profilées (cProfile ou pyinstrument) dans `profile_dir`.
+    """
+
+    def __init__(self, run_id: str | None = None, log_path: str = RUN_LOG_PATH, prometheus_path: str | None = PROMETHEUS_TEXTFILE,
+                 profile_stages=(), profiler: str = 'cprofile', profile_dir: str = PROFILE_DIR):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Profileur inconnu: {profiler} (attendu: {', '.join(PROFILERS)})")
+        if profiler == 'pyinstrument' and PyinstrumentProfiler is None:
+            print("⚠️ pyinstrument non installé (pip install pyinstrument) : profilage avec cProfile.")
+            profiler = 'cprofile'
+        self.run_id = run_id or f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.profile_stages = set(profile_stages)
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        # Un seul profileur actif à la fois par processus (cProfile refuse d'en superposer deux)
+        self._profile_lock = threading.Lock()
+
+    def settings(self) -> dict:
+        """Paramètres pour recréer ce recorder dans un worker (même run_id et même journal, sans Prometheus)."""
+        return {"run_id": self.run_id, "log_path": self.log_path, "prometheus_path": None,
+                "profile_stages": sorted(self.profile_stages), "profiler": self.profiler, "profile_dir": self.profile_dir}
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _start_profiler(self, name: str):
+        if name not in self.profile_stages or not self._profile_lock.acquire(blocking=False):
+            return None
+        try:
+            profiler = PyinstrumentProfiler() if self.profiler == 'pyinstrument' else cProfile.Profile()
+            if self.profiler == 'pyinstrument':
+                profiler.start()
+            else:
+                profiler.enable()
+            return profiler
+        except Exception as e:
+            self._profile_lock.release()
+            print(f"   ⚠️ Profilage de l'étape '{name}' impossible: {e}")
+            return None
+
+    def _stop_profiler(self, profiler, name: str, span_id: str) -> str:
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{self.run_id}_{name}_{span_id}")
+            if self.profiler == 'pyinstrument':
+                profiler.stop()
+                path += ".html"
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.disable()
+                path += ".prof"   # python -m pstats <fichier>, ou snakeviz
+                profiler.dump_stats(path)
+            return path
+        finally:
+            self._profile_lock.release()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """Mesure le bloc comme une étape `name`. Le dict renvoyé accepte des attributs ajoutés pendant l'étape."""
+        stack = self._stack()
+        record = {
+            "run_id": self.run_id, "span": name, "id": f"{os.getpid()}.{next(self._ids)}",
+            "parent": stack[-1]["id"] if stack else None, "pid": os.getpid(), "thread": threading.current_thread().name,
+            "start": datetime.now().isoformat(timespec="milliseconds"), **attrs,
+        }
+        stack.append(record)
+        io_before, peak_before = _io_bytes(), _peak_rss_bytes()
+        wall, cpu, thread_cpu = time.perf_counter(), time.process_time(), time.thread_time()
+        profiler = self._start_profiler(name)
+        record["status"] = "ok"
+        try:
+            yield record
+        except BaseException as e:
+            record.update(status="error", error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            record.update(
+                wall_s=round(time.perf_counter() - wall, 4),
+                cpu_s=round(time.process_time() - cpu, 4),
+                thread_cpu_s=round(time.thread_time() - thread_cpu, 4),
+            )
+            if profiler is not None:
+                try:
+                    record["profile"] = self._stop_profiler(profiler, name, record["id"])
+                except Exception as e:
+                    print(f"   ⚠️ Profil de l'étape '{name}' non enregistré: {e}")
+            peak = _peak_rss_bytes()
+            record.update(peak_rss_mb=round(peak / 1e6, 1), peak_rss_growth_mb=round((peak - peak_before) / 1e6, 1))
+            io_after = _io_bytes()
+            if io_before is not None and io_after is not None:
+                record.update(io_read_bytes=io_after[0] - io_before[0], io_write_bytes=io_after[1] - io_before[1])
+            stack.pop()
+            self.emit(record)
+
+    def bind(self, fn):
+        """`fn` exécutée dans un autre thread (pool de téléchargements) avec pour parent le span courant de ce thread."""
+        parents = list(self._stack())
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            self._local.stack = list(parents)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.stack = []
+        return wrapper
+
+    def emit(self, record: dict):
+        """Ajoute une ligne au journal (une seule écriture en mode ajout : les lignes des workers ne s'entremêlent pas)."""
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._write_lock:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def run_records(self) -> list[dict]:
+        """Spans de ce run relus dans le journal (ceux des workers du backfill compris)."""
+        records = []
+        if not os.path.exists(self.log_path):
+            return records
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                if self.run_id in line:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("run_id") == self.run_id:
+                        records.append(record)
+        return records
+
+    def write_prometheus(self) -> str | None:
+        """
+        Résumé du run au format texte Prometheus, écrit de façon atomique dans `prometheus_path` : par étape (et source)
+        la durée, le CPU, les octets lus/écrits et le nombre d'exécutions/erreurs ; le pic mémoire ; la provenance des sources.
+        """
+        if not self.prometheus_path:
+            return None
+        records = self.run_records()
+        stages = {}
+        for record in records:
+            labels = (("stage", record["span"]),) + ((("source", record["source"]),) if record.get("source") else ())
+            stage = stages.setdefault(labels, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "io_read_bytes": 0, "io_write_bytes": 0, "runs": 0, "errors": 0})
+            stage["wall_seconds"] += record.get("wall_s", 0.0)
+            stage["cpu_seconds"] += record.get("thread_cpu_s", 0.0)
+            stage["io_read_bytes"] += record.get("io_read_bytes", 0)
+            stage["io_write_bytes"] += record.get("io_write_bytes", 0)
+            stage["runs"] += 1
+            stage["errors"] += record.get("status") == "error"
+        provenance = {record["provenance"]: int(bool(record.get("real_data"))) for record in records if record.get("provenance")}
+        root = next((record for record in records if record.get("parent") is None and record["span"] == "run"), None)
+
+        def labels_text(labels):
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+            lines.extend(f"{METRIC_PREFIX}_{name}{labels_text(labels)} {value}" for labels, value in samples)
+
+        helps = {
+            "wall_seconds": "Durée cumulée de l'étape pendant le dernier run (s).",
+            "cpu_seconds": "Temps CPU cumulé des threads de l'étape pendant le dernier run (s).",
+            "io_read_bytes": "Octets lus par le processus pendant l'étape.",
+            "io_write_bytes": "Octets écrits par le processus pendant l'étape.",
+            "runs": "Nombre d'exécutions de l'étape pendant le dernier run.",
+            "errors": "Nombre d'exécutions de l'étape terminées en erreur.",
+        }
+        for field, help_text in helps.items():
+            metric(f"stage_{field}", help_text, [(labels, round(values[field], 4)) for labels, values in sorted(stages.items())])
+        metric("peak_rss_bytes", "Pic de mémoire résidente d'un processus du run.",
+               [((), int(max((record.get("peak_rss_mb", 0.0) for record in records), default=0.0) * 1e6))])
+        metric("source_real_data", "1 si la source a fourni des données réelles au dernier run, 0 si elles sont simulées.",
+               [((("provenance", key),), value) for key, value in sorted(provenance.items())])
+        metric("last_run_timestamp_seconds", "Fin du dernier run (horodatage Unix).", [((), round(time.time()))])
+        metric("last_run_success", "1 si le dernier run s'est terminé sans erreur.", [((), int(root is not None and root.get("status") == "ok"))])
+
+        os.makedirs(os.path.dirname(self.prometheus_path) or ".", exist_ok=True)
+        partial_path = f"{self.prometheus_path}.{os.getpid()}.part"
+        with open(partial_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(partial_path, self.prometheus_path)
+        return self.prometheus_path
+
+
+# Recorder du processus : None tant que `configure` n'a pas été appelée (les spans sont alors sans effet)
+_recorder = None
+
+
+def configure(**settings) -> RunRecorder:
+    global _recorder
+    _recorder = RunRecorder(**settings)
+    return _recorder
+
+
+def current() -> RunRecorder | None:
+    return _recorder
+
+
+def span(name: str, **attrs):
+    """Span du recorder du processus ; sans recorder, bloc non mesuré (le dict renvoyé est ignoré)."""
+    if _recorder is None:
+        return contextlib.nullcontext({})
+    return _recorder.span(name, **attrs)
+
+
+def bind(fn):
+    return fn if _recorder is None else _recorder.bind(fn)
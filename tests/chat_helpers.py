@@ -0,0 +1,33 @@
+# tests/chat_helpers.py
+import threading
+import time
+
+from chat_service import FakeLLM
+
+
+class BlockingLLM(FakeLLM):
+    """FakeLLM qui ne répond qu'une fois `gate` ouvert : simule un LLM lent, appel par appel."""
+
+    def __init__(self):
+        super().__init__(latency_s=0, token_delay_s=0)
+        self.gate = threading.Event()
+
+    def generate(self, prompt, timeout):
+        self.gate.wait()
+        return super().generate(prompt, timeout)
+
+    def stream(self, prompt, timeout):
+        self.gate.wait()
+        yield from super().stream(prompt, timeout)
+
+
+def eventually(check, timeout_s=2.0):
+    """Rappelle `check` jusqu'à ce qu'il ne lève plus (libérations faites par les threads du pool)."""
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            return check()
+        except Exception:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.01)
@@ -0,0 +1,28 @@
+# tests/conftest.py
+import importlib
+import os
+import sys
+
+import pytest
+
+# Les modules du projet sont à la racine du dépôt (scripts, pas de paquet installé).
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def thonia_app():
+    """3_app chargé avec le LLM factice, sur le modèle et la grille du dépôt (chemins relatifs à la racine)."""
+    previous_cwd = os.getcwd()
+    previous_backend = os.environ.get("THONIA_LLM_BACKEND")
+    os.environ["THONIA_LLM_BACKEND"] = "fake"
+    os.chdir(ROOT)
+    try:
+        yield importlib.import_module("3_app")
+    finally:
+        os.chdir(previous_cwd)
+        if previous_backend is None:
+            os.environ.pop("THONIA_LLM_BACKEND", None)
+        else:
+            os.environ["THONIA_LLM_BACKEND"] = previous_backend
@@ -0,0 +1,67 @@
+# tests/test_app_chat.py
+import json
+
+import pytest
+
+from chat_cache import ChatResponseCache
+from chat_helpers import BlockingLLM
+from chat_service import ChatService, FakeLLM
+
+
+@pytest.fixture
+def client(thonia_app, monkeypatch):
+    # Cache de réponses vide à chaque test : chaque question va jusqu'au LLM.
+    monkeypatch.setattr(thonia_app, "chat_cache", ChatResponseCache())
+    return thonia_app.app.test_client()
+
+
+@pytest.fixture
+def blocking_llm(thonia_app, monkeypatch):
+    """Chat saturé : un appel en cours et un en file, abandonnés après 50 ms mais jamais terminés."""
+    llm = BlockingLLM()
+    monkeypatch.setattr(thonia_app, "chat_service", ChatService(llm, max_concurrent=1, max_queue=1, timeout_s=0.05))
+    yield llm
+    llm.gate.set()
+
+
+def _sse_events(body):
+    events = []
+    for block in body.decode("utf-8").split("\n\n"):
+        if not block.strip():
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def test_chat_timeout_then_overloaded(client, blocking_llm):
+    for _ in range(2):
+        response = client.post("/api/chat", json={"message": "Où pêcher ?"})
+        assert response.status_code == 504
+    response = client.post("/api/chat", json={"message": "Où pêcher ?"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    response = client.post("/api/chat?stream=1", json={"message": "Où pêcher ?"})
+    assert response.status_code == 429
+
+
+def test_predictions_served_while_chat_saturated(client, blocking_llm):
+    for _ in range(2):
+        client.post("/api/chat", json={"message": "Où pêcher ?"})
+    assert client.post("/api/chat", json={"message": "Où pêcher ?"}).status_code == 429
+    response = client.get("/api/predictions")
+    assert response.status_code == 200
+    assert response.get_json()
+
+
+def test_chat_stream_sends_deltas_then_done(thonia_app, client, monkeypatch):
+    llm = FakeLLM(latency_s=0, token_delay_s=0)
+    monkeypatch.setattr(thonia_app, "chat_service", ChatService(llm, max_concurrent=1, max_queue=0, timeout_s=1))
+    response = client.post("/api/chat", json={"message": "Quelle marée ?"}, headers={"Accept": "text/event-stream"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = _sse_events(response.data)
+    assert events[-1] == ("done", {})
+    deltas = [data["delta"] for event, data in events[:-1]]
+    assert all(event == "message" for event, _ in events[:-1]) and len(deltas) > 1
+    assert "".join(deltas).strip() == llm._reply('Question de l\'utilisateur : "Quelle marée ?"\n')
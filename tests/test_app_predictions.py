@@ -0,0 +1,54 @@
+# tests/test_app_predictions.py
+import pytest
+
+
+@pytest.fixture
+def client(thonia_app):
+    return thonia_app.app.test_client()
+
+
+@pytest.mark.parametrize("query", [
+    "bbox=-1e308,-1e308,1e308,1e308",
+    "bbox=-5,43,200,46",
+    "bbox=nan,43,-1,46",
+    "near=90,0&radius_km=1e308",
+    "near=1e308,1e308&radius_km=1",
+    "near=45,-3&radius_km=inf",
+    "near=45,-3&radius_km=0",
+    "near=45,-200",
+])
+def test_predictions_rejects_out_of_range_coordinates(client, query):
+    response = client.get(f"/api/predictions?{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_predictions_accepts_whole_globe(client):
+    everything = client.get("/api/predictions?format=columnar").get_json()
+    response = client.get("/api/predictions?format=columnar&bbox=-180,-90,180,90")
+    assert response.status_code == 200
+    assert len(response.get_json()["score"]) == len(everything["score"])
+    response = client.get("/api/predictions?format=columnar&near=90,0&radius_km=20015")
+    assert response.status_code == 200
+
+
+def test_predictions_gzip_follows_accept_encoding_quality(client):
+    identity = client.get("/api/predictions", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "Content-Encoding" not in identity.headers
+    compressed = client.get("/api/predictions", headers={"Accept-Encoding": "br, gzip;q=0.5"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+
+
+def test_predictions_etag_differs_per_encoding(client):
+    identity = client.get("/api/predictions")
+    compressed = client.get("/api/predictions", headers={"Accept-Encoding": "gzip"})
+    identity_etag, compressed_etag = identity.get_etag()[0], compressed.get_etag()[0]
+    assert compressed_etag == f"{identity_etag}-gz"
+    assert not identity.get_etag()[1] and not compressed.get_etag()[1]
+
+    assert client.get("/api/predictions", headers={"If-None-Match": f'"{identity_etag}"'}).status_code == 304
+    assert client.get("/api/predictions", headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{compressed_etag}"'}).status_code == 304
+    # L'ETag d'une représentation ne valide pas l'autre
+    assert client.get("/api/predictions", headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{identity_etag}"'}).status_code == 200
+    assert client.get("/api/predictions", headers={"If-None-Match": f'"{compressed_etag}"'}).status_code == 200
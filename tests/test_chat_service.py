@@ -0,0 +1,58 @@
+# tests/test_chat_service.py
+import pytest
+
+from chat_helpers import BlockingLLM, eventually
+from chat_service import ChatOverloaded, ChatService, ChatTimeout, FakeLLM
+
+
+def test_ask_returns_llm_reply():
+    service = ChatService(FakeLLM(latency_s=0), max_concurrent=1, max_queue=0, timeout_s=1)
+    assert "Réponse de test" in service.ask("Question de l'utilisateur : bonjour\n")
+
+
+def test_ask_times_out():
+    llm = BlockingLLM()
+    service = ChatService(llm, max_concurrent=1, max_queue=0, timeout_s=0.05)
+    try:
+        with pytest.raises(ChatTimeout):
+            service.ask("question")
+    finally:
+        llm.gate.set()
+
+
+def test_rejects_once_concurrent_and_queue_are_full():
+    llm = BlockingLLM()
+    service = ChatService(llm, max_concurrent=1, max_queue=1, timeout_s=0.05)
+    try:
+        # Un appel en cours et un en file : abandonnés par l'appelant, ils gardent leur place.
+        for _ in range(2):
+            with pytest.raises(ChatTimeout):
+                service.ask("question")
+        with pytest.raises(ChatOverloaded):
+            service.ask("question")
+        with pytest.raises(ChatOverloaded):
+            service.stream("question")
+    finally:
+        llm.gate.set()
+
+
+def test_slot_released_after_abandoned_call():
+    llm = BlockingLLM()
+    service = ChatService(llm, max_concurrent=1, max_queue=0, timeout_s=0.05)
+    with pytest.raises(ChatTimeout):
+        service.ask("question")
+    with pytest.raises(ChatOverloaded):
+        service.ask("question")
+    # La place est rendue quand l'appel abandonné se termine réellement.
+    llm.gate.set()
+    service.timeout_s = 1
+    assert "Réponse de test" in eventually(lambda: service.ask("Question de l'utilisateur : encore\n"))
+
+
+def test_stream_yields_whole_reply():
+    llm = FakeLLM(latency_s=0, token_delay_s=0)
+    service = ChatService(llm, max_concurrent=1, max_queue=0, timeout_s=1)
+    prompt = "Question de l'utilisateur : marée\n"
+    assert "".join(service.stream(prompt)).strip() == llm._reply(prompt)
+    # Le flux consommé jusqu'au bout a rendu sa place.
+    assert eventually(lambda: "".join(service.stream(prompt))).strip() == llm._reply(prompt)
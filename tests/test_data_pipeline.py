@@ -0,0 +1,77 @@
+# tests/test_data_pipeline.py
+from datetime import datetime
+
+import pandas as pd
+
+import context_digest
+import data_pipeline
+import grid_store
+import static_features
+
+
+def _write_day(output_dir, day):
+    date = datetime.strptime(day, "%Y-%m-%d")
+    path = data_pipeline.daily_output_path(date, output_dir=str(output_dir))
+    context_digest.write_digest(context_digest.digest_path(path), {"date": day})
+    return grid_store.write_table(pd.DataFrame({"cell_id": [0, 1], "temp_surface_c": [15.0, 16.0]}), path, metadata={"date": day})
+
+
+def test_publish_daily_output_keeps_newest_day(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_pipeline, "SERVED_OUTPUT_STEM", str(tmp_path / "daily_data"))
+    served_path = data_pipeline.publish_daily_output(_write_day(tmp_path, "2024-06-02"))
+    assert served_path == str(tmp_path / "daily_data") + grid_store.ARROW_EXTENSION
+    assert grid_store.read_metadata(served_path)["date"] == "2024-06-02"
+    assert context_digest.read_digest(context_digest.digest_path(served_path))["date"] == "2024-06-02"
+
+    # Backfill d'un jour plus ancien : la grille servie ne recule pas
+    assert data_pipeline.publish_daily_output(_write_day(tmp_path, "2024-05-30")) is None
+    assert grid_store.read_metadata(served_path)["date"] == "2024-06-02"
+
+    data_pipeline.publish_daily_output(_write_day(tmp_path, "2024-06-03"))
+    assert grid_store.read_metadata(served_path)["date"] == "2024-06-03"
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_static_features_joined_back_by_cell_id(tmp_path, monkeypatch):
+    grid_df = pd.DataFrame({"latitude": [44.0, 44.0, 44.1], "longitude": [-3.0, -2.9, -3.0], "bathymetry_m": [-150.0, -800.0, -20.0]})
+    grid_df.attrs['bathymetry_source'] = 'emodnet'
+    static_df = static_features.load_static_features("key", 0.1, lambda: grid_df, store_dir=str(tmp_path))
+    store = static_df.attrs['thonia']["store_path"]
+    assert store == static_features.store_path("key", 0.1, str(tmp_path))
+
+    daily_df = pd.DataFrame({"cell_id": [2, 0], "temp_surface_c": [15.0, 16.0]})
+    daily_df.attrs['thonia'] = {"static_features": store}
+    joined = static_features.attach_static_features(daily_df)
+    assert joined['bathymetry_m'].tolist() == [-20.0, -150.0]
+    assert set(static_features.STATIC_COLUMNS) <= set(joined.columns)
+
+
+def test_simulated_bathymetry_is_written_with_each_grid(tmp_path):
+    grid_df = pd.DataFrame({"latitude": [44.0, 44.1], "longitude": [-3.0, -3.0], "bathymetry_m": [-150.0, -20.0]})
+    grid_df.attrs['bathymetry_source'] = 'simulated'
+    static_df = static_features.load_static_features("key", 0.1, lambda: grid_df, store_dir=str(tmp_path))
+    # Aucun store écrit : la provenance ne doit pas en référencer, et les colonnes statiques restent dans la grille
+    assert "store_path" not in static_df.attrs['thonia']
+    assert not list(tmp_path.iterdir())
+    assert set(static_features.STATIC_COLUMNS) <= set(data_pipeline.grid_columns(static_df))
+
+
+def test_run_pipeline_isolates_failed_days_without_workers(tmp_path, monkeypatch, capsys):
+    def process_day(day, static_grid_df, export_csv=False):
+        if day.day == 2:
+            raise ValueError("source indisponible")
+        return _write_day(tmp_path, day.strftime("%Y-%m-%d"))
+
+    monkeypatch.setattr(data_pipeline, "build_static_grid", pd.DataFrame)
+    monkeypatch.setattr(data_pipeline, "daily_output_exists", lambda day: False)
+    monkeypatch.setattr(data_pipeline, "process_day", process_day)
+    monkeypatch.setattr(data_pipeline, "SERVED_OUTPUT_STEM", str(tmp_path / "daily_data"))
+    outputs, failures = data_pipeline.run_pipeline(datetime(2024, 6, 1), datetime(2024, 6, 3), workers=1)
+
+    assert [day.day for day in failures] == [2]
+    assert len(outputs) == 2
+    out = capsys.readouterr().out
+    assert "[backfill 3/3] 2024-06-03 ✅" in out
+    assert "[backfill 2/3] 2024-06-02 ❌ (ValueError: source indisponible)" in out
+    assert "1 jour(s) en échec: 2024-06-02" in out
+    assert grid_store.read_metadata(str(tmp_path / "daily_data") + grid_store.ARROW_EXTENSION)["date"] == "2024-06-03"
@@ -0,0 +1,25 @@
+# tests/test_spatial_index.py
+import numpy as np
+
+from grid_raster import GridRaster
+from spatial_index import SpatialIndex
+
+
+def _index():
+    lats, lons = np.meshgrid(np.arange(43.5, 46.0, 0.5), np.arange(-5.0, -1.0, 0.5), indexing="ij")
+    lats, lons = lats.ravel(), lons.ravel()
+    scores = np.linspace(0, 1, len(lats))
+    return SpatialIndex(GridRaster(lats, lons, scores), lats, lons, scores)
+
+
+def test_in_bbox_clamps_huge_bounds():
+    index = _index()
+    assert np.array_equal(index.in_bbox(-1e308, 1e308, -1e308, 1e308), np.arange(len(index.lats)))
+    assert len(index.in_bbox(1e308, 1e308, 0, 1)) == 0
+    assert len(index.in_bbox(-1e308, -1e308, -5, -1)) == 0
+
+
+def test_near_pole_with_huge_radius():
+    index = _index()
+    assert np.array_equal(np.sort(index.near(90.0, 0.0, 20015.0)), np.arange(len(index.lats)))
+    assert len(index.near(45.0, -3.0, 1.0)) == 1
@@ -0,0 +1,126 @@
+# variables.py
+import re
+
+import numpy as np
+import pandas as pd
+
+# Registre des variables de la grille : unités attendues, plage de valeurs plausibles et
+# conversions acceptées (unité source normalisée -> (facteur, décalage) vers l'unité attendue).
+# L'ordre fixe aussi le bit de chaque variable dans la colonne `qc_flags`.
+_CELSIUS = {"degc": (1.0, 0.0), "celsius": (1.0, 0.0), "degree celsius": (1.0, 0.0), "degrees celsius": (1.0, 0.0), "c": (1.0, 0.0), "°c": (1.0, 0.0),
+            "k": (1.0, -273.15), "kelvin": (1.0, -273.15), "degk": (1.0, -273.15), "degree kelvin": (1.0, -273.15), "degrees kelvin": (1.0, -273.15)}
+_SPEED = {"m s-1": (1.0, 0.0), "m/s": (1.0, 0.0), "ms-1": (1.0, 0.0), "meter second-1": (1.0, 0.0), "cm s-1": (0.01, 0.0), "cm/s": (0.01, 0.0)}
+_KNOTS = {"knots": (1.0, 0.0), "knot": (1.0, 0.0), "kt": (1.0, 0.0), "kn": (1.0, 0.0), "noeuds": (1.0, 0.0),
+          "m s-1": (1.943844, 0.0), "m/s": (1.943844, 0.0), "ms-1": (1.943844, 0.0), "km h-1": (0.539957, 0.0), "km/h": (0.539957, 0.0)}
+
+VARIABLES = {
+    'temp_surface_c': {"units": "degC", "valid_range": (-2.0, 35.0), "conversions": _CELSIUS},
+    'chlorophylle_mg_m3': {"units": "mg m-3", "valid_range": (0.0, 100.0), "conversions": {
+        "mg m-3": (1.0, 0.0), "mg/m3": (1.0, 0.0), "milligram m-3": (1.0, 0.0), "mgm-3": (1.0, 0.0),
+        "ug l-1": (1.0, 0.0), "ug/l": (1.0, 0.0), "µg l-1": (1.0, 0.0), "µg/l": (1.0, 0.0), "kg m-3": (1e6, 0.0)}},
+    'eastward_current_m_s': {"units": "m s-1", "valid_range": (-5.0, 5.0), "conversions": _SPEED},
+    'northward_current_m_s': {"units": "m s-1", "valid_range": (-5.0, 5.0), "conversions": _SPEED},
+    'vent_noeuds': {"units": "knots", "valid_range": (0.0, 150.0), "conversions": _KNOTS},
+    'wave_height_m': {"units": "m", "valid_range": (0.0, 30.0), "conversions": {"m": (1.0, 0.0), "meter": (1.0, 0.0), "metre": (1.0, 0.0), "meters": (1.0, 0.0), "cm": (0.01, 0.0)}},
+    'wave_direction_deg': {"units": "degree", "valid_range": (0.0, 360.0), "conversions": {"degree": (1.0, 0.0), "degrees": (1.0, 0.0), "deg": (1.0, 0.0), "degree true": (1.0, 0.0)}},
+    'wave_period_s': {"units": "s", "valid_range": (0.0, 30.0), "conversions": {"s": (1.0, 0.0), "second": (1.0, 0.0), "seconds": (1.0, 0.0), "sec": (1.0, 0.0)}},
+}
+QC_FLAGS_COLUMN = 'qc_flags'
+QC_BITS = {name: 1 << i for i, name in enumerate(VARIABLES)}
+PLAUSIBILITY_SAMPLE = 10000  # Nombre de valeurs utilisées pour vérifier une conversion
+
+
+def normalize_units(units: str | None) -> str:
+    """'degree_Celsius' -> 'degree celsius', 'm.s-1' -> 'm s-1', 'm s**-1' -> 'm s-1'."""
+    units = (units or "").strip().lower().replace("**", "").replace("^", "")
+    return " ".join(re.sub(r"[_.]", " ", units).split())
+
+
+def _in_range_fraction(values: np.ndarray, conversion: tuple, valid_range: tuple) -> float:
+    scale, offset = conversion
+    converted = values * scale + offset
+    return float(((converted >= valid_range[0]) & (converted <= valid_range[1])).mean())
+
+
+def resolve_conversion(name: str, units: str | None, values: np.ndarray) -> tuple[float, float]:
+    """
+    (facteur, décalage) à appliquer à la colonne `name` dont les valeurs sources sont en `units`.
+    `units=None` : valeurs déjà dans l'unité attendue (simulations du pipeline).
+    Les unités déclarées sont vérifiées sur un échantillon : si elles donnent des valeurs implausibles
+    alors qu'une autre conversion connue donne des valeurs plausibles (attribut absent, faux ou
+    non reconnu), c'est cette dernière qui est retenue.
+    """
+    spec = VARIABLES[name]
+    identity = (1.0, 0.0)
+    if units is None:
+        return identity
+    values = values[np.isfinite(values)]
+    if len(values) > PLAUSIBILITY_SAMPLE:
+        values = values[np.linspace(0, len(values) - 1, PLAUSIBILITY_SAMPLE).astype(np.int64)]
+    declared = spec["conversions"].get(normalize_units(units))
+    if len(values) == 0:
+        return declared or identity
+    if declared is not None and _in_range_fraction(values, declared, spec["valid_range"]) >= 0.5:
+        return declared
+
+    candidates = list(dict.fromkeys([identity] + list(spec["conversions"].values())))
+    scores = [_in_range_fraction(values, conversion, spec["valid_range"]) for conversion in candidates]
+    best = candidates[int(np.argmax(scores))]
+    if max(scores) < 0.9:
+        # Aucune conversion ne rend les données plausibles : on garde l'unité déclarée, les valeurs seront masquées.
+        return declared or identity
+    if best == identity and not normalize_units(units):
+        return best  # Attribut absent mais valeurs déjà plausibles
+    print(f"   ⚠️ [{name}] Unités '{units}' {'incohérentes avec les valeurs' if declared else 'non reconnues'} ; "
+          f"conversion retenue d'après les valeurs : x{best[0]:g} {best[1]:+g} -> {spec['units']}.")
+    return best
+
+
+def normalize_grid(grid_df: pd.DataFrame, source_units: dict | None = None) -> pd.DataFrame:
+    """
+    Convertit et valide toutes les variables du registre présentes dans `grid_df` en une passe vectorisée.
+    `source_units` : {colonne: unités du fichier source} ; une colonne absente est supposée déjà dans
+    l'unité attendue. Les valeurs hors plage deviennent NaN et sont signalées dans `qc_flags` (un bit par variable).
+    Modifie et retourne `grid_df`.
+    """
+    source_units = source_units or {}
+    names = [name for name in VARIABLES if name in grid_df.columns]
+    if not names:
+        return grid_df
+    values = np.column_stack([grid_df[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in names])
+    conversions = np.array([resolve_conversion(name, source_units.get(name), values[:, i]) for i, name in enumerate(names)])
+    low = np.array([VARIABLES[name]["valid_range"][0] for name in names])
+    high = np.array([VARIABLES[name]["valid_range"][1] for name in names])
+    bits = np.array([QC_BITS[name] for name in names], dtype=np.int32)
+
+    values = values * conversions[:, 0] + conversions[:, 1]
+    out_of_range = np.isfinite(values) & ((values < low) | (values > high))
+    values[out_of_range] = np.nan
+    flags = (out_of_range * bits).sum(axis=1).astype(np.int32)
+    if QC_FLAGS_COLUMN in grid_df.columns:
+        flags |= grid_df[QC_FLAGS_COLUMN].to_numpy(dtype=np.int32)
+
+    for i, name in enumerate(names):
+        grid_df[name] = values[:, i]
+        if out_of_range[:, i].any():
+            print(f"   ⚠️ [{name}] {int(out_of_range[:, i].sum())} valeur(s) hors de la plage {VARIABLES[name]['valid_range']} masquée(s).")
+    grid_df[QC_FLAGS_COLUMN] = flags
+    return grid_df
+
+
+def valid_rows(df: pd.DataFrame, features: list[str]) -> np.ndarray:
+    """
+    Masque des lignes utilisables par le modèle : toutes les `features` présentes, finies, dans leur plage
+    et non signalées dans `qc_flags`. Fonctionne aussi sur les anciens fichiers sans `qc_flags`.
+    """
+    valid = np.ones(len(df), dtype=bool)
+    for name in features:
+        values = df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid &= np.isfinite(values)
+        if name in VARIABLES:
+            low, high = VARIABLES[name]["valid_range"]
+            valid &= (values >= low) & (values <= high)
+    if QC_FLAGS_COLUMN in df.columns:
+        feature_bits = sum(QC_BITS[name] for name in features if name in QC_BITS)
+        valid &= (df[QC_FLAGS_COLUMN].to_numpy(dtype=np.int64) & feature_bits) == 0
+    return valid
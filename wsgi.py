@@ -0,0 +1,8 @@
+# wsgi.py
+# Point d'entrée WSGI de production. '3_app' n'est pas un nom de module importable avec
+# 'import', d'où importlib. Le modèle et la grille du jour sont chargés à l'import :
+# avec gunicorn --preload (voir gunicorn.conf.py), une seule fois avant le fork des workers.
+import importlib
+
+thonia_app = importlib.import_module("3_app")
+app = thonia_app.app